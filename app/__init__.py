@@ -1,21 +1,16 @@
 import os
-from flask import Flask, render_template, request, session, redirect
+from flask import Flask, request, redirect
 from flask_cors import CORS
-from flask_migrate import Migrate
-from flask_wtf.csrf import CSRFProtect, generate_csrf
+from flask_wtf.csrf import generate_csrf
 from flask_login import LoginManager
 from .models import db, User
-from .api.user_routes import user_routes
-from .api.auth_routes import auth_routes
-from .api.trail_routes import trail_routes
-from .api.review_routes import review_routes
-from .seeds import seed_commands
+from .models.fields import InvalidFields
 from .config import Config
-
-app = Flask(__name__, static_folder='../react-vite/dist', static_url_path='/')
+from .compression import register_compression, send_static_asset
+from .idempotency import register_idempotency
 
 # Setup login manager
-login = LoginManager(app)
+login = LoginManager()
 login.login_view = 'auth.unauthorized'
 
 
@@ -24,72 +19,144 @@ def load_user(id):
     return User.query.get(int(id))
 
 
-# Tell flask about our seed commands
-app.cli.add_command(seed_commands)
-
-app.config.from_object(Config)
-app.register_blueprint(user_routes, url_prefix='/api/users')
-app.register_blueprint(auth_routes, url_prefix='/api/auth')
-app.register_blueprint(trail_routes, url_prefix='/api/trails')
-app.register_blueprint(review_routes, url_prefix='/api')
-db.init_app(app)
-Migrate(app, db)
-
-# Application Security
-CORS(app)
-
-
-# Since we are deploying with Docker and Flask,
-# we won't be using a buildpack when we deploy to Heroku.
-# Therefore, we need to make sure that in production any
-# request made over http is redirected to https.
-# Well.........
-@app.before_request
-def https_redirect():
-    if os.environ.get('FLASK_ENV') == 'production':
-        if request.headers.get('X-Forwarded-Proto') == 'http':
-            url = request.url.replace('http://', 'https://', 1)
-            code = 301
-            return redirect(url, code=code)
-
-
-@app.after_request
-def inject_csrf_token(response):
-    response.set_cookie(
-        'csrf_token',
-        generate_csrf(),
-        secure=True if os.environ.get('FLASK_ENV') == 'production' else False,
-        samesite='Strict' if os.environ.get(
-            'FLASK_ENV') == 'production' else None,
-        httponly=True)
-    return response
-
-
-@app.route("/api/docs")
-def api_help():
+def create_app(config_object=Config):
+    app = Flask(__name__, static_folder='../react-vite/dist', static_url_path='/')
+    app.config.from_object(config_object)
+
+    from .api.user_routes import user_routes
+    from .api.auth_routes import auth_routes
+    from .api.trail_routes import trail_routes
+    from .api.review_routes import review_routes
+    from .api.route_routes import route_routes
+    from .api.region_routes import region_routes
+    from .api.sync_routes import sync_routes
+    from .seeds import seed_commands
+    from .bench import bench_commands
+    from .commands import review_commands, stats_commands, forecast_commands, trail_commands, asset_commands
+
+    login.init_app(app)
+
+    # Tell flask about our seed, benchmark and maintenance commands
+    app.cli.add_command(seed_commands)
+    app.cli.add_command(bench_commands)
+    app.cli.add_command(review_commands)
+    app.cli.add_command(stats_commands)
+    app.cli.add_command(forecast_commands)
+    app.cli.add_command(trail_commands)
+    app.cli.add_command(asset_commands)
+
+    app.register_blueprint(user_routes, url_prefix='/api/users')
+    app.register_blueprint(auth_routes, url_prefix='/api/auth')
+    app.register_blueprint(trail_routes, url_prefix='/api/trails')
+    app.register_blueprint(review_routes, url_prefix='/api')
+    app.register_blueprint(route_routes, url_prefix='/api/routes')
+    app.register_blueprint(region_routes, url_prefix='/api/regions')
+    app.register_blueprint(sync_routes, url_prefix='/api/sync')
+    db.init_app(app)
+
+    # Migrations only ever run through `flask db ...`, so web workers skip
+    # importing alembic
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    # Application Security
+    CORS(app)
+
+    from .bench.traffic import register_traffic_log
+    register_traffic_log(app)
+    register_compression(app)
+
+    register_handlers(app)
+    # After compression, so responses are recorded before they are encoded,
+    # and after the https redirect, so a redirected write claims no key
+    register_idempotency(app)
+    warm_up(app)
+    return app
+
+
+def register_handlers(app):
+
+    # Since we are deploying with Docker and Flask,
+    # we won't be using a buildpack when we deploy to Heroku.
+    # Therefore, we need to make sure that in production any
+    # request made over http is redirected to https.
+    # Well.........
+    @app.before_request
+    def https_redirect():
+        if os.environ.get('FLASK_ENV') == 'production':
+            if request.headers.get('X-Forwarded-Proto') == 'http':
+                url = request.url.replace('http://', 'https://', 1)
+                code = 301
+                return redirect(url, code=code)
+
+    @app.after_request
+    def inject_csrf_token(response):
+        response.set_cookie(
+            'csrf_token',
+            generate_csrf(),
+            secure=True if os.environ.get('FLASK_ENV') == 'production' else False,
+            samesite='Strict' if os.environ.get(
+                'FLASK_ENV') == 'production' else None,
+            httponly=True)
+        return response
+
+    @app.route("/api/docs")
+    def api_help():
+        """
+        Returns all API routes and their doc strings
+        """
+        acceptable_methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+        route_list = { rule.rule: [[ method for method in rule.methods if method in acceptable_methods ],
+                        app.view_functions[rule.endpoint].__doc__ ]
+                        for rule in app.url_map.iter_rules() if rule.endpoint != 'static' }
+        return route_list
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def react_root(path):
+        """
+        This route will direct to the public directory in our
+        react builds in the production environment for favicon
+        or index.html requests
+        """
+        if path == 'favicon.ico':
+            return app.send_from_directory('public', 'favicon.ico')
+        return send_static_asset(app, 'index.html')
+
+    @app.errorhandler(InvalidFields)
+    def invalid_fields(e):
+        return {'message': 'Validation error', 'errors': {e.param: str(e)}}, 400
+
+    @app.errorhandler(404)
+    def not_found(e):
+        return send_static_asset(app, 'index.html')
+
+
+def warm_up(app):
     """
-    Returns all API routes and their doc strings
+    Do the one-off work a first request would otherwise pay for, so that
+    with gunicorn's preload_app it happens once in the master and the
+    forked workers share it
     """
-    acceptable_methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
-    route_list = { rule.rule: [[ method for method in rule.methods if method in acceptable_methods ],
-                    app.view_functions[rule.endpoint].__doc__ ]
-                    for rule in app.url_map.iter_rules() if rule.endpoint != 'static' }
-    return route_list
+    from sqlalchemy.orm import configure_mappers
+
+    configure_mappers()
+    app.url_map.update()
 
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def react_root(path):
+def reset_after_fork(app):
     """
-    This route will direct to the public directory in our
-    react builds in the production environment for favicon
-    or index.html requests
+    Drop what a forked worker must not share with its parent: pooled
+    database connections, the background job threads and the trail
+    event listeners and poller
     """
-    if path == 'favicon.ico':
-        return app.send_from_directory('public', 'favicon.ico')
-    return app.send_static_file('index.html')
-
-
-@app.errorhandler(404)
-def not_found(e):
-    return app.send_static_file('index.html')
+    from .services.jobs import jobs
+    from .services.trail_events import broker
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the parent's sockets alone
+            engine.dispose(close=False)
+    jobs.reset()
+    broker.reset()
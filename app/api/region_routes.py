@@ -0,0 +1,33 @@
+from flask import Blueprint, send_file
+from app.services import region_packs
+
+region_routes = Blueprint('regions', __name__)
+
+
+# Download the offline pack of a region: trails, simplified geometries and
+# recent reviews as one gzip'd JSON file. Supports Range/If-Range so an
+# interrupted download can resume, the ETag is the hash of the pack
+@region_routes.route('/<region>/pack')
+def get_region_pack(region):
+
+    manifest, stale = region_packs.get_pack(region)
+    if manifest is None:
+        return {'message': 'Region not found'}, 404
+
+    try:
+        response = send_file(
+            manifest['path'],
+            mimetype='application/gzip',
+            as_attachment=True,
+            download_name=f"{region_packs.region_slug(region)}.trailpack.json.gz",
+            conditional=True,
+            etag=manifest['etag'],
+            max_age=0
+        )
+    except FileNotFoundError:
+        # Replaced by a rebuild in another worker between lookup and open
+        return get_region_pack(region)
+
+    response.headers['X-Pack-Generated-At'] = manifest['generated_at']
+    response.headers['X-Pack-Stale'] = 'true' if stale else 'false'
+    return response
@@ -1,65 +1,229 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
-from app.models import db, Trail, Review
-from datetime import datetime
+from app.models import db, Trail, Review, ReviewVote, TrackVerification, TrailConditionRollup, ChangeLog, UserStats, get_many
+from app.api.utils import parse_ids
+from datetime import date, datetime, timedelta
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Load
+from app.services import region_packs, trail_events, trail_clusters, trail_query_cache
+from app.services.jobs import jobs, JobQueueFull
+from app.services.review_ingest import ingest_reviews
+from app.services.condition_forecast import forecast_days
+from app.services.track_verification import verify_track
+import os
+import uuid
 
 review_routes = Blueprint('reviews', __name__)
 
+# Supported ?sort= values for trail reviews. Each ordering (with its
+# created_at tie-breaker) matches a composite index on reviews so the
+# filtered listing is read in index order without a separate sort step.
+REVIEW_SORTS = {
+    'newest': (Review.created_at.desc(),),
+    'oldest': (Review.created_at.asc(),),
+    'highest': (Review.rating.desc(), Review.created_at.desc()),
+    'lowest': (Review.rating.asc(), Review.created_at.asc()),
+    'helpful': (Review.helpful_count.desc(), Review.created_at.desc())
+}
+
+
+# Keep per-region derived data in step with a committed review write and
+# tell the trail's event listeners (the review is gone when deleted)
+def _after_review_write(trail_id, change=None, review=None):
+    region_packs.index_review(trail_id)
+    trail_query_cache.index_review(trail_id)
+    if trail_clusters.trail_cluster_index.is_built:
+        # The trail's rating moved its clusters' averages
+        trail_clusters.index_trail(db.session.get(Trail, trail_id))
+    if change == trail_events.REVIEW_DELETED:
+        trail_events.review_deleted(trail_id, review.id)
+    elif change:
+        trail_events.review_changed(change, review)
+    trail_events.trail_changed(trail_id)
+
+
+def trail_reviews_query(trail_id, sort='newest'):
+    query = Review.query.filter_by(trail_id=trail_id)
+    if sort in REVIEW_SORTS:
+        query = query.order_by(*REVIEW_SORTS[sort])
+    return query
+
+
+USER_REVIEW_ORDER = (Review.created_at.desc(),)
+
+
+def user_reviews_query(user_id):
+    return Review.query.filter_by(user_id=user_id).order_by(*USER_REVIEW_ORDER)
+
+
+def review_page_ids(query, ordering, page, per_page):
+    """
+    The ids of one page of a review listing query, sorted by `ordering`:
+    a plain ORDER BY ... LIMIT/OFFSET its composite index answers by
+    reading only the rows up to the page (see `flask bench explain`)
+    """
+    return query.order_by(None).order_by(*ordering)\
+        .with_entities(Review.id.label('id'))\
+        .limit(per_page).offset((page - 1) * per_page)
+
+
+def review_page(query, ordering, page, per_page, fields, parent=None):
+    """
+    One page of a review listing query (sorted by `ordering`) and its total.
+
+    The page's ids (review_page_ids) are joined to the reviews with author
+    and trail loaded, so the page is a single statement. `parent` is
+    (model, id, load options) of the row a listing belongs to (the trail of
+    a trail listing). The page is left-joined onto it, so checking that the
+    parent exists costs no extra query.
+
+    Returns (parent, reviews, total), parent is None when not found. The
+    total is counted separately (an index-only count over the listing's
+    filter), unless the first page shows every review.
+    """
+    page = max(page, 1)
+    per_page = per_page if per_page > 0 else 20
+    ordering = ordering or (Review.id,)
+
+    page_ids = review_page_ids(query, ordering, page, per_page).subquery()
+
+    if parent is None:
+        rows = db.session.query(Review).join(page_ids, Review.id == page_ids.c.id)
+    else:
+        model, parent_id, parent_options = parent
+        rows = db.session.query(model, Review).select_from(model)\
+            .outerjoin(page_ids, db.true())\
+            .outerjoin(Review, Review.id == page_ids.c.id)\
+            .filter(model.id == parent_id)\
+            .options(*parent_options)
+    # Re-sorts only the page's rows, the id settles ties within it
+    rows = rows.options(*Review.load_options(fields, joined=True)).order_by(*ordering, Review.id).all()
+
+    if parent is not None:
+        if not rows:
+            return None, [], 0
+        parent_row = rows[0][0]
+        reviews = [row[1] for row in rows if row[1] is not None]
+    else:
+        parent_row = None
+        reviews = rows
+
+    if page == 1 and len(reviews) < per_page:
+        total = len(reviews)
+    else:
+        total = query.order_by(None).with_entities(db.func.count()).scalar()
+    return parent_row, reviews, total
+
+
+def pagination(page, per_page, total):
+    page = max(page, 1)
+    per_page = per_page if per_page > 0 else 20
+    return {
+        'page': page,
+        'pages': -(-total // per_page),
+        'per_page': per_page,
+        'total': total
+    }
+
 # Get all reviews for a specific trail
 @review_routes.route('/trails/<int:trail_id>/reviews')
 def get_trail_reviews(trail_id):
 
-    trail = Trail.query.get(trail_id)
-
-    if not trail:
-        return {'message': 'Trail not found'}, 404
-
     # This is to get query parameters
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
     sort = request.args.get('sort', 'newest')
+    fields = Review.parse_fields(request.args.get('fields'))
 
-    # Build query
-    query = Review.query.filter_by(trail_id=trail_id)
-
-    # Then, apply sorting
-    if sort == 'newest':
-        query = query.order_by(Review.created_at.desc())
-    elif sort == 'oldest':
-        query = query.order_by(Review.created_at.asc())
-    elif sort == 'highest':
-        query = query.order_by(Review.rating.desc())
-    elif sort == 'lowest':
-        query = query.order_by(Review.rating.asc())
+    # The trail, the page of reviews with authors and the total in one query
+    trail, reviews, total = review_page(
+        trail_reviews_query(trail_id, sort), REVIEW_SORTS.get(sort), page, limit, fields,
+        parent=(Trail, trail_id, [Load(Trail).load_only(Trail.id, Trail.name)])
+    )
 
-    # Paginate
-    reviews = query.paginate(page=page, per_page=limit, error_out=False)
+    if not trail:
+        return {'message': 'Trail not found'}, 404
 
     return {
-        'reviews': [review.to_dict() for review in reviews.items],
+        'reviews': [review.to_dict(fields) for review in reviews],
         'trail': {
             'id': trail.id,
             'name': trail.name
         },
-        'pagination': {
-            'page': reviews.page,
-            'pages': reviews.pages,
-            'per_page': reviews.per_page,
-            'total': reviews.total
-        }
+        'pagination': pagination(page, limit, total)
+    }
+
+# Get recent weather, trail and crowd conditions reported for a trail
+@review_routes.route('/trails/<int:trail_id>/conditions')
+def get_trail_conditions(trail_id):
+
+    trail = Trail.query.get(trail_id)
+
+    if not trail:
+        return {'message': 'Trail not found'}, 404
+
+    days = request.args.get('days', 30, type=int)
+    half_life = request.args.get('half_life', 7, type=float)
+
+    if days < 1 or days > 365:
+        return {'message': 'days must be between 1 and 365'}, 400
+    if half_life <= 0:
+        return {'message': 'half_life must be a positive number'}, 400
+
+    return TrailConditionRollup.summarize(trail_id, window_days=days, half_life_days=half_life)
+
+# Get the likely weather, trail and crowd conditions of a trail for the
+# coming days, from its trained seasonal forecast (flask forecast train)
+@review_routes.route('/trails/<int:trail_id>/forecast')
+def get_trail_forecast(trail_id):
+
+    days = request.args.get('days', 7, type=int)
+    if days < 1 or days > 31:
+        return {'message': 'days must be between 1 and 31'}, 400
+
+    start = datetime.utcnow().date()
+    if request.args.get('start'):
+        try:
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        except ValueError:
+            return {'message': 'Invalid date format. Use YYYY-MM-DD'}, 400
+    # The last forecast day must still be a valid date
+    if start > date.max - timedelta(days=days - 1):
+        return {'message': 'start is too late for the requested number of days'}, 400
+
+    forecast = forecast_days(trail_id, start, days)
+    if forecast is None:
+        return {'message': 'Trail not found'}, 404
+    return forecast
+
+# Get many reviews by id in one call, in the order requested
+@review_routes.route('/reviews/batch')
+def get_reviews_batch():
+
+    try:
+        ids = parse_ids(request.args.get('ids'))
+    except ValueError as e:
+        return {'message': str(e)}, 400
+
+    fields = Review.parse_fields(request.args.get('fields'))
+    reviews = get_many(Review, ids, Review.load_options(fields))
+
+    return {
+        'reviews': [reviews[id].to_dict(fields) for id in ids if id in reviews],
+        'missing': [id for id in ids if id not in reviews]
     }
 
 # Get detailed information about a specific review
 @review_routes.route('/reviews/<int:id>')
 def get_review_by_id(id):
 
-    review = Review.query.get(id)
+    fields = Review.parse_fields(request.args.get('fields'))
+    review = Review.query.options(*Review.load_options(fields)).get(id)
 
     if not review:
         return {'message': 'Review not found'}, 404
 
-    return review.to_dict()
+    return review.to_dict(fields)
 
 # Create a new review for a trail
 @review_routes.route('/trails/<int:trail_id>/reviews', methods=['POST'])
@@ -108,10 +272,13 @@ def create_review(trail_id):
 
     try:
         db.session.add(review)
+        TrailConditionRollup.apply_review(review, 1)
+        UserStats.apply_review(review, trail.length_km, 1)
         db.session.commit()
 
         # Update trail rating stats
         trail.update_rating_stats()
+        _after_review_write(trail_id, trail_events.REVIEW_CREATED, review)
 
         return review.to_dict(), 201
 
@@ -122,6 +289,32 @@ def create_review(trail_id):
         db.session.rollback()
         return {'message': f'Error creating review: {str(e)}'}, 500
 
+# Ingest a batch of reviews from a partner feed (admin only). Every review
+# is validated on its own, invalid and duplicate ones are reported by their
+# position in the batch and the rest are created
+@review_routes.route('/reviews/bulk', methods=['POST'])
+@login_required
+def bulk_create_reviews():
+
+    if not current_user.is_admin:
+        return {'message': 'Access denied. Bulk ingestion is limited to admins.'}, 403
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('reviews')
+    limit = current_app.config['BULK_REVIEW_LIMIT']
+
+    if not isinstance(items, list) or not items:
+        return {'message': 'Validation error', 'errors': {'reviews': 'A non-empty list of reviews is required'}}, 400
+    if len(items) > limit:
+        return {'message': 'Validation error', 'errors': {'reviews': f'At most {limit} reviews per batch'}}, 400
+
+    result = ingest_reviews(items)
+    trail_events.reviews_created([created['id'] for created in result['created'] if created['id']])
+    for trail_id in result.pop('trail_ids'):
+        _after_review_write(trail_id)
+
+    return result
+
 # Update an existing review
 @review_routes.route('/reviews/<int:id>', methods=['PUT'])
 @login_required
@@ -138,6 +331,10 @@ def update_review(id):
 
     data = request.get_json()
 
+    # Remember the reported conditions so the rollup can be moved over
+    previous_conditions = TrailConditionRollup.snapshot(review)
+    previous_rating = review.rating
+
     # Update fields
     if 'rating' in data:
         review.rating = data['rating']
@@ -165,10 +362,14 @@ def update_review(id):
         return {'message': 'Validation error', 'errors': errors}, 400
 
     try:
+        TrailConditionRollup.apply_snapshot(previous_conditions, -1)
+        TrailConditionRollup.apply_review(review, 1)
+        UserStats.add_counts({review.user_id: {'rating_sum': review.rating - previous_rating}})
         db.session.commit()
 
         # Update trail rating stats
         review.trail.update_rating_stats()
+        _after_review_write(review.trail_id, trail_events.REVIEW_UPDATED, review)
 
         return review.to_dict()
 
@@ -193,34 +394,171 @@ def delete_review(id):
     trail = review.trail
 
     try:
+        TrailConditionRollup.apply_review(review, -1)
+        UserStats.apply_review(review, trail.length_km, -1)
         db.session.delete(review)
         db.session.commit()
 
         # Update trail rating stats
         trail.update_rating_stats()
+        _after_review_write(trail.id, trail_events.REVIEW_DELETED, review)
 
         return '', 204
     except Exception as e:
         db.session.rollback()
         return {'message': f'Error deleting review: {str(e)}'}, 500
 
+# Mark a review as helpful (one vote per user per review)
+@review_routes.route('/reviews/<int:id>/helpful', methods=['POST'])
+@login_required
+def vote_helpful(id):
+
+    review = Review.query.get(id)
+
+    if not review:
+        return {'message': 'Review not found'}, 404
+
+    if review.user_id == current_user.id:
+        return {'message': 'You cannot vote on your own review'}, 403
+
+    try:
+        db.session.add(ReviewVote(review_id=id, user_id=current_user.id))
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return {'message': 'You have already marked this review as helpful'}, 409
+
+    # Increment in the database rather than read-modify-write so
+    # concurrent votes on a popular review never overwrite each other
+    _adjust_helpful_count(id, 1)
+    db.session.commit()
+    trail_events.review_updated(id)
+
+    return {'review_id': id, 'helpful_count': _helpful_count(id), 'voted': True}, 201
+
+# Remove a helpful vote
+@review_routes.route('/reviews/<int:id>/helpful', methods=['DELETE'])
+@login_required
+def remove_helpful_vote(id):
+
+    deleted = ReviewVote.query.filter_by(review_id=id, user_id=current_user.id)\
+        .delete(synchronize_session=False)
+
+    if not deleted:
+        return {'message': 'Vote not found'}, 404
+
+    _adjust_helpful_count(id, -1)
+    db.session.commit()
+    trail_events.review_updated(id)
+
+    return {'review_id': id, 'helpful_count': _helpful_count(id), 'voted': False}
+
+
+def _adjust_helpful_count(review_id, delta):
+    Review.query.filter_by(id=review_id).update(
+        {Review.helpful_count: db.func.coalesce(Review.helpful_count, 0) + delta},
+        synchronize_session=False
+    )
+    # The UPDATE bypasses the ORM events that feed the change log
+    ChangeLog.record_reviews([review_id])
+
+
+def _helpful_count(review_id):
+    return db.session.query(Review.helpful_count).filter_by(id=review_id).scalar() or 0
+
+def _copy_limited(source, path, max_bytes, chunk_size=64 * 1024):
+    """Copy a stream to a file, False as soon as it exceeds max_bytes"""
+    written = 0
+    with open(path, 'wb') as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return True
+            written += len(chunk)
+            if written > max_bytes:
+                return False
+            target.write(chunk)
+
+# Upload a GPX track to verify the hike behind a review. The file is saved
+# to disk and checked by a background job, poll the GET for the result
+@review_routes.route('/reviews/<int:id>/track', methods=['POST'])
+@login_required
+def upload_review_track(id):
+
+    review = Review.query.get(id)
+
+    if not review:
+        return {'message': 'Review not found'}, 404
+
+    if review.user_id != current_user.id:
+        return {'message': 'Access denied. You can only verify your own reviews.'}, 403
+
+    max_bytes = current_app.config['TRACK_MAX_UPLOAD_BYTES']
+    too_large = {'message': f'Track files are limited to {max_bytes // (1024 * 1024)} MB'}, 413
+    if request.content_length and request.content_length > max_bytes:
+        return too_large
+
+    # Multipart uploads send the file as "gpx", otherwise the body is the
+    # GPX. The form parser reads a whole multipart body before the size
+    # can be checked, so those must announce their length
+    if request.mimetype.startswith('multipart/'):
+        if request.content_length is None:
+            return {'message': 'Multipart uploads need a Content-Length header'}, 411
+        upload = request.files.get('gpx')
+        source = upload.stream if upload else request.stream
+    else:
+        source = request.stream
+
+    upload_dir = current_app.config['TRACK_UPLOAD_DIR']
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f'{uuid.uuid4().hex}.gpx')
+    # Chunked bodies have no Content-Length, the copy stops at the limit
+    if not _copy_limited(source, path, max_bytes):
+        os.remove(path)
+        return too_large
+
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        return {'message': 'A GPX file is required'}, 400
+
+    verification = TrackVerification(review_id=id, status='pending')
+    db.session.add(verification)
+    db.session.commit()
+
+    try:
+        jobs.submit(verify_track, verification.id, path)
+    except JobQueueFull:
+        os.remove(path)
+        db.session.delete(verification)
+        db.session.commit()
+        return {'message': 'Too many tracks are being processed, try again shortly'}, 503
+
+    return verification.to_dict(), 202
+
+# Get the latest track verification of a review
+@review_routes.route('/reviews/<int:id>/track')
+def get_review_track(id):
+
+    verification = TrackVerification.query.filter_by(review_id=id)\
+        .order_by(TrackVerification.id.desc())\
+        .first()
+
+    if not verification:
+        return {'message': 'No track uploaded for this review'}, 404
+
+    return verification.to_dict()
+
 # Get all reviews by a specific user
 @review_routes.route('/users/<int:user_id>/reviews')
 def get_user_reviews(user_id):
 
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
+    fields = Review.parse_fields(request.args.get('fields'))
 
-    reviews = Review.query.filter_by(user_id=user_id)\
-        .order_by(Review.created_at.desc())\
-        .paginate(page=page, per_page=limit, error_out=False)
+    _, reviews, total = review_page(user_reviews_query(user_id), USER_REVIEW_ORDER, page, limit, fields)
 
     return {
-        'reviews': [review.to_dict() for review in reviews.items],
-        'pagination': {
-            'page': reviews.page,
-            'pages': reviews.pages,
-            'per_page': reviews.per_page,
-            'total': reviews.total
-        }
+        'reviews': [review.to_dict(fields) for review in reviews],
+        'pagination': pagination(page, limit, total)
     }
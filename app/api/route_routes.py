@@ -0,0 +1,52 @@
+from flask import Blueprint, request
+from app.models import Trail, get_many
+from app.services.route_graph import route_graph, ROUTE_MODES, SHORTEST
+from sqlalchemy.orm import load_only
+
+route_routes = Blueprint('routes', __name__)
+
+
+def _parse_point(raw):
+    """'lat,lon' -> (lon, lat), None if malformed or out of range"""
+    try:
+        lat, lon = [float(value) for value in raw.split(',')]
+    except (AttributeError, ValueError):
+        return None
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return None
+    return lon, lat
+
+
+# Plan a route across connected trails: ?from=lat,lon&to=lat,lon[&mode=]
+@route_routes.route('')
+def plan_route():
+
+    start = _parse_point(request.args.get('from'))
+    end = _parse_point(request.args.get('to'))
+    mode = request.args.get('mode', SHORTEST)
+
+    errors = {}
+    if start is None:
+        errors['from'] = 'from must be lat,lon'
+    if end is None:
+        errors['to'] = 'to must be lat,lon'
+    if mode not in ROUTE_MODES:
+        errors['mode'] = f"mode must be one of: {', '.join(ROUTE_MODES)}"
+    if errors:
+        return {'message': 'Validation error', 'errors': errors}, 400
+
+    route = route_graph.route(*start, *end, mode=mode)
+    if route is None:
+        return {'message': 'No connected trail route found between these points'}, 404
+
+    trails = get_many(
+        Trail,
+        list({leg['trail_id'] for leg in route['legs']}),
+        [load_only(Trail.id, Trail.name, Trail.difficulty)]
+    )
+    for leg in route['legs']:
+        trail = trails.get(leg['trail_id'])
+        leg['name'] = trail.name if trail else None
+        leg['difficulty'] = trail.difficulty if trail else None
+
+    return dict(route, mode=mode)
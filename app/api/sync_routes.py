@@ -0,0 +1,65 @@
+from flask import Blueprint, request, current_app
+from app.models import Trail, Review, ChangeLog, get_many
+from app.models.change_log import TRAIL, REVIEW, UPSERT, DELETE
+from app.api.utils import requested_geometry_format
+
+sync_routes = Blueprint('sync', __name__)
+
+SYNC_LIMIT = 1000
+
+
+# Trail responses can be negotiated on the Accept header (geometry encoding)
+@sync_routes.after_request
+def vary_on_accept(response):
+    response.vary.add('Accept')
+    return response
+
+
+# Get the trails and reviews created, updated or deleted since a token.
+# Start with since=0 and pass back `next` until has_more is false; every
+# entity appears once per page with its latest state or as a tombstone
+@sync_routes.route('')
+def get_changes():
+
+    try:
+        since = int(request.args.get('since', 0))
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return {'message': 'Validation error', 'errors': {'since': 'since must be a token returned by this endpoint'}}, 400
+
+    limit = max(1, min(request.args.get('limit', 500, type=int), SYNC_LIMIT))
+    geometry_format = requested_geometry_format()
+
+    entries = ChangeLog.since(since, limit, current_app.config.get('SYNC_SETTLE_SECONDS', 0))
+
+    # Several writes to the same row within a page collapse to the last one
+    latest = {}
+    for entry in entries:
+        latest[(entry.entity, entry.entity_id)] = entry
+
+    def wanted(entity):
+        return [id for (kind, id), entry in latest.items() if kind == entity and entry.op == UPSERT]
+
+    loaded = {
+        TRAIL: get_many(Trail, wanted(TRAIL), Trail.load_options(None, geometry_format)),
+        REVIEW: get_many(Review, wanted(REVIEW), Review.load_options())
+    }
+
+    changes = []
+    for entry in sorted(latest.values(), key=lambda entry: entry.seq):
+        instance = loaded[entry.entity].get(entry.entity_id) if entry.op == UPSERT else None
+        change = {'seq': entry.seq, 'entity': entry.entity, 'id': entry.entity_id, 'trail_id': entry.trail_id}
+        if instance is None:
+            # Deleted, or deleted again later than this page reaches
+            change['op'] = DELETE
+        else:
+            change['op'] = UPSERT
+            change['data'] = instance.to_dict(None, geometry_format) if entry.entity == TRAIL else instance.to_dict()
+        changes.append(change)
+
+    return {
+        'changes': changes,
+        'next': str(entries[-1].seq if entries else since),
+        'has_more': len(entries) == limit
+    }
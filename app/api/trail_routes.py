@@ -1,13 +1,35 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_login import login_required, current_user
-from app.models import db, Trail, Review
+from app.models import db, Trail, Review, UserStats, get_many
+from app.api.utils import parse_ids, requested_geometry_format
+from app.services import spatial_index, route_graph, region_packs, trail_events, trail_clusters, trail_query_cache
+from app.services.spatial_index import get_spatial_backend
+from app.services.trail_geometry import InvalidGeometry, clean_geometry
 from sqlalchemy import func
 from geoalchemy2.shape import from_shape
-from shapely.geometry import LineString, Point
+from shapely.geometry import Point
 import json
+import math
 
 trail_routes = Blueprint('trails', __name__)
 
+
+# Trail responses can be negotiated on the Accept header (geometry encoding)
+@trail_routes.after_request
+def vary_on_accept(response):
+    response.vary.add('Accept')
+    return response
+
+
+# Keep this worker's in-process trail indexes in step with a committed write
+def _after_trail_write(trail, deleted=False):
+    spatial_index.index_trail(trail, deleted)
+    route_graph.index_trail(trail, deleted)
+    region_packs.index_trail(trail, deleted)
+    trail_clusters.index_trail(trail, deleted)
+    trail_query_cache.index_trail(trail, deleted)
+    trail_events.trail_changed(trail.id, deleted)
+
 # Get all trails with optional filtering
 # Get query parameters
 
@@ -19,43 +41,170 @@ def get_all_trails():
     min_length = request.args.get('min_length', type=float)
     max_length = request.args.get('max_length', type=float)
     region = request.args.get('region')
+    fields = Trail.parse_fields(request.args.get('fields'), Trail.BASIC_FIELDS)
+    geometry_format = requested_geometry_format()
+
+    # Normalized filters, the key of the cached result (region matching is
+    # case insensitive)
+    filters = (difficulty or None, min_length or None, max_length or None, region.lower() if region else None)
+
+    def matching_ids():
+        # This is to build query, selecting only the ids
+        query = db.session.query(Trail.id)
+
+        # Then apply filters
+        if difficulty:
+            query = query.filter(Trail.difficulty == difficulty)
+        if min_length:
+            query = query.filter(Trail.length_km >= min_length)
+        if max_length:
+            query = query.filter(Trail.length_km <= max_length)
+        if region:
+            query = query.filter(Trail.region.ilike(f'%{region}%'))
+        return (id for id, in query.order_by(Trail.id))
+
+    def render(ids):
+        trails = get_many(Trail, ids, Trail.load_options(fields, geometry_format))
+        return {id: trail.to_dict_basic(fields, geometry_format) for id, trail in trails.items()}
+
+    # Paginate a slice of the cached ids, the total is their count
+    trail_query_cache.listing_cache.sync()
+    ids = trail_query_cache.listing_cache.result_ids(filters, matching_ids)
+    page = max(page, 1)
+    limit = limit if limit > 0 else 20
+    page_ids = ids[(page - 1) * limit:page * limit].tolist()
+    trails = trail_query_cache.listing_cache.hydrate(page_ids, (tuple(fields), geometry_format), render)
+
+    return {
+        'trails': [trails[id] for id in page_ids if id in trails],
+        'pagination': {
+            'page': page,
+            'pages': math.ceil(len(ids) / limit),
+            'per_page': limit,
+            'total': len(ids)
+        }
+    }
 
-    # This is to build query
-    query = Trail.query
+# Get many trails by id in one call, in the order requested
+@trail_routes.route('/batch')
+def get_trails_batch():
 
-    # Then apply filters
-    if difficulty:
-        query = query.filter(Trail.difficulty == difficulty)
-    if min_length:
-        query = query.filter(Trail.length_km >= min_length)
-    if max_length:
-        query = query.filter(Trail.length_km <= max_length)
-    if region:
-        query = query.filter(Trail.region.ilike(f'%{region}%'))
+    try:
+        ids = parse_ids(request.args.get('ids'))
+    except ValueError as e:
+        return {'message': str(e)}, 400
 
-    # Paginate
-    trails = query.paginate(page=page, per_page=limit, error_out=False)
+    fields = Trail.parse_fields(request.args.get('fields'))
+    geometry_format = requested_geometry_format()
+    trails = get_many(Trail, ids, Trail.load_options(fields, geometry_format))
 
     return {
-        'trails': [trail.to_dict_basic() for trail in trails.items],
-        'pagination': {
-            'page': trails.page,
-            'pages': trails.pages,
-            'per_page': trails.per_page,
-            'total': trails.total
-        }
+        'trails': [trails[id].to_dict(fields, geometry_format) for id in ids if id in trails],
+        'missing': [id for id in ids if id not in trails]
+    }
+
+# Get trails crossing a bounding box: ?bbox=min_lon,min_lat,max_lon,max_lat
+@trail_routes.route('/within')
+def get_trails_within():
+
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        return {'message': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, 400
+    if min_lon > max_lon or min_lat > max_lat:
+        return {'message': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, 400
+
+    fields = Trail.parse_fields(request.args.get('fields'), Trail.BASIC_FIELDS)
+    geometry_format = requested_geometry_format()
+
+    ids = get_spatial_backend().in_bbox(min_lon, min_lat, max_lon, max_lat, limit)
+    trails = get_many(Trail, ids, Trail.load_options(fields, geometry_format))
+
+    return {
+        'trails': [trails[id].to_dict_basic(fields, geometry_format) for id in ids if id in trails]
+    }
+
+# Get map clusters of the trails in a bounding box for a zoom level:
+# ?bbox=min_lon,min_lat,max_lon,max_lat&zoom=z. Single-trail clusters
+# carry the trail_id, so clients can fetch them as trails once zoomed in
+@trail_routes.route('/clusters')
+def get_trail_clusters():
+
+    zoom = request.args.get('zoom', type=int)
+    if zoom is None or zoom < 0:
+        return {'message': 'zoom must be a non-negative integer'}, 400
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        return {'message': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, 400
+    if min_lon > max_lon or min_lat > max_lat:
+        return {'message': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, 400
+
+    zoom, clusters = trail_clusters.trail_cluster_index.clusters(min_lon, min_lat, max_lon, max_lat, zoom)
+
+    return {'zoom': zoom, 'clusters': clusters}
+
+# Get the trails closest to a point: ?lat=&lon=[&radius_km=][&limit=]
+@trail_routes.route('/nearby')
+def get_trails_nearby():
+
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', type=float)
+    limit = min(request.args.get('limit', 10, type=int), 100)
+
+    if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return {'message': 'Valid lat and lon are required'}, 400
+    if radius_km is not None and radius_km <= 0:
+        return {'message': 'radius_km must be a positive number'}, 400
+
+    fields = Trail.parse_fields(request.args.get('fields'), Trail.BASIC_FIELDS)
+    geometry_format = requested_geometry_format()
+
+    matches = get_spatial_backend().nearby(lon, lat, radius_km, limit)
+    trails = get_many(Trail, [id for id, _ in matches], Trail.load_options(fields, geometry_format))
+
+    return {
+        'trails': [
+            dict(trails[id].to_dict_basic(fields, geometry_format), distance_km=distance_km)
+            for id, distance_km in matches if id in trails
+        ]
     }
 
 #Get detailed information about a specific trail
 @trail_routes.route('/<int:id>')
 def get_trail_by_id(id):
 
-    trail = Trail.query.get(id)
+    fields = Trail.parse_fields(request.args.get('fields'))
+    geometry_format = requested_geometry_format()
+    trail = Trail.query.options(*Trail.load_options(fields, geometry_format)).get(id)
 
     if not trail:
         return {'message': 'Trail not found'}, 404
 
-    return trail.to_dict()
+    return trail.to_dict(fields, geometry_format)
+
+# Stream new, updated and deleted reviews and trail updates of a trail as
+# server-sent events, so detail pages need not poll the reviews listing
+@trail_routes.route('/<int:id>/events')
+def trail_event_stream(id):
+
+    if not db.session.query(Trail.id).filter(Trail.id == id).scalar():
+        return {'message': 'Trail not found'}, 404
+
+    try:
+        subscription = trail_events.broker.subscribe(id)
+    except trail_events.TooManyListeners:
+        return {'message': 'Too many event listeners, try again later'}, 503, {'Retry-After': '30'}
+
+    # The stream runs after the request's session is released, so an idle
+    # listener holds no database connection
+    return Response(
+        trail_events.broker.stream(subscription, current_app.config.get('TRAIL_EVENTS_HEARTBEAT', 15)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # Create a new trail
 @trail_routes.route('', methods=['POST'])
@@ -95,25 +244,19 @@ def create_trail():
         except (ValueError, TypeError):
             errors['elevation_gain_m'] = 'Elevation gain must be a valid number'
 
+    # Validate and clean the geometry (optional field, a trail without one
+    # stays off the map)
+    geometry = None
+    if data.get('geometry'):
+        try:
+            geometry = from_shape(clean_geometry(data['geometry']), srid=4326)
+        except InvalidGeometry as e:
+            errors['geometry'] = str(e)
+
     if errors:
         return {'message': 'Validation error', 'errors': errors}, 400
 
     try:
-        # Handle geometry if provided, otherwise create a default line
-        geometry = None
-        if data.get('geometry'):  # Check if geometry exists first
-            geojson = data['geometry']
-            if geojson['type'] != 'LineString':
-                return {'message': 'Geometry must be a LineString'}, 400
-            # This is to create LineString from coordinates
-            line = LineString(geojson['coordinates'])
-            geometry = from_shape(line, srid=4326)
-        else:
-            # Create a default line (just two points)
-            # This is a temporary solution until we implement map functionality
-            default_line = LineString([(0, 0), (0.001, 0.001)])
-            geometry = from_shape(default_line, srid=4326)
-
         # Then create trail
         trail = Trail(
             name=data['name'],
@@ -121,7 +264,7 @@ def create_trail():
             difficulty=data['difficulty'],
             length_km=length_km,  # Already converted to float
             elevation_gain_m=elevation_gain_m,  # Already converted to float or None
-            geometry=geometry,  # Now always has a value
+            geometry=geometry,  # Cleaned geometry or None
             region=data.get('region', ''),
             parking_info=data.get('parking_info', ''),
             created_by=current_user.id
@@ -129,8 +272,9 @@ def create_trail():
 
 
         db.session.add(trail)
+        UserStats.add_counts({current_user.id: {'trails_created': 1}})
         db.session.commit()
-
+        _after_trail_write(trail)
 
         return trail.to_dict(), 201
 
@@ -160,6 +304,13 @@ def update_trail(id):
         errors['difficulty'] = 'Difficulty must be one of: easy, moderate, hard, expert'
     if 'length_km' in data and data['length_km'] <= 0:
         errors['length_km'] = 'Trail length must be a positive number'
+    # A null geometry takes the trail off the map
+    geometry = None
+    if data.get('geometry') is not None:
+        try:
+            geometry = from_shape(clean_geometry(data['geometry']), srid=4326)
+        except InvalidGeometry as e:
+            errors['geometry'] = str(e)
 
     if errors:
         return {'message': 'Validation error', 'errors': errors}, 400
@@ -173,6 +324,7 @@ def update_trail(id):
         if 'difficulty' in data:
             trail.difficulty = data['difficulty']
         if 'length_km' in data:
+            UserStats.apply_trail_length(trail.id, data['length_km'] - (trail.length_km or 0))
             trail.length_km = data['length_km']
         if 'elevation_gain_m' in data:
             trail.elevation_gain_m = data['elevation_gain_m']
@@ -183,13 +335,10 @@ def update_trail(id):
 
         # Handle geometry update if provided
         if 'geometry' in data:
-            geojson = data['geometry']
-            if geojson['type'] != 'LineString':
-                return {'message': 'Geometry must be a LineString'}, 400
-            line = LineString(geojson['coordinates'])
-            trail.geometry = from_shape(line, srid=4326)
+            trail.geometry = geometry
 
         db.session.commit()
+        _after_trail_write(trail)
         return trail.to_dict()
 
     except Exception as e:
@@ -211,8 +360,10 @@ def delete_trail(id):
         return {'message': 'Access denied. You can only delete trails you created.'}, 403
 
     try:
+        UserStats.remove_trail(trail)
         db.session.delete(trail)
         db.session.commit()
+        _after_trail_write(trail, deleted=True)
         return '', 204
     except Exception as e:
         db.session.rollback()
@@ -225,12 +376,14 @@ def search_trails():
     query = request.args.get('q', '')
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
+    fields = Trail.parse_fields(request.args.get('fields'), Trail.BASIC_FIELDS)
+    geometry_format = requested_geometry_format()
 
     if not query:
         return {'message': 'Search query is required'}, 400
 
     # Search in name and region
-    trails = Trail.query.filter(
+    trails = Trail.query.options(*Trail.load_options(fields, geometry_format)).filter(
         db.or_(
             Trail.name.ilike(f'%{query}%'),
             Trail.region.ilike(f'%{query}%')
@@ -238,7 +391,7 @@ def search_trails():
     ).paginate(page=page, per_page=limit, error_out=False)
 
     return {
-        'trails': [trail.to_dict_basic() for trail in trails.items],
+        'trails': [trail.to_dict_basic(fields, geometry_format) for trail in trails.items],
         'search_query': query,
         'pagination': {
             'page': trails.page,
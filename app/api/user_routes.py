@@ -1,18 +1,139 @@
-from flask import Blueprint, jsonify
-from flask_login import login_required
-from app.models import User
+import csv
+import io
+
+from flask import Blueprint, Response, request, stream_with_context
+from flask_login import login_required, current_user
+from app.models import db, User, UserStats
+from app.models.fields import InvalidFields
 
 user_routes = Blueprint('users', __name__)
 
+USER_PAGE_LIMIT = 200
+EXPORT_BATCH = 1000
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+# Leading characters a spreadsheet would evaluate as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _user_filters():
+    """
+    The filters of the user listing and export as SQL criteria. Raises
+    InvalidFields for a value the filter does not accept
+    """
+    criteria = []
+
+    hiking_level = request.args.get('hiking_level')
+    if hiking_level:
+        if hiking_level not in User.HIKING_LEVELS:
+            raise InvalidFields(f"hiking_level must be one of {', '.join(User.HIKING_LEVELS)}", 'hiking_level')
+        criteria.append(User.hiking_level == hiking_level)
+
+    for name in ('is_active', 'is_admin'):
+        raw = request.args.get(name)
+        if raw is None or raw == '':
+            continue
+        if raw.lower() not in BOOLEANS:
+            raise InvalidFields(f'{name} must be true or false', name)
+        criteria.append(getattr(User, name).is_(BOOLEANS[raw.lower()]))
+
+    # Prefix match only, a LIKE 'abc%' the username pattern index serves
+    username = request.args.get('username')
+    if username:
+        criteria.append(User.username.startswith(username, autoescape=True))
 
+    return criteria
+
+
+def _after():
+    try:
+        after = int(request.args.get('after', 0))
+        if after < 0:
+            raise ValueError
+    except ValueError:
+        raise InvalidFields('after must be a cursor returned by this endpoint', 'after')
+    return after
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# Get a page of users (admin only), filtered by hiking_level, is_active,
+# is_admin and a username prefix. Pages are keyed on the id: pass back
+# `next` as `after` until has_more is false
 @user_routes.route('/')
 @login_required
 def users():
-    """
-    Query for all users and returns them in a list of user dictionaries
-    """
-    users = User.query.all()
-    return {'users': [user.to_dict() for user in users]}
+
+    if not current_user.is_admin:
+        return {'message': 'Access denied. The user listing is limited to admins.'}, 403
+
+    fields = User.parse_fields(request.args.get('fields'))
+    criteria = _user_filters()
+    after = _after()
+    limit = max(1, min(request.args.get('limit', 50, type=int), USER_PAGE_LIMIT))
+
+    users = (
+        User.query.options(*User.load_options(fields))
+        .filter(User.id > after, *criteria)
+        .order_by(User.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(users) > limit
+    users = users[:limit]
+
+    return {
+        'users': [user.to_dict(fields) for user in users],
+        'next': str(users[-1].id) if users else str(after),
+        'has_more': has_more
+    }
+
+
+# Export the users matching the listing's filters as CSV (admin only).
+# Rows are read and written EXPORT_BATCH at a time, so the export runs in
+# constant memory whatever the size of the table
+@user_routes.route('/export')
+@login_required
+def export_users():
+
+    if not current_user.is_admin:
+        return {'message': 'Access denied. The user export is limited to admins.'}, 403
+
+    fields = User.parse_fields(request.args.get('fields')) or list(User.FIELDS)
+    criteria = _user_filters()
+    options = User.load_options(fields)
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        after = 0
+        while True:
+            batch = (
+                User.query.options(*options)
+                .filter(User.id > after, *criteria)
+                .order_by(User.id)
+                .limit(EXPORT_BATCH)
+                .all()
+            )
+            for user in batch:
+                record = user.to_dict(fields)
+                writer.writerow([_csv_value(record[field]) for field in fields])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(batch) < EXPORT_BATCH:
+                return
+            after = batch[-1].id
+
+    return Response(
+        stream_with_context(rows()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename="users.csv"'}
+    )
 
 
 @user_routes.route('/<int:id>')
@@ -21,5 +142,23 @@ def user(id):
     """
     Query for a user by id and returns that user in a dictionary
     """
-    user = User.query.get(id)
-    return user.to_dict()
+    fields = User.parse_fields(request.args.get('fields'))
+    user = User.query.options(*User.load_options(fields)).get(id)
+    return user.to_dict(fields)
+
+
+# Get a user's profile stats, read from their precomputed counters
+@user_routes.route('/<int:id>/stats')
+@login_required
+def user_stats(id):
+
+    row = (
+        db.session.query(User.id, UserStats)
+        .outerjoin(UserStats, UserStats.user_id == User.id)
+        .filter(User.id == id)
+        .first()
+    )
+    if row is None:
+        return {'message': 'User not found'}, 404
+
+    return UserStats.to_dict_for(id, row.UserStats)
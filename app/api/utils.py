@@ -0,0 +1,60 @@
+from flask import request
+from app.models.fields import InvalidFields
+from app.models.polyline import GEOJSON, POLYLINE, DELTA, GEOMETRY_FORMATS
+
+# Most ids a single batch request may ask for
+BATCH_LIMIT = 100
+
+
+def parse_ids(raw, limit=BATCH_LIMIT):
+    """
+    Parse an ?ids=3,1,2 parameter into a list of ints, keeping the request
+    order and dropping repeats. Raises ValueError with a client-facing
+    message when the list is empty, malformed or too long.
+    """
+    if not raw:
+        raise ValueError('ids is required')
+
+    ids = []
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            id = int(part)
+        except ValueError:
+            raise ValueError(f'Invalid id: {part}')
+        if id not in ids:
+            ids.append(id)
+
+    if not ids:
+        raise ValueError('ids is required')
+    if len(ids) > limit:
+        raise ValueError(f'At most {limit} ids can be requested at once')
+    return ids
+
+
+# Media types clients can Accept instead of passing ?geometry_format=
+GEOMETRY_MEDIA_TYPES = {
+    'application/json': GEOJSON,
+    'application/vnd.trailhub.polyline+json': POLYLINE,
+    'application/vnd.trailhub.delta+json': DELTA
+}
+
+
+def requested_geometry_format():
+    """
+    Geometry encoding for trail responses, from ?geometry_format= or the
+    Accept header, GeoJSON by default
+    """
+    geometry_format = request.args.get('geometry_format')
+    if geometry_format is None:
+        best = request.accept_mimetypes.best_match(list(GEOMETRY_MEDIA_TYPES))
+        return GEOMETRY_MEDIA_TYPES.get(best, GEOJSON)
+
+    if geometry_format not in GEOMETRY_FORMATS:
+        raise InvalidFields(
+            f"geometry_format must be one of: {', '.join(GEOMETRY_FORMATS)}",
+            param='geometry_format'
+        )
+    return geometry_format
@@ -0,0 +1,218 @@
+from flask.cli import AppGroup
+import click
+
+# Creates a bench group to hold our performance checks
+# So we can type `flask bench --help`
+bench_commands = AppGroup('bench')
+
+
+# Creates the `flask bench explain` command
+@bench_commands.command('explain')
+@click.option('--trail-id', type=int, help='Trail to explain (defaults to the most reviewed one)')
+@click.option('--user-id', type=int, help='User to explain (defaults to the most active reviewer)')
+@click.option('--verbose', is_flag=True, help='Print the full plan of every query')
+def explain(trail_id, user_id, verbose):
+    """Assert that every review listing query uses an index scan"""
+    from .query_plans import run_review_plan_checks
+
+    results = run_review_plan_checks(trail_id, user_id)
+    if results is None:
+        raise click.ClickException('No reviews found, seed the database first')
+
+    failures = 0
+    for label, index, error, plan in results:
+        if error:
+            failures += 1
+        click.echo(f"{'FAIL' if error else 'ok  '}  {label:<32} {error or index}")
+        if verbose or error:
+            for line in plan:
+                click.echo(f'        {line}')
+
+    if failures:
+        raise click.ClickException(f'{failures} of {len(results)} queries are not served by an index')
+
+
+# Creates the `flask bench spatial` command
+@bench_commands.command('spatial')
+@click.option('--iterations', default=200, help='Random queries per lookup type')
+@click.option('--seed', default=1, help='Random seed for reproducible queries')
+def spatial(iterations, seed):
+    """Compare in-memory and PostGIS spatial lookups"""
+    from .spatial import run_spatial_benchmark
+
+    report = run_spatial_benchmark(iterations, seed)
+    if report is None:
+        raise click.ClickException('No trails found, seed the database first')
+
+    click.echo(f"{report['trails']} trails, in-memory index built in {report['memory_build_ms']} ms")
+    for label, timing in report['queries'].items():
+        click.echo(f"{label:<16} mean {timing['mean_ms']:>8} ms  p50 {timing['p50_ms']:>8} ms  p95 {timing['p95_ms']:>8} ms")
+    for kind, ratio in report.get('agreement', {}).items():
+        click.echo(f'{kind} results identical on both backends: {ratio:.1%}')
+
+
+# Creates the `flask bench geometry` command
+@bench_commands.command('geometry')
+@click.option('--points', default=100000, help='Points per synthetic track')
+@click.option('--max-vertices', default=5000, help='Vertex cap the tracks are simplified to')
+@click.option('--iterations', default=5, help='Timed runs per track')
+@click.option('--seed', default=1, help='Random seed for the synthetic tracks')
+def geometry(points, max_vertices, iterations, seed):
+    """Time the trail geometry cleanup on dense, spiky and drawn tracks"""
+    from .geometry import run_geometry_benchmark
+
+    for row in run_geometry_benchmark(points, max_vertices, iterations, seed):
+        click.echo(
+            f"{row['label']:<18} {row['input_points']:>7} -> {row['points']:>6} points  "
+            f"{row['duplicates_removed']:>7} duplicates  {row['spikes_removed']:>3} spikes  "
+            f"simplify {row['simplify_meters']:>6.2f} m  {row['input_km']} -> {row['km']} km  p50 {row['p50_ms']} ms"
+        )
+
+
+# Creates the `flask bench startup` command
+@bench_commands.command('startup')
+@click.option('--runs', default=5, help='Cold starts to take the median of')
+@click.option('--path', default='/api/trails?limit=1', help='Request served as the first request')
+@click.option('--history', default='bench/startup.jsonl', help='JSONL file results are appended to')
+@click.option('--no-record', is_flag=True, help='Print the result without appending it')
+def startup(runs, path, history, no_record):
+    """Measure import time, time-to-first-request and RSS of a worker"""
+    from .startup import METRICS, run_startup_benchmark, previous_result, record_result
+
+    previous = previous_result(history)
+    result = run_startup_benchmark(runs, path)
+    if result['status'] >= 500:
+        raise click.ClickException(f"{path} answered {result['status']}, check the database")
+
+    for metric in METRICS:
+        line = f'{metric:<26} {result[metric]:>9}'
+        if previous and previous.get(metric):
+            change = (result[metric] - previous[metric]) / previous[metric]
+            line += f"  ({change:+.1%} vs {previous.get('revision') or previous['recorded_at']})"
+        click.echo(line)
+
+    if not no_record:
+        record_result(history, result)
+        click.echo(f'Recorded in {history}')
+
+
+# Creates the `flask bench endpoints` command
+@bench_commands.command('endpoints')
+@click.option('--iterations', default=20, help='Timed calls per endpoint')
+@click.option('--seed', default=1, help='Random seed for the ids picked')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the report to this JSON file')
+def endpoints(iterations, seed, output):
+    """Latency, SQL statements and payload size of the main read endpoints"""
+    from .endpoints import run_endpoint_benchmark, write_report
+
+    report = run_endpoint_benchmark(iterations, seed)
+    if report is None:
+        raise click.ClickException('No trails found, run `flask seed synthetic` first')
+
+    click.echo(f"{'endpoint':<26} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'bytes':>9} {'gzip':>8}")
+    for row in report:
+        click.echo(
+            f"{row['label']:<26} {row['status']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+            f"{row['queries']:>8} {row['bytes']:>9} {row['gzip_bytes']:>8}"
+        )
+    if output:
+        write_report(output, report)
+        click.echo(f'Report written to {output}')
+
+
+# Creates the `flask bench compression` command
+@bench_commands.command('compression')
+@click.option('--iterations', default=20, help='Timed runs per codec and endpoint')
+@click.option('--seed', default=1, help='Random seed for the ids picked')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the report to this JSON file')
+def compression(iterations, seed, output):
+    """Payload size and compression cost of the main read endpoints"""
+    from .compression import run_compression_benchmark
+    from .endpoints import write_report
+
+    report = run_compression_benchmark(iterations, seed)
+    if report is None:
+        raise click.ClickException('No trails found, run `flask seed synthetic` first')
+
+    for row in report:
+        click.echo(
+            f"{row['label']:<26} {row['bytes']:>9} bytes  served {row['served_encoding']:<8} {row['served_bytes']:>9} bytes  "
+            f"p50 {row['identity_ms']} ms identity, {row['encoded_ms']} ms encoded"
+        )
+        for name, codec in row['codecs'].items():
+            click.echo(
+                f"    {name:<8} {codec['bytes']:>9} bytes  ratio {codec['ratio']}  "
+                f"compress {codec['compress_ms']} ms  decompress {codec['decompress_ms']} ms"
+            )
+    if output:
+        write_report(output, report)
+        click.echo(f'Report written to {output}')
+
+
+# Creates the `flask bench replay` command
+@bench_commands.command('replay')
+@click.argument('log', type=click.Path(exists=True, dir_okay=False))
+@click.option('--base-url', default='http://localhost:8000', help='Instance to replay against')
+@click.option('--rate', type=float, help='Requests per second (default: as fast as possible)')
+@click.option('--concurrency', default=8, help='Requests in flight at most')
+@click.option('--credentials', type=click.Path(exists=True, dir_okay=False),
+              help='JSON file of {"<user_id>": {"email": ..., "password": ...}} to replay as recorded users')
+@click.option('--include-writes', is_flag=True, help='Also replay POST/PUT/DELETE requests')
+@click.option('--limit', type=int, help='Replay only the first N requests')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the JSON report to this file')
+def replay(log, base_url, rate, concurrency, credentials, include_writes, limit, output):
+    """Replay a recorded TRAFFIC_LOG and report per endpoint results"""
+    import json
+    from .traffic import read_traffic, replay as run_replay
+
+    entries = read_traffic(log, include_writes, limit)
+    if not entries:
+        raise click.ClickException('No requests to replay in that log')
+    logins = {}
+    if credentials:
+        with open(credentials) as f:
+            logins = json.load(f)
+
+    report = run_replay(entries, base_url, rate, concurrency, logins)
+
+    click.echo(f"{'endpoint':<48} {'reqs':>6} {'rps':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for key, row in list(report['endpoints'].items()) + [('overall', report['overall'])]:
+        click.echo(
+            f"{key[:48]:<48} {row['requests']:>6} {row['throughput_rps']:>8} {row['p50_ms']:>8} "
+            f"{row['p90_ms']:>8} {row['p99_ms']:>8} {row['error_rate']:>7.2%}"
+        )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        click.echo(f'Report written to {output}')
+
+
+# Creates the `flask bench compare` command
+@bench_commands.command('compare')
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('candidate', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.1, help='Latency growth (0.1 = 10%) that counts as a regression')
+def compare(baseline, candidate, threshold):
+    """Compare two replay reports and fail on regressions"""
+    import json
+    from .traffic import compare as compare_reports
+
+    with open(baseline) as f:
+        before = json.load(f)
+    with open(candidate) as f:
+        after = json.load(f)
+
+    regressions = 0
+    for row in compare_reports(before, after, threshold):
+        if 'only_in' in row:
+            click.echo(f"{row['endpoint']:<48} only in {row['only_in']}")
+            continue
+        regressions += row['regressed']
+        p50, p90 = row['p50_ms'], row['p90_ms']
+        click.echo(
+            f"{'REGRESSED' if row['regressed'] else 'ok':<10}{row['endpoint'][:48]:<48} "
+            f"p50 {p50[0]}->{p50[1]} ms ({p50[2]:+.1%})  p90 {p90[0]}->{p90[1]} ms ({p90[2]:+.1%})  "
+            f"errors {row['error_rate'][0]:.2%}->{row['error_rate'][1]:.2%}"
+        )
+    if regressions:
+        raise click.ClickException(f'{regressions} endpoint(s) regressed')
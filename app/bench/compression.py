@@ -0,0 +1,69 @@
+"""
+Size and latency of compressing typical trail payloads.
+
+Every read endpoint case of `flask bench endpoints` is fetched once
+uncompressed. Its body is then compressed with each codec setting
+(compress and decompress time, size), and the endpoint is timed through
+the test client with and without Accept-Encoding, which shows what
+compress_response adds to a request end to end.
+"""
+import gzip
+import statistics
+import time
+
+from flask import current_app
+
+from app.compression import brotli, compress, GZIP, BROTLI
+from .endpoints import endpoint_cases
+
+
+def codec_settings():
+    """(name, encoding, gzip level, brotli quality) to compare"""
+    settings = [('gzip-1', GZIP, 1, None), ('gzip-6', GZIP, 6, None), ('gzip-9', GZIP, 9, None)]
+    if brotli is not None:
+        settings += [('br-4', BROTLI, None, 4), ('br-11', BROTLI, None, 11)]
+    return settings
+
+
+def _decompress(data, encoding):
+    return brotli.decompress(data) if encoding == BROTLI else gzip.decompress(data)
+
+
+def _p50_ms(fn, iterations):
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def run_compression_benchmark(iterations=20, seed=1):
+    cases = endpoint_cases(seed)
+    if cases is None:
+        return None
+
+    client = current_app.test_client()
+    report = []
+    for label, url in cases:
+        body = client.get(url, headers={'Accept-Encoding': 'identity'}).get_data()
+        row = {'label': label, 'url': url, 'bytes': len(body), 'codecs': {}}
+
+        for name, encoding, level, quality in codec_settings():
+            encoded = compress(body, encoding, level or 6, quality or 4)
+            row['codecs'][name] = {
+                'bytes': len(encoded),
+                'ratio': round(len(encoded) / len(body), 3) if body else None,
+                'compress_ms': _p50_ms(lambda: compress(body, encoding, level or 6, quality or 4), iterations),
+                'decompress_ms': _p50_ms(lambda: _decompress(encoded, encoding), iterations),
+            }
+
+        # End to end, with the configured levels
+        accept = ', '.join((BROTLI, GZIP) if brotli is not None else (GZIP,))
+        response = client.get(url, headers={'Accept-Encoding': accept})
+        row['served_encoding'] = response.headers.get('Content-Encoding', 'identity')
+        row['served_bytes'] = len(response.get_data())
+        row['identity_ms'] = _p50_ms(lambda: client.get(url, headers={'Accept-Encoding': 'identity'}), iterations)
+        row['encoded_ms'] = _p50_ms(lambda: client.get(url, headers={'Accept-Encoding': accept}), iterations)
+        report.append(row)
+    return report
@@ -0,0 +1,123 @@
+import gzip
+import json
+import random
+import statistics
+import time
+from urllib.parse import quote
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.models import db, Trail, Review
+from .query_plans import busiest
+
+
+class QueryCounter:
+    """Counts the SQL statements run on the engine while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def endpoint_cases(seed=1):
+    """
+    (label, url) pairs covering the read endpoints of trail_routes and
+    review_routes, with ids picked from the current dataset
+    """
+    rng = random.Random(seed)
+    trail_ids = [id for id, in db.session.query(Trail.id).order_by(Trail.id)]
+    if not trail_ids:
+        return None
+
+    busy_trail = busiest(Review.trail_id) or trail_ids[0]
+    busy_user = busiest(Review.user_id) or 1
+    review_id = db.session.query(Review.id).filter(Review.trail_id == busy_trail).limit(1).scalar()
+    sample = ','.join(str(id) for id in rng.sample(trail_ids, min(50, len(trail_ids))))
+    region = db.session.query(Trail.region).filter(Trail.id == busy_trail).scalar() or ''
+    name = db.session.query(Trail.name).filter(Trail.id == busy_trail).scalar() or ''
+    # First word of each, empty for a blank region or name
+    region_word = quote((region.split() or [''])[0])
+    name_word = quote((name.split() or [''])[0])
+    lon, lat = db.session.query(
+        db.func.ST_X(db.func.ST_StartPoint(Trail.geometry)), db.func.ST_Y(db.func.ST_StartPoint(Trail.geometry))
+    ).filter(Trail.id == busy_trail).one() if db.engine.dialect.name == 'postgresql' else (None, None)
+
+    cases = [
+        ('trails list', '/api/trails?limit=20'),
+        ('trails list ids only', '/api/trails?limit=100&fields=id,name'),
+        ('trails list polyline', '/api/trails?limit=20&geometry_format=polyline'),
+        ('trails filtered', f'/api/trails?difficulty=moderate&min_length=2&region={region_word}'),
+        ('trail detail', f'/api/trails/{busy_trail}'),
+        ('trails batch (50)', f'/api/trails/batch?ids={sample}'),
+        ('trail reviews newest', f'/api/trails/{busy_trail}/reviews'),
+        ('trail reviews helpful', f'/api/trails/{busy_trail}/reviews?sort=helpful'),
+        ('trail reviews deep page', f'/api/trails/{busy_trail}/reviews?page=5'),
+        ('trail conditions', f'/api/trails/{busy_trail}/conditions'),
+        ('user reviews', f'/api/users/{busy_user}/reviews'),
+    ]
+    if name_word:
+        cases.append(('trails search', f'/api/trails/search?q={name_word}'))
+    if review_id:
+        cases.append(('review detail', f'/api/reviews/{review_id}'))
+    center_lon, center_lat = db.session.query(Trail.centroid_lon, Trail.centroid_lat)\
+        .filter(Trail.id == busy_trail).one()
+    if center_lon is not None:
+        cases.append(('trail clusters', '/api/trails/clusters?zoom=7&bbox='
+                      f'{center_lon - 3},{center_lat - 2},{center_lon + 3},{center_lat + 2}'))
+    if lon is not None:
+        cases.append(('trails nearby', f'/api/trails/nearby?lat={lat}&lon={lon}&radius_km=10'))
+        cases.append(('trails within', f'/api/trails/within?bbox={lon - 0.1},{lat - 0.1},{lon + 0.1},{lat + 0.1}'))
+    return cases
+
+
+def run_endpoint_benchmark(iterations=20, seed=1):
+    """
+    Call every endpoint case `iterations` times through the test client
+    (after one untimed warm-up call) and report latency, SQL statements
+    per request and payload size
+    """
+    cases = endpoint_cases(seed)
+    if cases is None:
+        return None
+
+    client = current_app.test_client()
+    counter = QueryCounter(db.engine)
+    report = []
+    for label, url in cases:
+        client.get(url)
+        times = []
+        for _ in range(iterations):
+            with counter:
+                start = time.perf_counter()
+                response = client.get(url)
+                times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+        report.append({
+            'label': label,
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(times[len(times) // 2], 2),
+            'p95_ms': round(times[max(int(len(times) * 0.95) - 1, 0)], 2),
+            'mean_ms': round(statistics.mean(times), 2),
+            'queries': counter.count,
+            'bytes': len(response.data),
+            'gzip_bytes': len(gzip.compress(response.data)),
+        })
+    return report
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump({'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'endpoints': report}, f, indent=2)
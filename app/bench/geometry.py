@@ -0,0 +1,67 @@
+import math
+import statistics
+import time
+
+import numpy as np
+
+from app.services.trail_geometry import METERS_PER_DEGREE, clean_coordinates
+
+
+def _track(steps_m, lat=37.7, lon=-119.5):
+    """lon/lat array of a track from its (n, 2) steps in meters"""
+    xy = np.cumsum(steps_m, axis=0)
+    scale = (METERS_PER_DEGREE * math.cos(math.radians(lat)), METERS_PER_DEGREE)
+    return xy / scale + (lon, lat)
+
+
+def synthetic_tracks(points, seed=1):
+    """(label, lon/lat array) of the kinds of tracks uploads send"""
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.02, points))
+    walk = np.column_stack((np.cos(heading), np.sin(heading)))
+
+    # 10 Hz logger on a slow climb: every step is well under DUPLICATE_METERS
+    dense = walk * 0.15 + rng.normal(0, 0.02, (points, 2))
+    # 1 Hz walk with GPS spikes every 5000 points
+    spiky = walk * 1.3
+    spiky[::5000] += rng.normal(0, 200, (len(spiky[::5000]), 2))
+    spiky[1::5000] -= spiky[::5000] - walk[::5000] * 1.3
+    # Drawn line, few far apart vertices
+    drawn = walk[:max(points // 100, 2)] * 50
+    return [
+        ('dense 10 Hz', _track(dense)),
+        ('1 Hz with spikes', _track(spiky)),
+        ('drawn', _track(drawn)),
+    ]
+
+
+def _length_km(coords):
+    lat = math.radians(coords[:, 1].mean())
+    steps = np.diff(coords, axis=0) * (METERS_PER_DEGREE * math.cos(lat), METERS_PER_DEGREE)
+    return float(np.hypot(*steps.T).sum()) / 1000
+
+
+def run_geometry_benchmark(points=100000, max_vertices=5000, iterations=5, seed=1):
+    """
+    Time the trail geometry cleanup on synthetic tracks and report what it
+    kept: points, duplicates and spikes dropped, simplify tolerance and the
+    track length before and after (a cleanup that eats stretches of track
+    shows up as a shorter length)
+    """
+    report = []
+    for label, coords in synthetic_tracks(points, seed):
+        times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            cleaned, cleanup = clean_coordinates(coords, max_vertices)
+            times.append((time.perf_counter() - start) * 1000)
+        report.append(dict(
+            cleanup,
+            label=label,
+            input_points=len(coords),
+            points=len(cleaned),
+            input_km=round(_length_km(coords), 3),
+            km=round(_length_km(cleaned), 3),
+            p50_ms=round(statistics.median(times), 1)
+        ))
+    return report
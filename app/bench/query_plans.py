@@ -0,0 +1,85 @@
+from app.models import db, Review
+from app.api.review_routes import (
+    REVIEW_SORTS, USER_REVIEW_ORDER, review_page_ids, trail_reviews_query, user_reviews_query
+)
+
+
+# (label, query, index the planner is expected to walk). The queries are
+# the page id queries review_page runs for the endpoints
+def review_listing_cases(trail_id, user_id, limit=10):
+    cases = [
+        (f'get_trail_reviews sort={sort}',
+         review_page_ids(trail_reviews_query(trail_id, sort), REVIEW_SORTS[sort], 1, limit),
+         index)
+        for sort, index in (
+            ('newest', 'ix_reviews_trail_created'),
+            ('oldest', 'ix_reviews_trail_created'),
+            ('highest', 'ix_reviews_trail_rating'),
+            ('lowest', 'ix_reviews_trail_rating'),
+            ('helpful', 'ix_reviews_trail_helpful')
+        )
+    ]
+    cases.append((
+        'get_user_reviews',
+        review_page_ids(user_reviews_query(user_id), USER_REVIEW_ORDER, 1, limit),
+        'ix_reviews_user_created'
+    ))
+    return cases
+
+
+def busiest(column):
+    """The trail or user id with the most reviews, the worst case for a sort"""
+    return db.session.query(column)\
+        .group_by(column)\
+        .order_by(db.func.count(Review.id).desc())\
+        .limit(1)\
+        .scalar()
+
+
+def explain(query):
+    """Return the plan lines for an ORM query on the current database"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'postgresql':
+        rows = db.session.execute(db.text(f'EXPLAIN {sql}'))
+        return [row[0] for row in rows]
+
+    rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))
+    return [row[-1] for row in rows]
+
+
+def check_plan(plan, index):
+    """
+    An endpoint query passes when the planner walks the expected index and
+    does not add a sort step on top of it.
+    """
+    text = '\n'.join(plan)
+    if index not in text:
+        return f'expected an index scan on {index}'
+    if 'Sort' in text or 'TEMP B-TREE FOR ORDER BY' in text:
+        return 'plan sorts rows after the filter'
+    return None
+
+
+def run_review_plan_checks(trail_id=None, user_id=None):
+    """
+    EXPLAIN every review listing query and report whether it is served by
+    its composite index.
+
+    Planners prefer sequential scans on tiny tables, so run this against a
+    database seeded with a realistic number of reviews.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('ANALYZE reviews'))
+
+    trail_id = trail_id or busiest(Review.trail_id)
+    user_id = user_id or busiest(Review.user_id)
+    if trail_id is None or user_id is None:
+        return None
+
+    results = []
+    for label, query, index in review_listing_cases(trail_id, user_id):
+        plan = explain(query)
+        results.append((label, index, check_plan(plan, index), plan))
+    return results
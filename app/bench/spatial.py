@@ -0,0 +1,75 @@
+import random
+import statistics
+import time
+
+from app.models import db
+from app.services.spatial_index import MemorySpatialIndex, postgis_spatial_backend
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _summary(times):
+    times = sorted(times)
+    return {
+        'mean_ms': round(statistics.mean(times), 3),
+        'p50_ms': round(times[len(times) // 2], 3),
+        'p95_ms': round(times[int(len(times) * 0.95) - 1], 3)
+    }
+
+
+def run_spatial_benchmark(iterations=200, seed=1):
+    """
+    Time bbox, within-radius and nearest-N lookups on the in-memory index
+    and, on PostgreSQL, on the PostGIS path. Also reports how often both
+    backends returned the same trails for the same query.
+    """
+    memory = MemorySpatialIndex()
+    _, build_ms = _timed(memory.build)
+    tree, ids = memory._ensure_tree()
+    if not len(ids):
+        return None
+
+    min_lon, min_lat, max_lon, max_lat = tree.geometries[0].bounds
+    for geometry in tree.geometries[1:]:
+        a, b, c, d = geometry.bounds
+        min_lon, min_lat, max_lon, max_lat = min(min_lon, a), min(min_lat, b), max(max_lon, c), max(max_lat, d)
+
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(iterations):
+        lon, lat = rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)
+        span = rng.uniform(0.01, 0.2)
+        queries.append({
+            'bbox': (lon - span, lat - span, lon + span, lat + span, 100),
+            'radius': (lon, lat, rng.uniform(1, 25), 20),
+            'nearest': (lon, lat, None, 10)
+        })
+
+    backends = {'memory': memory}
+    if db.engine.dialect.name == 'postgresql':
+        backends['postgis'] = postgis_spatial_backend
+
+    report = {'trails': len(ids), 'memory_build_ms': round(build_ms, 1), 'queries': {}}
+    results = {}
+    for name, backend in backends.items():
+        for kind in ('bbox', 'radius', 'nearest'):
+            method = backend.in_bbox if kind == 'bbox' else backend.nearby
+            times = []
+            for i, query in enumerate(queries):
+                result, elapsed = _timed(method, *query[kind])
+                times.append(elapsed)
+                results[(name, kind, i)] = [row[0] if isinstance(row, tuple) else row for row in result]
+            report['queries'][f'{name} {kind}'] = _summary(times)
+
+    if 'postgis' in backends:
+        report['agreement'] = {
+            kind: round(sum(
+                results[('memory', kind, i)] == results[('postgis', kind, i)] for i in range(iterations)
+            ) / iterations, 3)
+            for kind in ('bbox', 'radius', 'nearest')
+        }
+    return report
@@ -0,0 +1,93 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+# Runs in a fresh interpreter so nothing is imported yet. Prints one JSON
+# line: import time, create_app time, first request time and peak RSS
+_PROBE = r'''
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+client = flask_app.test_client()
+status = client.get(sys.argv[1]).status_code
+served = time.perf_counter()
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss_kb //= 1024
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'rss_mb': rss_kb / 1024,
+    'status': status
+}))
+'''
+
+METRICS = ('import_ms', 'create_app_ms', 'first_request_ms', 'time_to_first_request_ms', 'rss_mb')
+
+
+def _probe(path):
+    env = dict(os.environ)
+    # Measure a web worker, not a CLI process (which also loads alembic)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE, path],
+        capture_output=True, text=True, env=env, check=True
+    ).stdout
+    sample = json.loads(output.strip().splitlines()[-1])
+    sample['time_to_first_request_ms'] = sample['import_ms'] + sample['create_app_ms'] + sample['first_request_ms']
+    return sample
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_startup_benchmark(runs=5, path='/api/trails?limit=1'):
+    """
+    Start the app `runs` times in fresh interpreters, each serving one
+    request, and report the median of every startup metric
+    """
+    samples = [_probe(path) for _ in range(runs)]
+    return {
+        'recorded_at': datetime.utcnow().isoformat(),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'runs': runs,
+        'path': path,
+        'status': samples[-1]['status'],
+        **{
+            metric: round(statistics.median(sample[metric] for sample in samples), 1)
+            for metric in METRICS
+        }
+    }
+
+
+def previous_result(history_path):
+    """Last result recorded in a JSONL history file, None if there is none"""
+    try:
+        with open(history_path) as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def record_result(history_path, result):
+    directory = os.path.dirname(history_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(history_path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
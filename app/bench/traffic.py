@@ -0,0 +1,269 @@
+"""
+Record API traffic to JSONL and replay it against a running instance.
+
+Recording is off unless TRAFFIC_LOG names a file. Every /api request then
+appends one line: method, path, query args, the authenticated user id,
+the matched URL rule (so /api/trails/12 and /api/trails/40 group as
+/api/trails/<int:id>), status and server time. JSON bodies of writes are
+kept too (up to TRAFFIC_LOG_MAX_BODY bytes) so writes can be replayed,
+except those of /api/auth/ (replay logs in from the credentials file) and
+with password-like keys blanked, so the log never holds credentials.
+
+Replay sends the recorded requests over HTTP at a fixed rate from a pool
+of threads, logging in as the recorded user when the credentials file has
+them. The report groups results per endpoint (method + URL rule) with
+sorted keys, so two reports can be diffed or run through `flask bench
+compare`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import http.cookiejar
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from flask import g, request
+from flask_login import current_user
+
+# Bodies of these paths are never recorded
+UNRECORDED_BODY_PREFIXES = ('/api/auth/',)
+# Keys whose values are blanked in the recorded bodies
+SECRET_KEYS = ('password', 'secret', 'token', 'csrf')
+
+
+def _scrub(value):
+    """A JSON body with the values of password-like keys blanked"""
+    if isinstance(value, dict):
+        return {
+            key: '[redacted]' if any(secret in key.lower() for secret in SECRET_KEYS) else _scrub(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_scrub(item) for item in value]
+    return value
+
+
+class TrafficRecorder:
+
+    def __init__(self, path, sample=1.0, max_body=65536):
+        self.path = path
+        self.sample = sample
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        self._file = None
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._record)
+
+    def _start(self):
+        g.traffic_started = time.perf_counter()
+
+    def _record(self, response):
+        if not request.path.startswith('/api/') or random.random() >= self.sample:
+            return response
+
+        entry = {
+            'ts': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'args': list(request.args.items(multi=True)),
+            'user_id': current_user.get_id() if current_user.is_authenticated else None,
+            'endpoint': request.url_rule.rule if request.url_rule else None,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.get('traffic_started', time.perf_counter())) * 1000, 2),
+        }
+        if request.method not in ('GET', 'HEAD') and request.is_json \
+                and not request.path.startswith(UNRECORDED_BODY_PREFIXES) \
+                and (request.content_length or 0) <= self.max_body:
+            entry['json'] = _scrub(request.get_json(silent=True))
+
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            # Opened lazily, so a preloading master never holds the handle
+            if self._file is None:
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(line)
+        return response
+
+
+def register_traffic_log(app):
+    path = app.config.get('TRAFFIC_LOG')
+    if path:
+        TrafficRecorder(
+            path,
+            app.config.get('TRAFFIC_LOG_SAMPLE', 1.0),
+            app.config.get('TRAFFIC_LOG_MAX_BODY', 65536)
+        ).init_app(app)
+
+
+def read_traffic(path, include_writes=False, limit=None):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['method'] not in ('GET', 'HEAD') and not include_writes:
+                continue
+            entries.append(entry)
+            if limit and len(entries) >= limit:
+                break
+    return entries
+
+
+class _Clients:
+    """One cookie-keeping opener per recorded user, logged in on first use"""
+
+    def __init__(self, base_url, credentials):
+        self.base_url = base_url
+        self.credentials = credentials
+        self._openers = {}
+        self._lock = threading.Lock()
+
+    def _login(self, opener, login):
+        # The first response sets the session and csrf_token cookies the
+        # login form validates against
+        opener.open(f'{self.base_url}/api/auth/').close()
+        body = json.dumps({'email': login['email'], 'password': login['password']}).encode()
+        opener.open(urllib.request.Request(
+            f'{self.base_url}/api/auth/login', data=body, method='POST',
+            headers={'Content-Type': 'application/json'}
+        )).close()
+
+    def get(self, user_id):
+        key = user_id if user_id is not None and str(user_id) in self.credentials else None
+        with self._lock:
+            opener = self._openers.get(key)
+            if opener is None:
+                opener = urllib.request.build_opener(
+                    urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+                if key is not None:
+                    try:
+                        self._login(opener, self.credentials[str(key)])
+                    except urllib.error.HTTPError:
+                        pass
+                self._openers[key] = opener
+        return opener
+
+
+def _send(clients, base_url, entry, timeout):
+    url = base_url + entry['path']
+    if entry.get('args'):
+        url += '?' + urllib.parse.urlencode([tuple(pair) for pair in entry['args']])
+    data = None
+    headers = {}
+    if entry.get('json') is not None:
+        data = json.dumps(entry['json']).encode()
+        headers['Content-Type'] = 'application/json'
+    opener = clients.get(entry.get('user_id'))
+
+    try:
+        with opener.open(urllib.request.Request(url, data=data, method=entry['method'], headers=headers),
+                         timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def _percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def _summarize(results, elapsed):
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status is None or status >= 500)
+    client_errors = sum(1 for status, _ in results if status is not None and 400 <= status < 500)
+    return {
+        'requests': len(results),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'p50_ms': round(_percentile(latencies, 0.5), 2),
+        'p90_ms': round(_percentile(latencies, 0.9), 2),
+        'p99_ms': round(_percentile(latencies, 0.99), 2),
+        'error_rate': round(errors / len(results), 4),
+        'client_error_rate': round(client_errors / len(results), 4),
+    }
+
+
+def replay(entries, base_url, rate=None, concurrency=8, credentials=None, timeout=30):
+    """
+    Send the entries in order, starting request i at i / rate seconds
+    (as fast as the pool allows without a rate). Returns the report.
+
+    With a rate, latency counts from when a request was due rather than
+    when a free thread sent it, so a saturated server shows up as latency
+    instead of silently lowering the offered load.
+    """
+    base_url = base_url.rstrip('/')
+    clients = _Clients(base_url, credentials or {})
+    results = [None] * len(entries)
+
+    def run(index, entry, due):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        status = _send(clients, base_url, entry, timeout)
+        results[index] = (status, (time.perf_counter() - (due if rate else sent)) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run, index, entry, start + index / rate if rate else start)
+            for index, entry in enumerate(entries)
+        ]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+
+    grouped = {}
+    for entry, result in zip(entries, results):
+        key = f"{entry['method']} {entry.get('endpoint') or entry['path']}"
+        grouped.setdefault(key, []).append(result)
+
+    return {
+        'recorded_at': datetime.utcnow().isoformat(),
+        'base_url': base_url,
+        'rate': rate,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'overall': _summarize(results, elapsed),
+        'endpoints': {key: _summarize(grouped[key], elapsed) for key in sorted(grouped)},
+    }
+
+
+def compare(baseline, candidate, threshold=0.1):
+    """
+    Per endpoint changes between two replay reports. A row regresses when
+    p50 or p90 latency grows by more than `threshold` or the error rate
+    goes up.
+    """
+    rows = []
+    for key in sorted(set(baseline['endpoints']) | set(candidate['endpoints'])):
+        before = baseline['endpoints'].get(key)
+        after = candidate['endpoints'].get(key)
+        if before is None or after is None:
+            rows.append({'endpoint': key, 'only_in': 'candidate' if before is None else 'baseline'})
+            continue
+
+        row = {'endpoint': key, 'regressed': False}
+        for metric in ('p50_ms', 'p90_ms', 'throughput_rps'):
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            row[metric] = (before[metric], after[metric], round(change, 4))
+            if metric != 'throughput_rps' and change > threshold:
+                row['regressed'] = True
+        row['error_rate'] = (before['error_rate'], after['error_rate'])
+        if after['error_rate'] > before['error_rate']:
+            row['regressed'] = True
+        rows.append(row)
+    return rows
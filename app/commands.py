@@ -0,0 +1,120 @@
+from flask.cli import AppGroup
+import click
+import json
+
+# Creates a reviews group for data maintenance commands
+# So we can type `flask reviews --help`
+review_commands = AppGroup('reviews')
+
+# Creates a stats group for the users' profile counters
+# So we can type `flask stats --help`
+stats_commands = AppGroup('stats')
+
+# Creates a forecast group for the trail condition forecasts
+# So we can type `flask forecast --help`
+forecast_commands = AppGroup('forecast')
+
+# Creates a trails group for trail data maintenance
+# So we can type `flask trails --help`
+trail_commands = AppGroup('trails')
+
+# Creates an assets group for the React build
+# So we can type `flask assets --help`
+asset_commands = AppGroup('assets')
+
+
+def _read_items(path):
+    """Reviews from a JSON array file or a JSON lines file"""
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# Creates the `flask reviews ingest` command
+@review_commands.command('ingest')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, help='Reviews validated and committed together')
+@click.option('--chunk-size', default=500, help='Rows per INSERT statement')
+@click.option('--show-errors', is_flag=True, help='Print every rejected review')
+def ingest(path, batch_size, chunk_size, show_errors):
+    """Bulk load partner reviews from a JSON or JSON lines file"""
+    from app.services.review_ingest import ingest_reviews
+
+    items = _read_items(path)
+    created = duplicates = rejected = 0
+    for start in range(0, len(items), batch_size):
+        result = ingest_reviews(items[start:start + batch_size], chunk_size)
+        created += len(result['created'])
+        duplicates += len(result['duplicates'])
+        rejected += len(result['errors'])
+        if show_errors:
+            for index, errors in result['errors'].items():
+                click.echo(f'#{start + index}: {errors}')
+
+    # Region packs notice the new reviews through their version check on
+    # the next download, no need to rebuild them from this process
+    click.echo(f'{created} created, {duplicates} duplicates skipped, {rejected} rejected')
+
+
+# Creates the `flask forecast train` command
+@forecast_commands.command('train')
+@click.option('--full', is_flag=True, help='Retrain every trail, not only those with new reviews')
+@click.option('--chunk-size', default=1000, help='Trails trained and committed together')
+def train(full, chunk_size):
+    """Train the seasonal condition forecasts from the review history"""
+    from app.services.condition_forecast import train_forecasts
+
+    trained, dropped = train_forecasts(full, chunk_size)
+    click.echo(f'{trained} trails trained, {dropped} without condition reports')
+
+
+# Creates the `flask assets precompress` command
+@asset_commands.command('precompress')
+@click.option('--directory', type=click.Path(exists=True, file_okay=False),
+              help='Build output to compress (defaults to the static folder)')
+@click.option('--min-size', default=1024, help='Smaller files are served as they are')
+def precompress(directory, min_size):
+    """Write .gz/.br siblings of the built static assets"""
+    from flask import current_app
+    from app.compression import precompress_directory, brotli
+
+    if brotli is None:
+        click.echo('brotli is not installed, writing gzip only')
+    written = precompress_directory(directory or current_app.static_folder, min_size)
+    for path, encoding, size, compressed in written:
+        click.echo(f'{encoding:<5} {size:>9} -> {compressed:>9} bytes  {path}')
+    click.echo(f'{len(written)} files written')
+
+
+# Creates the `flask stats reconcile` command
+@stats_commands.command('reconcile')
+@click.option('--user-id', 'user_ids', type=int, multiple=True, help='Only this user (repeatable)')
+@click.option('--chunk-size', default=5000, help='Users recomputed and committed together')
+def reconcile(user_ids, chunk_size):
+    """Recompute the users' profile counters and repair the drifted ones"""
+    from app.models import UserStats
+
+    checked, corrected = UserStats.reconcile(list(user_ids) or None, chunk_size)
+    click.echo(f'{checked} users checked, {corrected} corrected')
+
+
+# Creates the `flask trails repair-geometry` command
+@trail_commands.command('repair-geometry')
+@click.option('--chunk-size', default=500, help='Trails checked and committed together')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing')
+def repair_geometry(chunk_size, dry_run):
+    """Clean the stored trail geometries, fill missing cached polylines and clear placeholders"""
+    from app.services.trail_geometry import repair_geometries
+
+    counts, invalid = repair_geometries(chunk_size, dry_run)
+    for trail_id, reason in invalid.items():
+        click.echo(f'trail {trail_id}: {reason}')
+    click.echo(
+        f"{counts['checked']} trails checked, {counts['repaired']} repaired "
+        f"({counts['duplicates']} duplicate and {counts['spikes']} spike points dropped, "
+        f"{counts['simplified']} simplified), {counts['cleared']} placeholders cleared, "
+        f"{counts['cached']} polylines cached, "
+        f"{len(invalid)} invalid left as they are" + (' (dry run)' if dry_run else '')
+    )
@@ -0,0 +1,166 @@
+"""
+Response compression and pre-compressed static assets.
+
+JSON responses (including the +json geometry media types) of at least
+COMPRESS_MIN_SIZE bytes are encoded with brotli or gzip, whichever the
+client accepts, preferring brotli. Brotli is optional: without the
+package installed only gzip is offered. Streamed and file responses are
+left alone (event streams must not be buffered, region packs are gzip
+already).
+
+Static files from the Vite build are served from `<file>.br` / `<file>.gz`
+siblings when the client accepts them, written ahead of time by `flask
+assets precompress`, so no asset is compressed per request. Vite names
+bundles with a content hash (assets/index-3d04204a.css), those get a
+one-year immutable cache lifetime; anything else (index.html) is
+revalidated on every use.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from flask import request, send_file, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+SUFFIXES = {BROTLI: '.br', GZIP: '.gz'}
+
+# File types worth compressing ahead of time
+PRECOMPRESS_EXTENSIONS = ('.js', '.css', '.html', '.svg', '.json', '.map', '.txt', '.xml', '.ico', '.wasm')
+# Vite's content-hashed output names, safe to cache forever
+HASHED_ASSET = re.compile(r'(^|/)assets/.+-[0-9a-zA-Z_]{8,}\.[0-9a-z]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def available_encodings():
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def negotiate_encoding(encodings=None):
+    """The best content coding both sides support, None for identity"""
+    encodings = encodings or available_encodings()
+    best = request.accept_encodings.best_match(encodings)
+    if best is None or request.accept_encodings[best] <= 0:
+        return None
+    return best
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    if encoding == BROTLI:
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def _is_json(mimetype):
+    return mimetype == 'application/json' or (mimetype or '').endswith('+json')
+
+
+def register_compression(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+
+    @app.after_request
+    def compress_response(response):
+        if not _is_json(response.mimetype) or response.direct_passthrough or response.is_streamed:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if response.status_code < 200 or response.status_code in (204, 206) \
+                or 'Content-Encoding' in response.headers or request.method == 'HEAD':
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+
+        response.set_data(compress(data, encoding, gzip_level, brotli_quality))
+        response.headers['Content-Encoding'] = encoding
+        # An entity tag names one representation
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+
+    # Serve the React build through send_static_asset
+    app.view_functions['static'] = lambda filename: send_static_asset(app, filename)
+
+
+def send_static_asset(app, filename):
+    """
+    A file from the static folder, its pre-compressed sibling when the
+    client accepts one, with cache headers for its kind of file
+    """
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    # Pre-compressed siblings in the client's order of preference. Brotli
+    # files are served without the brotli package, clients decode them
+    accepted = sorted(
+        (encoding for encoding in SUFFIXES if request.accept_encodings[encoding] > 0),
+        key=lambda encoding: -request.accept_encodings[encoding]
+    )
+    served, encoding = path, None
+    for candidate in accepted:
+        if os.path.isfile(path + SUFFIXES[candidate]):
+            served, encoding = path + SUFFIXES[candidate], candidate
+            break
+
+    hashed = HASHED_ASSET.search(filename.replace(os.sep, '/')) is not None
+    response = send_file(
+        served,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        conditional=True,
+        etag=True,
+        max_age=IMMUTABLE_MAX_AGE if hashed else 0
+    )
+    if hashed:
+        response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.endswith(PRECOMPRESS_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def precompress_directory(directory, min_size=1024):
+    """
+    Write .gz (and .br, with brotli installed) next to every compressible
+    file of directory at maximum compression. Up to date siblings are
+    skipped and a sibling that would not be smaller is not written.
+    Returns (path, encoding, original bytes, compressed bytes) per file.
+    """
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            size = os.path.getsize(path)
+            if size < min_size:
+                continue
+
+            with open(path, 'rb') as f:
+                data = None
+                for encoding in available_encodings():
+                    target = path + SUFFIXES[encoding]
+                    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                        continue
+                    data = data if data is not None else f.read()
+                    encoded = compress(data, encoding, gzip_level=9, brotli_quality=11)
+                    if len(encoded) >= size:
+                        continue
+                    with open(target, 'wb') as out:
+                        out.write(encoded)
+                    written.append((path, encoding, size, len(encoded)))
+    return written
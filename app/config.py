@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class Config:
@@ -12,3 +13,57 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         'DATABASE_URL').replace('postgres://', 'postgresql://')
     SQLALCHEMY_ECHO = True
+    # Spatial queries: 'postgis' or 'memory' (defaults to postgis on
+    # PostgreSQL). The in-memory index is rebuilt when older than max age
+    SPATIAL_BACKEND = os.environ.get('SPATIAL_BACKEND')
+    SPATIAL_INDEX_MAX_AGE = int(os.environ.get('SPATIAL_INDEX_MAX_AGE', 300))
+    ROUTE_GRAPH_MAX_AGE = int(os.environ.get('ROUTE_GRAPH_MAX_AGE', 900))
+    CLUSTER_INDEX_MAX_AGE = int(os.environ.get('CLUSTER_INDEX_MAX_AGE', 300))
+    # Trail listing cache: ordered ids per filter combination and rendered
+    # trails, dropped on this worker's writes and after max age for others'
+    TRAIL_QUERY_CACHE_SIZE = int(os.environ.get('TRAIL_QUERY_CACHE_SIZE', 256))
+    TRAIL_OBJECT_CACHE_SIZE = int(os.environ.get('TRAIL_OBJECT_CACHE_SIZE', 5000))
+    TRAIL_CACHE_MAX_AGE = int(os.environ.get('TRAIL_CACHE_MAX_AGE', 60))
+    # Trail geometries with more vertices are simplified to fit
+    TRAIL_MAX_VERTICES = int(os.environ.get('TRAIL_MAX_VERTICES', 5000))
+    # Background jobs (GPX track verification)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 16))
+    TRACK_UPLOAD_DIR = os.environ.get(
+        'TRACK_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'trailhub-tracks'))
+    TRACK_MAX_UPLOAD_BYTES = int(os.environ.get('TRACK_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+    TRACK_MAX_POINTS = int(os.environ.get('TRACK_MAX_POINTS', 50000))
+    # Offline region packs
+    PACK_CACHE_DIR = os.environ.get(
+        'PACK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'trailhub-packs'))
+    PACK_REVIEWS_PER_TRAIL = int(os.environ.get('PACK_REVIEWS_PER_TRAIL', 20))
+    PACK_SIMPLIFY_METERS = float(os.environ.get('PACK_SIMPLIFY_METERS', 5))
+    # Longest a worker trusts its cached region data versions (others' writes)
+    PACK_VERSION_MAX_AGE = int(os.environ.get('PACK_VERSION_MAX_AGE', 60))
+    # Record /api traffic as JSONL for `flask bench replay` (off when unset)
+    TRAFFIC_LOG = os.environ.get('TRAFFIC_LOG')
+    TRAFFIC_LOG_SAMPLE = float(os.environ.get('TRAFFIC_LOG_SAMPLE', 1.0))
+    # Larger write bodies are recorded without their JSON
+    TRAFFIC_LOG_MAX_BODY = int(os.environ.get('TRAFFIC_LOG_MAX_BODY', 65536))
+    # Largest batch accepted by POST /api/reviews/bulk
+    BULK_REVIEW_LIMIT = int(os.environ.get('BULK_REVIEW_LIMIT', 1000))
+    # Writes sent with an Idempotency-Key: how long responses are kept for
+    # retries, when an unfinished claim is taken over, how often to purge
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+    IDEMPOTENCY_PURGE_SECONDS = int(os.environ.get('IDEMPOTENCY_PURGE_SECONDS', 300))
+    # Sync API: change log entries younger than this are held back so a
+    # slow transaction cannot commit a lower sequence number behind a client
+    SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', 1))
+    # Trail event streams (SSE). 'changelog' polls the change log while a
+    # worker has listeners, so writes in any worker reach every stream;
+    # 'local' only reaches listeners of the writing process
+    TRAIL_EVENTS_BACKEND = os.environ.get('TRAIL_EVENTS_BACKEND', 'changelog')
+    TRAIL_EVENTS_POLL_SECONDS = float(os.environ.get('TRAIL_EVENTS_POLL_SECONDS', 1))
+    TRAIL_EVENTS_MAX_CONNECTIONS = int(os.environ.get('TRAIL_EVENTS_MAX_CONNECTIONS', 24))
+    TRAIL_EVENTS_BUFFER = int(os.environ.get('TRAIL_EVENTS_BUFFER', 100))
+    TRAIL_EVENTS_HEARTBEAT = float(os.environ.get('TRAIL_EVENTS_HEARTBEAT', 15))
+    # JSON responses of at least this many bytes are gzip/brotli encoded
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
@@ -0,0 +1,189 @@
+"""
+Idempotent writes.
+
+A client that may retry a write (mobile apps on flaky connections) sends
+an Idempotency-Key header, any unique string of up to 255 characters.
+The first request with a key runs normally and its response is recorded.
+A retry with the same key from the same user gets the recorded response
+back, marked with an Idempotent-Replayed header, without the request
+running again: no validation, no insert, no rating recomputation.
+
+- A key reused for a different request (method, path, query string or
+  JSON body; content type and length for uploads) is rejected with 422.
+- A retry arriving while the first request still runs gets 409 with
+  Retry-After. A claim older than IDEMPOTENCY_LOCK_SECONDS belongs to a
+  worker that died and is taken over.
+- 5xx and 3xx responses are not recorded, the key is released so a retry
+  runs.
+- Records expire after IDEMPOTENCY_TTL_SECONDS, each worker purges the
+  expired ones at most every IDEMPOTENCY_PURGE_SECONDS.
+
+Writes without the header behave as before. The key store is written on
+connections of its own, never through the request's session, so it never
+commits (or rolls back) a route's pending changes.
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+
+from flask import Response, g, request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, IdempotencyKey
+from app.models.idempotency_key import PENDING, COMPLETED
+
+HEADER = 'Idempotency-Key'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+MAX_KEY_LENGTH = 255
+# Headers recorded and replayed with a response
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+# Logging in and out set the session cookie, which is never recorded
+EXCLUDED_PREFIXES = ('/api/auth/',)
+
+_purge_lock = threading.Lock()
+_next_purge = 0.0
+
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.full_path}\n'.encode())
+    if request.is_json:
+        digest.update(request.get_data(cache=True))
+    else:
+        # Uploads (GPX tracks) are left unread: the view streams them to
+        # disk, reading them here would leave it an empty stream and hold
+        # the file in memory. Their type and size stand in for the body
+        digest.update(f'{request.content_type} {request.content_length}'.encode())
+    return digest.hexdigest()
+
+
+def _purge_expired(interval):
+    """Delete expired keys, at most once per interval seconds per worker"""
+    global _next_purge
+    now = time.monotonic()
+    with _purge_lock:
+        if now < _next_purge:
+            return
+        _next_purge = now + interval
+
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as connection:
+        connection.execute(db.delete(table).where(table.c.expires_at < datetime.utcnow()))
+
+
+def _insert(values):
+    """The id of the new pending row, None when the key is taken"""
+    try:
+        with db.engine.begin() as connection:
+            return connection.execute(
+                db.insert(IdempotencyKey.__table__).values(**values)
+            ).inserted_primary_key[0]
+    except IntegrityError:
+        return None
+
+
+def _existing(user_id, key):
+    table = IdempotencyKey.__table__
+    with db.engine.connect() as connection:
+        return connection.execute(
+            db.select(table).where(table.c.user_id == user_id, table.c.key == key)
+        ).first()
+
+
+def _run(statement):
+    with db.engine.begin() as connection:
+        return connection.execute(statement).rowcount
+
+
+def _replay(row):
+    response = Response(row.response_body or b'', status=row.response_status)
+    for name, value in json.loads(row.response_headers or '{}').items():
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def register_idempotency(app):
+    table = IdempotencyKey.__table__
+
+    @app.before_request
+    def claim_idempotency_key():
+        key = request.headers.get(HEADER)
+        if key is None or request.method not in WRITE_METHODS or not request.path.startswith('/api/') \
+                or request.path.startswith(EXCLUDED_PREFIXES):
+            return None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return {'message': 'Validation error',
+                    'errors': {HEADER: f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}}, 400
+
+        _purge_expired(app.config.get('IDEMPOTENCY_PURGE_SECONDS', 300))
+        now = datetime.utcnow()
+        user_id = int(current_user.get_id()) if current_user.is_authenticated else 0
+        fingerprint = _fingerprint()
+        values = {
+            'user_id': user_id, 'key': key, 'method': request.method, 'path': request.path,
+            'fingerprint': fingerprint, 'status': PENDING, 'created_at': now,
+            'expires_at': now + timedelta(seconds=app.config.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+        }
+
+        claim, row = _insert(values), None
+        if claim is None:
+            row = _existing(user_id, key)
+            if row is not None and row.expires_at < now:
+                # Expired but not purged yet, the key is free again
+                _run(db.delete(table).where(table.c.id == row.id))
+                claim = _insert(values)
+                row = None if claim else _existing(user_id, key)
+
+        if claim is None:
+            if row is None:
+                return {'message': f'{HEADER} could not be claimed, retry the request'}, 409
+            if row.fingerprint != fingerprint:
+                return {'message': f'{HEADER} was already used for a different request'}, 422
+            if row.status == COMPLETED:
+                return _replay(row)
+
+            # Still running, unless the worker running it died
+            stale = now - timedelta(seconds=app.config.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+            if row.created_at >= stale or not _run(
+                db.update(table)
+                .where(table.c.id == row.id, table.c.status == PENDING, table.c.created_at == row.created_at)
+                .values(created_at=now)
+            ):
+                return {'message': f'A request with this {HEADER} is still in progress'}, 409, {'Retry-After': '1'}
+            claim = row.id
+
+        g.idempotency_claim = claim
+        return None
+
+    @app.after_request
+    def record_idempotent_response(response):
+        claim = g.pop('idempotency_claim', None)
+        if claim is None:
+            return response
+
+        if response.status_code >= 500 or 300 <= response.status_code < 400 \
+                or response.is_streamed or response.direct_passthrough:
+            _run(db.delete(table).where(table.c.id == claim))
+            return response
+
+        headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+        _run(
+            db.update(table).where(table.c.id == claim).values(
+                status=COMPLETED,
+                response_status=response.status_code,
+                response_headers=json.dumps(headers),
+                response_body=response.get_data()
+            )
+        )
+        return response
+
+    @app.teardown_request
+    def release_idempotency_key(exc):
+        # The request failed before a response was recorded
+        claim = g.pop('idempotency_claim', None)
+        if claim is not None:
+            _run(db.delete(table).where(table.c.id == claim))
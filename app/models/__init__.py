@@ -2,4 +2,11 @@ from .db import db
 from .user import User
 from .trail import Trail
 from .review import Review
-from .db import environment, SCHEMA
+from .review_vote import ReviewVote
+from .track_verification import TrackVerification
+from .condition_rollup import TrailConditionRollup
+from .change_log import ChangeLog
+from .user_stats import UserStats
+from .trail_forecast import TrailForecast
+from .idempotency_key import IdempotencyKey
+from .db import environment, SCHEMA, get_many
@@ -0,0 +1,141 @@
+from .db import db, environment, SCHEMA
+from .trail import Trail
+from .review import Review
+from sqlalchemy import event, inspect
+from datetime import datetime, timedelta
+
+TRAIL = 'trail'
+REVIEW = 'review'
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+class ChangeLog(db.Model):
+    """
+    Append-only log of trail and review writes, the backing store of the
+    sync API. The sequence number is the sync token: a client that has
+    seen everything up to seq N asks for seq > N.
+
+    ORM writes are logged by the mapper events below, in the same
+    transaction as the write, so a change and its log entry commit or roll
+    back together. Deletes leave a tombstone (op=delete), including the
+    reviews removed by a trail delete's cascade. Writes that bypass the ORM
+    (bulk inserts, atomic counter updates) log with record_reviews /
+    record_trails.
+    """
+    __tablename__ = 'change_log'
+
+    # Per-row history (first and latest entry of a trail or review)
+    __table_args__ = (
+        db.Index('ix_change_log_entity', 'entity', 'entity_id', 'seq'),
+        {'schema': SCHEMA} if environment == "production" else {}
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # trail, review
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    # The trail a change belongs to (itself for trails), no foreign key so
+    # tombstones outlive the row
+    trail_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.op,
+            'trail_id': self.trail_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+    @classmethod
+    def record(cls, entity, entity_id, op, trail_id=None, connection=None):
+        statement = db.insert(cls.__table__).values(
+            entity=entity, entity_id=entity_id, op=op, trail_id=trail_id, created_at=datetime.utcnow()
+        )
+        (connection or db.session).execute(statement)
+
+    @classmethod
+    def record_reviews(cls, review_ids=None, op=UPSERT, trail_ids=None):
+        """Log many reviews, by id or every review of trail_ids, with one INSERT ... SELECT"""
+        if not review_ids and not trail_ids:
+            return
+        rows = db.select(
+            db.literal(REVIEW), Review.id, db.literal(op), Review.trail_id, db.literal(datetime.utcnow())
+        ).where(Review.id.in_(review_ids) if review_ids else Review.trail_id.in_(trail_ids))
+        db.session.execute(db.insert(cls.__table__).from_select(
+            ['entity', 'entity_id', 'op', 'trail_id', 'created_at'], rows
+        ))
+
+    @classmethod
+    def record_trails(cls, trail_ids, op=UPSERT):
+        """Log many trails with one INSERT ... SELECT"""
+        if not trail_ids:
+            return
+        rows = db.select(
+            db.literal(TRAIL), Trail.id, db.literal(op), Trail.id, db.literal(datetime.utcnow())
+        ).where(Trail.id.in_(trail_ids))
+        db.session.execute(db.insert(cls.__table__).from_select(
+            ['entity', 'entity_id', 'op', 'trail_id', 'created_at'], rows
+        ))
+
+    @classmethod
+    def since(cls, seq, limit, settle_seconds=0):
+        """
+        Entries after seq in order. Entries younger than settle_seconds are
+        held back: sequence numbers are taken at insert, not at commit, so
+        a slow transaction could otherwise commit a lower seq after a
+        client already moved past it.
+        """
+        query = cls.query.filter(cls.seq > seq)
+        if settle_seconds:
+            query = query.filter(cls.created_at <= datetime.utcnow() - timedelta(seconds=settle_seconds))
+        return query.order_by(cls.seq).limit(limit).all()
+
+    @classmethod
+    def head(cls, settle_seconds=0):
+        """The latest seq, of entries at least settle_seconds old (see since)"""
+        query = db.session.query(db.func.coalesce(db.func.max(cls.seq), 0))
+        if settle_seconds:
+            query = query.filter(cls.created_at <= datetime.utcnow() - timedelta(seconds=settle_seconds))
+        return query.scalar()
+
+
+def _has_changes(target):
+    """after_update also fires for flushed objects without net column changes"""
+    state = inspect(target)
+    return any(state.attrs[column.key].history.has_changes() for column in state.mapper.column_attrs)
+
+
+@event.listens_for(Trail, 'after_insert')
+def _log_trail_insert(mapper, connection, trail):
+    ChangeLog.record(TRAIL, trail.id, UPSERT, trail.id, connection)
+
+
+@event.listens_for(Trail, 'after_update')
+def _log_trail_update(mapper, connection, trail):
+    if _has_changes(trail):
+        ChangeLog.record(TRAIL, trail.id, UPSERT, trail.id, connection)
+
+
+@event.listens_for(Trail, 'after_delete')
+def _log_trail_delete(mapper, connection, trail):
+    ChangeLog.record(TRAIL, trail.id, DELETE, trail.id, connection)
+
+
+@event.listens_for(Review, 'after_insert')
+def _log_review_insert(mapper, connection, review):
+    ChangeLog.record(REVIEW, review.id, UPSERT, review.trail_id, connection)
+
+
+@event.listens_for(Review, 'after_update')
+def _log_review_update(mapper, connection, review):
+    if _has_changes(review):
+        ChangeLog.record(REVIEW, review.id, UPSERT, review.trail_id, connection)
+
+
+@event.listens_for(Review, 'after_delete')
+def _log_review_delete(mapper, connection, review):
+    ChangeLog.record(REVIEW, review.id, DELETE, review.trail_id, connection)
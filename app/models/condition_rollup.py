@@ -0,0 +1,178 @@
+from .db import db, environment, SCHEMA, add_prefix_for_prod
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+
+
+# Review fields that feed the rollup, keyed by the name used in the API
+CONDITION_FIELDS = {
+    'weather': 'weather_condition',
+    'trail': 'trail_condition',
+    'crowd': 'crowd_level'
+}
+
+# Accepted values of each condition field, in a fixed order (the forecast
+# tables index values by their position)
+CONDITION_VALUES = {
+    'weather': ('sunny', 'cloudy', 'rainy', 'snowy'),
+    'trail': ('excellent', 'good', 'muddy', 'icy', 'poor'),
+    'crowd': ('empty', 'light', 'moderate', 'crowded')
+}
+
+
+class TrailConditionRollup(db.Model):
+    """
+    Per trail, per hiked day count of each reported condition value.
+
+    Rows are kept up to date by the review write paths (see apply_review)
+    so the conditions endpoint only reads a handful of small rows instead
+    of scanning every review of a trail.
+    """
+    __tablename__ = 'trail_condition_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    trail_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('trails.id')), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # weather, trail, crowd
+    value = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    trail = db.relationship('Trail', back_populates='condition_rollups')
+
+    # One counter per trail/day/condition value, also serves the
+    # (trail_id, day) range scan used by summarize()
+    __table_args__ = (
+        db.UniqueConstraint('trail_id', 'day', 'kind', 'value', name='_trail_day_condition_uc'),
+        {'schema': SCHEMA} if environment == "production" else {}
+    )
+
+    @staticmethod
+    def snapshot(review):
+        """Capture the review fields the rollup depends on (before an edit)"""
+        return (
+            review.trail_id,
+            review.hiked_date,
+            {kind: getattr(review, attr) for kind, attr in CONDITION_FIELDS.items()}
+        )
+
+    @classmethod
+    def apply_review(cls, review, delta):
+        """Add (delta=1) or remove (delta=-1) a review's conditions"""
+        cls.apply_snapshot(cls.snapshot(review), delta)
+
+    @classmethod
+    def apply_snapshot(cls, snapshot, delta):
+        trail_id, day, values = snapshot
+        if not trail_id or not day:
+            return
+
+        for kind, value in values.items():
+            if not value:
+                continue
+            if delta > 0:
+                cls._increment(trail_id, day, kind, value, delta)
+            else:
+                cls.query.filter_by(trail_id=trail_id, day=day, kind=kind, value=value)\
+                    .update({cls.count: cls.count + delta}, synchronize_session=False)
+
+        if delta < 0:
+            cls.query.filter(cls.trail_id == trail_id, cls.day == day, cls.count <= 0)\
+                .delete(synchronize_session=False)
+
+    @classmethod
+    def _increment(cls, trail_id, day, kind, value, delta):
+        cls.add_counts({(trail_id, day, kind, value): delta})
+
+    @classmethod
+    def add_counts(cls, counts):
+        """
+        Add many {(trail_id, day, kind, value): count} increments with one
+        executemany upsert (bulk review ingestion)
+        """
+        if not counts:
+            return
+
+        # Atomic upsert so concurrent reviews for the same trail and day
+        # never race on the insert of a new counter row
+        dialect = db.session.get_bind().dialect.name
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(cls.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['trail_id', 'day', 'kind', 'value'],
+            set_={'count': cls.__table__.c.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt, [
+            {'trail_id': trail_id, 'day': day, 'kind': kind, 'value': value, 'count': count}
+            for (trail_id, day, kind, value), count in counts.items()
+        ])
+
+    @classmethod
+    def rebuild(cls, trail_ids=None):
+        """Recompute the rollup from the reviews table (seeding and repairs)"""
+        from .review import Review
+
+        delete = cls.query
+        if trail_ids is not None:
+            delete = delete.filter(cls.trail_id.in_(trail_ids))
+        delete.delete(synchronize_session=False)
+
+        # One INSERT ... SELECT per kind, the rows never leave the database
+        for kind, attr in CONDITION_FIELDS.items():
+            column = getattr(Review, attr)
+            rows = db.select(
+                Review.trail_id, Review.hiked_date, db.literal(kind), column, db.func.count(Review.id)
+            ).where(column.isnot(None))
+            if trail_ids is not None:
+                rows = rows.where(Review.trail_id.in_(trail_ids))
+            rows = rows.group_by(Review.trail_id, Review.hiked_date, column)
+
+            db.session.execute(
+                db.insert(cls.__table__).from_select(['trail_id', 'day', 'kind', 'value', 'count'], rows)
+            )
+        db.session.commit()
+
+    @classmethod
+    def summarize(cls, trail_id, window_days=30, half_life_days=7, today=None):
+        """
+        Time-decayed distribution of recent conditions for a trail.
+
+        Each report is weighted by 0.5 ** (age_in_days / half_life_days), so
+        yesterday's "icy" counts far more than one from three weeks ago.
+        """
+        today = today or datetime.utcnow().date()
+        since = today - timedelta(days=window_days)
+
+        rows = cls.query.with_entities(cls.day, cls.kind, cls.value, cls.count)\
+            .filter(cls.trail_id == trail_id, cls.day >= since, cls.day <= today)\
+            .all()
+
+        weights = {kind: {} for kind in CONDITION_FIELDS}
+        reports = {kind: 0 for kind in CONDITION_FIELDS}
+        last_report = None
+
+        for day, kind, value, count in rows:
+            if kind not in weights:
+                continue
+            age = (today - day).days
+            weight = count * 0.5 ** (age / half_life_days)
+            weights[kind][value] = weights[kind].get(value, 0) + weight
+            reports[kind] += count
+            if last_report is None or day > last_report:
+                last_report = day
+
+        distribution = {}
+        for kind, values in weights.items():
+            total = sum(values.values())
+            distribution[kind] = {
+                value: round(weight / total, 3) for value, weight in values.items()
+            } if total else {}
+
+        return {
+            'trail_id': trail_id,
+            'as_of': today.isoformat(),
+            'window_days': window_days,
+            'half_life_days': half_life_days,
+            'last_report': last_report.isoformat() if last_report else None,
+            'reports': reports,
+            'conditions': distribution
+        }
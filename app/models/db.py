@@ -13,3 +13,23 @@ def add_prefix_for_prod(attr):
         return f"{SCHEMA}.{attr}"
     else:
         return attr
+
+
+# helper function for fetching many rows by primary key in one query,
+# reusing any instance already in the session's identity map.
+# Returns a dict of id -> instance, ids that do not exist are left out
+def get_many(model, ids, options=()):
+    from sqlalchemy.orm.util import identity_key
+
+    found = {}
+    for id in ids:
+        instance = db.session.identity_map.get(identity_key(model, id))
+        if instance is not None:
+            found[id] = instance
+
+    missing = [id for id in ids if id not in found]
+    if missing:
+        for instance in model.query.options(*options).filter(model.id.in_(missing)):
+            found[instance.id] = instance
+
+    return found
@@ -0,0 +1,84 @@
+from sqlalchemy.orm import Load, selectinload, joinedload
+
+
+class InvalidFields(ValueError):
+    """
+    Raised when a response shaping parameter (?fields= and friends) asks
+    for something a model does not expose
+    """
+    def __init__(self, message, param='fields'):
+        super().__init__(message)
+        self.param = param
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for API responses.
+
+    FIELDS lists every public field in response order. A field renders
+    either through a `_render_<field>` method or as the plain attribute of
+    the same name. FIELD_COLUMNS names the columns a field reads when they
+    differ from the field name, and FIELD_RELATIONSHIPS maps a field to the
+    relationship it renders plus the related columns it needs (None for the
+    related model's BASIC_FIELDS). A query built with load_options() never
+    selects a column or relationship the response does not use.
+    """
+    FIELDS = ()
+    FIELD_COLUMNS = {}
+    FIELD_RELATIONSHIPS = {}
+
+    @classmethod
+    def parse_fields(cls, raw, default=None):
+        """Turn 'id,name' into a field list, None keeps the default payload"""
+        if not raw:
+            return default
+
+        fields = []
+        for name in raw.split(','):
+            name = name.strip()
+            if name and name not in fields:
+                fields.append(name)
+
+        unknown = [name for name in fields if name not in cls.FIELDS]
+        if unknown:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+
+        # Always return the id so clients can key what they receive
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        return fields
+
+    @classmethod
+    def load_options(cls, fields=None, columns=None, joined=False):
+        """
+        Query options that load only what serialize(fields) touches.
+        `columns` overrides FIELD_COLUMNS for fields rendered another way.
+        Relationships are loaded with one SELECT each after the main query,
+        or joined into the main query with `joined` (pages of many-to-one
+        relationships, where the join adds columns but no rows).
+        """
+        fields = fields or cls.FIELDS
+        field_columns = dict(cls.FIELD_COLUMNS, **(columns or {}))
+
+        loaded = {'id'}
+        options = []
+        for name in fields:
+            if name in cls.FIELD_RELATIONSHIPS:
+                relationship, related_columns = cls.FIELD_RELATIONSHIPS[name]
+                attr = getattr(cls, relationship)
+                target = attr.property.mapper.class_
+                related_columns = related_columns or target.BASIC_FIELDS
+                loader = joinedload(attr) if joined else selectinload(attr)
+                options.append(loader.load_only(*[getattr(target, c) for c in related_columns]))
+            loaded.update(field_columns.get(name, () if name in cls.FIELD_RELATIONSHIPS else (name,)))
+
+        # Bound to cls, so the options also work in multi-entity queries
+        return [Load(cls).load_only(*[getattr(cls, c) for c in sorted(loaded)])] + options
+
+    def serialize(self, fields=None, **renderers):
+        """Render the requested fields, `renderers` replace _render_<field>"""
+        data = {}
+        for name in fields or self.FIELDS:
+            render = renderers.get(name) or getattr(self, f'_render_{name}', None)
+            data[name] = render() if render else getattr(self, name)
+        return data
@@ -0,0 +1,40 @@
+from .db import db, environment, SCHEMA
+from datetime import datetime
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+
+
+class IdempotencyKey(db.Model):
+    """
+    The outcome of a write sent with an Idempotency-Key header, kept for
+    IDEMPOTENCY_TTL_SECONDS so a retry of the same request gets the
+    original response back instead of running again (see app.idempotency).
+
+    Keys are scoped to the user sending them (0 for anonymous requests).
+    A row is claimed as pending before the request runs, the unique
+    constraint settles concurrent retries, and completed with the response
+    once it is known.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    # Expired rows are purged by range on expires_at
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='_idempotency_user_key_uc'),
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+        {'schema': SCHEMA} if environment == "production" else {}
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    # SHA-256 of the method, path, query string and body
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    response_status = db.Column(db.Integer)
+    response_headers = db.Column(db.Text)
+    response_body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,115 @@
+"""
+Compact encodings for trail LineStrings.
+
+Both formats quantize coordinates to 1e-5 degrees (about 1 m), which is
+well below GPS noise on a hiking track:
+
+- polyline: Google's encoded polyline algorithm (lat, lon order), readable
+  by every mapping library
+- delta: little-endian int32 pairs (lon, lat), the first pair absolute and
+  every following pair the difference to the previous one, base64 encoded
+"""
+from array import array
+import base64
+import sys
+
+PRECISION = 5
+_FACTOR = 10 ** PRECISION
+
+GEOJSON = 'geojson'
+POLYLINE = 'polyline'
+DELTA = 'delta'
+GEOMETRY_FORMATS = (GEOJSON, POLYLINE, DELTA)
+
+
+def quantize(coordinates):
+    """[(lon, lat), ...] -> [(lon_int, lat_int), ...], dropping any z value"""
+    return [(int(round(point[0] * _FACTOR)), int(round(point[1] * _FACTOR))) for point in coordinates]
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(coordinates):
+    chunks = []
+    prev_lon = prev_lat = 0
+    for lon, lat in quantize(coordinates):
+        _encode_value(lat - prev_lat, chunks)
+        _encode_value(lon - prev_lon, chunks)
+        prev_lon, prev_lat = lon, lat
+    return ''.join(chunks)
+
+
+def decode_polyline_ints(encoded):
+    """Encoded polyline -> [(lon_int, lat_int), ...] at PRECISION"""
+    values = []
+    index = 0
+    while index < len(encoded):
+        result = shift = 0
+        while True:
+            byte = ord(encoded[index]) - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if byte < 0x20:
+                break
+        values.append(~(result >> 1) if result & 1 else result >> 1)
+
+    points = []
+    lat = lon = 0
+    for i in range(0, len(values) - 1, 2):
+        lat += values[i]
+        lon += values[i + 1]
+        points.append((lon, lat))
+    return points
+
+
+def decode_polyline(encoded):
+    return [(lon / _FACTOR, lat / _FACTOR) for lon, lat in decode_polyline_ints(encoded)]
+
+
+def encode_delta(points):
+    """Quantized [(lon_int, lat_int), ...] -> base64 delta-encoded int32 string"""
+    values = array('i')
+    prev_lon = prev_lat = 0
+    for lon, lat in points:
+        values.append(lon - prev_lon)
+        values.append(lat - prev_lat)
+        prev_lon, prev_lat = lon, lat
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def decode_delta(encoded):
+    values = array('i')
+    values.frombytes(base64.b64decode(encoded))
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    points = []
+    lon = lat = 0
+    for i in range(0, len(values) - 1, 2):
+        lon += values[i]
+        lat += values[i + 1]
+        points.append((lon / _FACTOR, lat / _FACTOR))
+    return points
+
+
+def encoded_geometry(polyline, geometry_format):
+    """API representation of a trail geometry from its cached polyline"""
+    if geometry_format == DELTA:
+        data = encode_delta(decode_polyline_ints(polyline))
+    else:
+        data = polyline
+    return {
+        'type': 'LineString',
+        'encoding': geometry_format,
+        'precision': PRECISION,
+        'data': data
+    }
@@ -1,16 +1,18 @@
 from .db import db, environment, SCHEMA, add_prefix_for_prod
+from .fields import SparseFieldsMixin
+from .condition_rollup import CONDITION_VALUES
 from datetime import datetime
 
 
-class Review(db.Model):
+class Review(db.Model, SparseFieldsMixin):
     __tablename__ = 'reviews'
 
     if environment == "production":
         __table_args__ = {'schema': SCHEMA}
 
     id = db.Column(db.Integer, primary_key=True)
-    trail_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('trails.id')), nullable=False, index=True)
-    user_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('users.id')), nullable=False, index=True)
+    trail_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('trails.id')), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('users.id')), nullable=False)
     rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
     title = db.Column(db.String(200))
     content = db.Column(db.Text, nullable=False)
@@ -32,36 +34,54 @@ class Review(db.Model):
     # This defines the relationships
     trail = db.relationship('Trail', back_populates='reviews')
     author = db.relationship('User', back_populates='reviews')
+    votes = db.relationship('ReviewVote', back_populates='review', lazy='dynamic', cascade='all, delete-orphan')
+    track_verifications = db.relationship('TrackVerification', back_populates='review', lazy='dynamic', cascade='all, delete-orphan')
 
-    # This is to ensure one review per user per trail
+    # This is to ensure one review per user per trail.
+    # The composite indexes match each filter + sort used by the review
+    # listings, so pages are read straight off the index
     __table_args__ = (
         db.UniqueConstraint('trail_id', 'user_id', name='_trail_user_uc'),
+        db.Index('ix_reviews_trail_created', 'trail_id', 'created_at'),
+        db.Index('ix_reviews_trail_rating', 'trail_id', 'rating', 'created_at'),
+        db.Index('ix_reviews_trail_helpful', 'trail_id', 'helpful_count', 'created_at'),
+        db.Index('ix_reviews_user_created', 'user_id', 'created_at'),
         {'schema': SCHEMA} if environment == "production" else {}
     )
 
-    def to_dict(self):
+    # Public fields, in response order, for to_dict and ?fields=
+    FIELDS = (
+        'id', 'trail_id', 'user_id', 'rating', 'title', 'content', 'hiked_date',
+        'weather_condition', 'trail_condition', 'crowd_level', 'helpful_count',
+        'is_verified_hike', 'created_at', 'updated_at', 'author', 'trail'
+    )
+    FIELD_COLUMNS = {'author': ('user_id',), 'trail': ('trail_id',)}
+    FIELD_RELATIONSHIPS = {
+        'author': ('author', None),
+        'trail': ('trail', ('id', 'name', 'difficulty'))
+    }
+
+    def to_dict(self, fields=None):
+        return self.serialize(fields)
+
+    def _render_hiked_date(self):
+        return self.hiked_date.isoformat() if self.hiked_date else None
+
+    def _render_created_at(self):
+        return self.created_at.isoformat() if self.created_at else None
+
+    def _render_updated_at(self):
+        return self.updated_at.isoformat() if self.updated_at else None
+
+    def _render_author(self):
+        return self.author.to_dict_basic() if self.author else None
+
+    def _render_trail(self):
         return {
-            'id': self.id,
-            'trail_id': self.trail_id,
-            'user_id': self.user_id,
-            'rating': self.rating,
-            'title': self.title,
-            'content': self.content,
-            'hiked_date': self.hiked_date.isoformat() if self.hiked_date else None,
-            'weather_condition': self.weather_condition,
-            'trail_condition': self.trail_condition,
-            'crowd_level': self.crowd_level,
-            'helpful_count': self.helpful_count,
-            'is_verified_hike': self.is_verified_hike,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'author': self.author.to_dict_basic() if self.author else None,
-            'trail': {
-                'id': self.trail.id,
-                'name': self.trail.name,
-                'difficulty': self.trail.difficulty
-            } if self.trail else None
-        }
+            'id': self.trail.id,
+            'name': self.trail.name,
+            'difficulty': self.trail.difficulty
+        } if self.trail else None
 
     # Validate review data
     def validate(self):
@@ -78,13 +98,13 @@ class Review(db.Model):
         elif self.hiked_date > datetime.now().date():
             errors['hiked_date'] = 'Hiked date cannot be in the future'
 
-        if self.weather_condition and self.weather_condition not in ['sunny', 'cloudy', 'rainy', 'snowy']:
+        if self.weather_condition and self.weather_condition not in CONDITION_VALUES['weather']:
             errors['weather_condition'] = 'Invalid weather condition'
 
-        if self.trail_condition and self.trail_condition not in ['excellent', 'good', 'muddy', 'icy', 'poor']:
+        if self.trail_condition and self.trail_condition not in CONDITION_VALUES['trail']:
             errors['trail_condition'] = 'Invalid trail condition'
 
-        if self.crowd_level and self.crowd_level not in ['empty', 'light', 'moderate', 'crowded']:
+        if self.crowd_level and self.crowd_level not in CONDITION_VALUES['crowd']:
             errors['crowd_level'] = 'Invalid crowd level'
 
         return errors
@@ -0,0 +1,20 @@
+from .db import db, environment, SCHEMA, add_prefix_for_prod
+from datetime import datetime
+
+
+class ReviewVote(db.Model):
+    __tablename__ = 'review_votes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    review_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('reviews.id')), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('users.id')), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    review = db.relationship('Review', back_populates='votes')
+
+    # One helpful vote per user per review, the constraint's index also
+    # serves lookups by review_id
+    __table_args__ = (
+        db.UniqueConstraint('review_id', 'user_id', name='_review_user_vote_uc'),
+        {'schema': SCHEMA} if environment == "production" else {}
+    )
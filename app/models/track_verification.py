@@ -0,0 +1,33 @@
+from .db import db, environment, SCHEMA, add_prefix_for_prod
+from datetime import datetime
+
+
+class TrackVerification(db.Model):
+    """One uploaded GPS track checked against the reviewed trail"""
+    __tablename__ = 'track_verifications'
+
+    if environment == "production":
+        __table_args__ = {'schema': SCHEMA}
+
+    id = db.Column(db.Integer, primary_key=True)
+    review_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('reviews.id')), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, verified, rejected, failed
+    coverage = db.Column(db.Float)  # share of the trail the track followed, 0-1
+    point_count = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    review = db.relationship('Review', back_populates='track_verifications')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'review_id': self.review_id,
+            'status': self.status,
+            'coverage': round(self.coverage, 3) if self.coverage is not None else None,
+            'point_count': self.point_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
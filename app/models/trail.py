@@ -1,11 +1,14 @@
 from .db import db, environment, SCHEMA, add_prefix_for_prod
+from .fields import SparseFieldsMixin
+from .polyline import GEOJSON, encode_polyline, encoded_geometry
+from sqlalchemy import event, inspect
 from geoalchemy2 import Geometry
 from geoalchemy2.shape import to_shape
 from shapely.geometry import mapping
 from datetime import datetime
 
 
-class Trail(db.Model):
+class Trail(db.Model, SparseFieldsMixin):
     __tablename__ = 'trails'
 
     if environment == "production":
@@ -18,8 +21,17 @@ class Trail(db.Model):
     length_km = db.Column(db.Float, nullable=False)
     elevation_gain_m = db.Column(db.Float)
 
-    # This is for spatial data - LineString is used for the trail path
-    geometry = db.Column(Geometry('LINESTRING', srid=4326), nullable=False)
+    # This is for spatial data - LineString is used for the trail path,
+    # validated and cleaned by app.services.trail_geometry (None when the
+    # trail has not been mapped)
+    geometry = db.Column(Geometry('LINESTRING', srid=4326), nullable=True)
+    # Cached encoded polyline of the geometry, so compact responses skip
+    # the WKB -> shapely -> dict conversion (kept in sync on every write)
+    geometry_encoded = db.Column(db.Text)
+    # Cached centroid of the geometry (kept in sync the same way), what
+    # map clustering reads instead of the full geometry
+    centroid_lon = db.Column(db.Float)
+    centroid_lat = db.Column(db.Float)
 
     # This is basic location info
     region = db.Column(db.String(100))
@@ -37,54 +49,68 @@ class Trail(db.Model):
     # This defines the relationships
     creator = db.relationship('User', back_populates='created_trails')
     reviews = db.relationship('Review', back_populates='trail', lazy='dynamic', cascade='all, delete-orphan')
+    condition_rollups = db.relationship('TrailConditionRollup', back_populates='trail', lazy='dynamic', cascade='all, delete-orphan')
+    forecast = db.relationship('TrailForecast', back_populates='trail', uselist=False, cascade='all, delete-orphan')
 
 
-    # Convert trail to dictionary with GeoJSON geometry
-    # Convert geometry to GeoJSON format if it exists
-    def to_dict(self):
-        geojson = None
-        if self.geometry:
-            shape = to_shape(self.geometry)
-            geojson = mapping(shape)
-
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'difficulty': self.difficulty,
-            'length_km': self.length_km,
-            'elevation_gain_m': self.elevation_gain_m,
-            'geometry': geojson,
-            'region': self.region,
-            'parking_info': self.parking_info,
-            'avg_rating': round(self.avg_rating, 1) if self.avg_rating else 0,
-            'total_reviews': self.total_reviews,
-            'created_by': self.created_by,
-            'creator': self.creator.to_dict_basic() if self.creator else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    # Public fields, in response order, for to_dict and ?fields=
+    FIELDS = (
+        'id', 'name', 'description', 'difficulty', 'length_km', 'elevation_gain_m',
+        'geometry', 'region', 'parking_info', 'avg_rating', 'total_reviews',
+        'created_by', 'creator', 'created_at', 'updated_at'
+    )
+    # Basic trail info for list views
+    BASIC_FIELDS = (
+        'id', 'name', 'difficulty', 'length_km', 'elevation_gain_m', 'geometry',
+        'region', 'avg_rating', 'total_reviews', 'creator'
+    )
+    FIELD_COLUMNS = {'creator': ('created_by',)}
+    FIELD_RELATIONSHIPS = {
+        'creator': ('creator', None)
+    }
+
+    # Convert trail to dictionary with GeoJSON (or encoded) geometry
+    def to_dict(self, fields=None, geometry_format=GEOJSON):
+        if geometry_format == GEOJSON:
+            return self.serialize(fields)
+        return self.serialize(fields, geometry=lambda: self.encoded_geometry(geometry_format))
 
     # Basic trail info for list views
+    def to_dict_basic(self, fields=None, geometry_format=GEOJSON):
+        return self.to_dict(fields or self.BASIC_FIELDS, geometry_format)
+
+    @classmethod
+    def load_options(cls, fields=None, geometry_format=GEOJSON):
+        # Encoded responses read the cached polyline instead of the geometry
+        if geometry_format == GEOJSON:
+            return super().load_options(fields)
+        return super().load_options(fields, columns={'geometry': ('geometry_encoded',)})
+
+    # Reads only the cached polyline: geometry is deferred in encoded
+    # responses, falling back to it would cost a query per trail. The
+    # cache is filled by the migration adding it and on every ORM write
+    def encoded_geometry(self, geometry_format):
+        if self.geometry_encoded is None:
+            return None
+        return encoded_geometry(self.geometry_encoded, geometry_format)
+
     # Convert geometry to GeoJSON format if it exists
-    def to_dict_basic(self):
-        geojson = None
-        if self.geometry:
-            shape = to_shape(self.geometry)
-            geojson = mapping(shape)
-
-        return {
-            'id': self.id,
-            'name': self.name,
-            'difficulty': self.difficulty,
-            'length_km': self.length_km,
-            'elevation_gain_m': self.elevation_gain_m,
-            'geometry': geojson,
-            'region': self.region,
-            'avg_rating': round(self.avg_rating, 1) if self.avg_rating else 0,
-            'total_reviews': self.total_reviews,
-            'creator': self.creator.to_dict_basic() if self.creator else None
-        }
+    def _render_geometry(self):
+        if not self.geometry:
+            return None
+        return mapping(to_shape(self.geometry))
+
+    def _render_avg_rating(self):
+        return round(self.avg_rating, 1) if self.avg_rating else 0
+
+    def _render_creator(self):
+        return self.creator.to_dict_basic() if self.creator else None
+
+    def _render_created_at(self):
+        return self.created_at.isoformat() if self.created_at else None
+
+    def _render_updated_at(self):
+        return self.updated_at.isoformat() if self.updated_at else None
 
     # Update average rating and review count
     def update_rating_stats(self):
@@ -96,3 +122,35 @@ class Trail(db.Model):
             self.total_reviews = 0
             self.avg_rating = 0
         db.session.commit()
+
+    # Recompute average rating and review count of many trails in one
+    # set-based UPDATE (bulk loads), all trails when trail_ids is None
+    @classmethod
+    def refresh_rating_stats(cls, trail_ids=None):
+        from .review import Review
+
+        reviews = db.select(db.func.count(Review.id)).where(Review.trail_id == cls.id)
+        average = db.select(db.func.avg(Review.rating)).where(Review.trail_id == cls.id)
+        update = db.update(cls.__table__).values(
+            total_reviews=reviews.scalar_subquery(),
+            avg_rating=db.func.coalesce(average.scalar_subquery(), 0)
+        )
+        if trail_ids is not None:
+            update = update.where(cls.id.in_(trail_ids))
+        db.session.execute(update)
+
+
+# Keep the cached polyline and centroid in step with the geometry on every
+# ORM write
+@event.listens_for(Trail, 'before_insert')
+@event.listens_for(Trail, 'before_update')
+def cache_encoded_geometry(mapper, connection, trail):
+    if not inspect(trail).attrs.geometry.history.has_changes():
+        return
+    if trail.geometry is None:
+        trail.geometry_encoded = None
+        trail.centroid_lon = trail.centroid_lat = None
+    else:
+        line = to_shape(trail.geometry)
+        trail.geometry_encoded = encode_polyline(line.coords)
+        trail.centroid_lon, trail.centroid_lat = line.centroid.x, line.centroid.y
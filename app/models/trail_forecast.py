@@ -0,0 +1,33 @@
+from .db import db, environment, SCHEMA, add_prefix_for_prod
+from datetime import datetime
+
+
+class TrailForecast(db.Model):
+    """
+    A trail's trained condition forecast: for every month and weekday, the
+    probability of each weather, trail and crowd value, packed into one
+    small binary table (see app.services.condition_forecast for the
+    layout). Rows are written by `flask forecast train` and read whole, so
+    a forecast lookup is one primary key fetch and an array index.
+
+    trained_seq is the change log position the tables are current with,
+    the next incremental run retrains only trails with review changes
+    after it.
+    """
+    __tablename__ = 'trail_forecasts'
+
+    if environment == "production":
+        __table_args__ = {'schema': SCHEMA}
+
+    trail_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('trails.id')), primary_key=True)
+    tables = db.Column(db.LargeBinary, nullable=False)
+    reports = db.Column(db.Integer, nullable=False, default=0)
+    trained_seq = db.Column(db.Integer, nullable=False, default=0)
+    trained_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    trail = db.relationship('Trail', back_populates='forecast')
+
+    @classmethod
+    def cursor(cls):
+        """The change log position of the last completed training run, None before the first"""
+        return db.session.query(db.func.max(cls.trained_seq)).scalar()
@@ -1,14 +1,22 @@
 from .db import db, environment, SCHEMA, add_prefix_for_prod
+from .fields import SparseFieldsMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime
 
 
-class User(db.Model, UserMixin):
+class User(db.Model, UserMixin, SparseFieldsMixin):
     __tablename__ = 'users'
 
-    if environment == "production":
-        __table_args__ = {'schema': SCHEMA}
+    # Username prefix search (LIKE 'abc%') of the admin listing. The
+    # pattern operator class makes the index usable for LIKE whatever the
+    # database's collation
+    __table_args__ = (
+        db.Index('ix_users_username_pattern', 'username', postgresql_ops={'username': 'varchar_pattern_ops'}),
+        {'schema': SCHEMA} if environment == "production" else {}
+    )
+
+    HIKING_LEVELS = ('beginner', 'intermediate', 'advanced', 'expert')
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(40), nullable=False, unique=True)
@@ -27,6 +35,7 @@ class User(db.Model, UserMixin):
     # Relationships
     created_trails = db.relationship('Trail', back_populates='creator', lazy='dynamic')
     reviews = db.relationship('Review', back_populates='author', lazy='dynamic', cascade='all, delete-orphan')
+    stats = db.relationship('UserStats', back_populates='user', uselist=False, cascade='all, delete-orphan')
 
     @property
     def password(self):
@@ -39,28 +48,19 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         return check_password_hash(self.password, password)
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'bio': self.bio,
-            'avatar_url': self.avatar_url,
-            'hiking_level': self.hiking_level,
-            'is_active': self.is_active,
-            'is_admin': self.is_admin,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    # Public fields, in response order, for to_dict and ?fields=
+    FIELDS = (
+        'id', 'username', 'email', 'first_name', 'last_name', 'bio', 'avatar_url',
+        'hiking_level', 'is_active', 'is_admin', 'created_at'
+    )
+    BASIC_FIELDS = ('id', 'username', 'first_name', 'last_name', 'hiking_level', 'avatar_url')
+
+    def to_dict(self, fields=None):
+        return self.serialize(fields)
 
     def to_dict_basic(self):
         """Basic info for public display"""
-        return {
-            'id': self.id,
-            'username': self.username,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'hiking_level': self.hiking_level,
-            'avatar_url': self.avatar_url
-        }
+        return self.serialize(self.BASIC_FIELDS)
+
+    def _render_created_at(self):
+        return self.created_at.isoformat() if self.created_at else None
@@ -0,0 +1,199 @@
+from .db import db, environment, SCHEMA, add_prefix_for_prod
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+
+# Counter columns, in the order rows are compared during reconciliation
+COUNTERS = ('review_count', 'trails_created', 'km_hiked', 'rating_sum')
+
+
+class UserStats(db.Model):
+    """
+    Per user profile counters: reviews written, trails created, km hiked
+    (the length of every reviewed trail) and the sum of the ratings given.
+
+    The review and trail write paths keep the counters up to date with
+    atomic increments (see add_counts), so the stats endpoint reads one row
+    instead of aggregating a user's reviews and trails. Writes that bypass
+    those paths (seeders, manual SQL) are repaired by reconcile, which `flask
+    stats reconcile` runs. A user without activity has no row.
+    """
+    __tablename__ = 'user_stats'
+
+    if environment == "production":
+        __table_args__ = {'schema': SCHEMA}
+
+    user_id = db.Column(db.Integer, db.ForeignKey(add_prefix_for_prod('users.id')), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    trails_created = db.Column(db.Integer, nullable=False, default=0)
+    km_hiked = db.Column(db.Float, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = db.relationship('User', back_populates='stats')
+
+    @staticmethod
+    def to_dict_for(user_id, stats=None):
+        """The stats payload of a user, zeros when the user has no row"""
+        review_count = stats.review_count if stats else 0
+        return {
+            'user_id': user_id,
+            'review_count': review_count,
+            'trails_created': stats.trails_created if stats else 0,
+            'km_hiked': round(stats.km_hiked, 1) if stats else 0.0,
+            'avg_rating_given': round(stats.rating_sum / review_count, 2) if review_count else None
+        }
+
+    @classmethod
+    def _upsert(cls, rows, increment=True):
+        """
+        Insert or update rows of {user_id, counter: value}, adding the
+        values to the stored counters or replacing them
+        """
+        if not rows:
+            return
+        table = cls.__table__
+        now = datetime.utcnow()
+        values = [dict({counter: 0 for counter in COUNTERS}, updated_at=now, **row) for row in rows]
+
+        # Atomic upsert so concurrent writes by the same user never race on
+        # the insert of their first row
+        dialect = db.session.get_bind().dialect.name
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_=dict(
+                {
+                    counter: (table.c[counter] + stmt.excluded[counter]) if increment else stmt.excluded[counter]
+                    for counter in COUNTERS
+                },
+                updated_at=stmt.excluded.updated_at
+            )
+        )
+        db.session.execute(stmt, values)
+
+    @classmethod
+    def add_counts(cls, counts):
+        """Add many {user_id: {counter: delta}} increments with one executemany upsert"""
+        rows = [
+            dict(deltas, user_id=user_id) for user_id, deltas in counts.items()
+            if user_id and any(deltas.values())
+        ]
+        cls._upsert(rows)
+
+    @classmethod
+    def apply_review(cls, review, length_km, delta):
+        """Add (delta=1) or remove (delta=-1) a review of a trail of length_km"""
+        cls.add_counts({review.user_id: {
+            'review_count': delta,
+            'km_hiked': delta * (length_km or 0),
+            'rating_sum': delta * (review.rating or 0)
+        }})
+
+    @classmethod
+    def apply_trail_length(cls, trail_id, delta_km):
+        """Move the km hiked of every reviewer of a trail whose length changed"""
+        from .review import Review
+
+        if not delta_km:
+            return
+        reviewers = db.select(Review.user_id).where(Review.trail_id == trail_id)
+        db.session.execute(
+            db.update(cls.__table__)
+            .where(cls.user_id.in_(reviewers))
+            .values(km_hiked=cls.km_hiked + delta_km, updated_at=datetime.utcnow())
+        )
+
+    @classmethod
+    def remove_trail(cls, trail):
+        """Take back a trail and the reviews its delete cascades to"""
+        from .review import Review
+
+        counts = {
+            user_id: {'review_count': -reviews, 'km_hiked': -reviews * (trail.length_km or 0), 'rating_sum': -ratings}
+            for user_id, reviews, ratings in
+            db.session.query(Review.user_id, db.func.count(Review.id), db.func.sum(Review.rating))
+            .filter(Review.trail_id == trail.id).group_by(Review.user_id)
+        }
+        creator = counts.setdefault(trail.created_by, {})
+        creator['trails_created'] = creator.get('trails_created', 0) - 1
+        cls.add_counts(counts)
+
+    @classmethod
+    def compute(cls, user_ids):
+        """{user_id: {counter: value}} recomputed from reviews and trails"""
+        from .review import Review
+        from .trail import Trail
+
+        actual = {}
+        reviews = (
+            db.session.query(
+                Review.user_id, db.func.count(Review.id),
+                db.func.coalesce(db.func.sum(Trail.length_km), 0), db.func.coalesce(db.func.sum(Review.rating), 0)
+            )
+            .join(Trail, Trail.id == Review.trail_id)
+            .filter(Review.user_id.in_(user_ids))
+            .group_by(Review.user_id)
+        )
+        for user_id, count, km, ratings in reviews:
+            actual[user_id] = {'review_count': count, 'km_hiked': float(km), 'rating_sum': int(ratings)}
+
+        trails = (
+            db.session.query(Trail.created_by, db.func.count(Trail.id))
+            .filter(Trail.created_by.in_(user_ids))
+            .group_by(Trail.created_by)
+        )
+        for user_id, count in trails:
+            actual.setdefault(user_id, {})['trails_created'] = count
+
+        return {
+            user_id: {counter: values.get(counter, 0) for counter in COUNTERS}
+            for user_id, values in actual.items()
+        }
+
+    @classmethod
+    def reconcile(cls, user_ids=None, chunk_size=5000):
+        """
+        Recompute the counters of user_ids (every user by default) a chunk
+        at a time and rewrite the rows that drifted. Returns
+        (users checked, rows corrected)
+        """
+        from .user import User
+
+        checked = corrected = 0
+        after = 0
+        while True:
+            if user_ids is None:
+                chunk = [id for id, in db.session.query(User.id).filter(User.id > after)
+                         .order_by(User.id).limit(chunk_size)]
+            else:
+                chunk = list(user_ids[checked:checked + chunk_size])
+            if not chunk:
+                break
+
+            actual = cls.compute(chunk)
+            stored = {
+                row.user_id: {counter: getattr(row, counter) for counter in COUNTERS}
+                for row in cls.query.filter(cls.user_id.in_(chunk))
+            }
+            zero = {counter: 0 for counter in COUNTERS}
+            drifted = [
+                dict(actual.get(user_id, zero), user_id=user_id) for user_id in chunk
+                if not _same(actual.get(user_id, zero), stored.get(user_id, zero))
+            ]
+            cls._upsert(drifted, increment=False)
+            db.session.commit()
+
+            checked += len(chunk)
+            corrected += len(drifted)
+            after = chunk[-1]
+            if len(chunk) < chunk_size:
+                break
+        return checked, corrected
+
+
+def _same(actual, stored):
+    return all(
+        abs((actual[counter] or 0) - (stored[counter] or 0)) < 1e-6 for counter in COUNTERS
+    )
@@ -1,4 +1,5 @@
 from flask.cli import AppGroup
+import click
 from .users import seed_users, undo_users
 from .trails import seed_trails, undo_trails
 
@@ -30,3 +31,19 @@ def undo():
     undo_trails()
     undo_users()
     # Add other undo functions here
+
+
+# Creates the `flask seed synthetic` command
+@seed_commands.command('synthetic')
+@click.option('--trails', default=1000, help='Number of trails to generate')
+@click.option('--users', default=200, help='Number of users to generate')
+@click.option('--reviews-per-trail', default=10, help='Mean reviews per trail (heavy-tailed)')
+@click.option('--seed', default=1, help='Random seed, the same seed gives the same data')
+def synthetic(trails, users, reviews_per_trail, seed):
+    """Bulk generate a large, reproducible dataset for benchmarks"""
+    from .synthetic import seed_synthetic
+
+    if users < 1:
+        raise click.BadParameter('At least one user is needed', param_hint='--users')
+    created = seed_synthetic(trails, users, reviews_per_trail, seed)
+    click.echo(f"Created {created['users']} users, {created['trails']} trails and {created['reviews']} reviews")
@@ -0,0 +1,242 @@
+"""
+Reproducible synthetic dataset for benchmarking.
+
+The same seed always produces the same trails, users and reviews (on an
+empty database). Trails are random walks with a drifting heading around a
+set of region centers, so they wander and cross like real trails. Review
+counts are heavy-tailed (a few popular trails get most reviews), ratings
+cluster around a per-trail quality and conditions follow the season.
+
+Everything is written with bulk Core inserts in chunks, bypassing the ORM
+unit of work, then the derived data (rating stats, condition rollups,
+change log) is refreshed set-based.
+"""
+from datetime import date, datetime, timedelta
+import math
+import random
+
+import numpy as np
+import shapely
+from werkzeug.security import generate_password_hash
+
+from app.models import db, User, Trail, Review, TrailConditionRollup, ChangeLog, UserStats
+from app.models.polyline import encode_polyline
+
+METERS_PER_DEGREE = 111320.0
+CHUNK_SIZE = 1000
+
+# name, center lon, center lat, spread in km
+REGIONS = (
+    ('Yosemite National Park', -119.54, 37.75, 25),
+    ('Sierra Nevada Foothills', -120.20, 38.20, 40),
+    ('Lake Tahoe Basin', -120.04, 39.05, 20),
+    ('Mount Rainier', -121.76, 46.85, 20),
+    ('Olympic Peninsula', -123.60, 47.80, 45),
+    ('Columbia River Gorge', -121.90, 45.65, 30),
+    ('Rocky Mountain Front Range', -105.60, 40.30, 35),
+    ('Zion Canyon', -113.00, 37.25, 15),
+    ('Great Smoky Mountains', -83.50, 35.60, 30),
+    ('White Mountains', -71.30, 44.25, 25),
+    ('Adirondack High Peaks', -73.95, 44.12, 25),
+    ('Big Sur Coast', -121.70, 36.20, 30),
+)
+DIFFICULTIES = ('easy', 'moderate', 'hard', 'expert')
+DIFFICULTY_WEIGHTS = (0.3, 0.4, 0.22, 0.08)
+# Elevation gain per km by difficulty (min, max)
+GAIN_PER_KM = {'easy': (5, 30), 'moderate': (30, 60), 'hard': (60, 110), 'expert': (100, 180)}
+
+NAME_PARTS = (
+    ('Eagle', 'Cedar', 'Granite', 'Misty', 'Hidden', 'Sunset', 'Bear', 'Falcon', 'Silver',
+     'Aspen', 'Crystal', 'Thunder', 'Lone', 'Red', 'Whispering', 'Painted', 'Willow', 'Echo'),
+    ('Peak', 'Ridge', 'Canyon', 'Lake', 'Falls', 'Meadow', 'Creek', 'Basin', 'Point',
+     'Hollow', 'Bluff', 'Pass', 'Grove', 'Summit', 'Valley', 'Springs'),
+    ('Trail', 'Loop', 'Path', 'Route', 'Traverse', 'Cutoff')
+)
+REVIEW_TITLES = (
+    'Worth every step', 'Great views', 'Harder than expected', 'Nice easy walk',
+    'Busy on weekends', 'Bring water', 'Beautiful in the morning', 'Well marked',
+    'Muddy in places', 'Perfect for families', 'Steep but rewarding', 'Quiet and peaceful'
+)
+REVIEW_SENTENCES = (
+    'The views from the top were incredible.', 'Parking filled up early.',
+    'Trail was well maintained.', 'Some sections were rocky and loose.',
+    'We saw deer near the creek.', 'Shade most of the way up.', 'Wildflowers everywhere.',
+    'Signage at the junctions could be better.', 'The last mile is a steady climb.',
+    'Great spot for lunch by the lake.', 'Bugs were bad near the water.',
+    'Would definitely hike this again.', 'Took longer than the listed time.'
+)
+# Weather odds per season (sunny, cloudy, rainy, snowy)
+SEASON_WEATHER = {
+    'winter': (0.25, 0.3, 0.15, 0.3),
+    'spring': (0.4, 0.3, 0.25, 0.05),
+    'summer': (0.7, 0.2, 0.1, 0.0),
+    'autumn': (0.45, 0.3, 0.2, 0.05),
+}
+WEATHER = ('sunny', 'cloudy', 'rainy', 'snowy')
+TRAIL_CONDITION_BY_WEATHER = {
+    'sunny': (('excellent', 'good', 'poor'), (0.5, 0.45, 0.05)),
+    'cloudy': (('excellent', 'good', 'muddy', 'poor'), (0.35, 0.5, 0.1, 0.05)),
+    'rainy': (('good', 'muddy', 'poor'), (0.25, 0.6, 0.15)),
+    'snowy': (('good', 'icy', 'poor'), (0.2, 0.6, 0.2)),
+}
+CROWD_LEVELS = ('empty', 'light', 'moderate', 'crowded')
+
+
+def _season(day):
+    return ('winter', 'winter', 'spring', 'spring', 'spring', 'summer',
+            'summer', 'summer', 'autumn', 'autumn', 'autumn', 'winter')[day.month - 1]
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert(model, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(db.insert(model.__table__), chunk)
+
+
+def _new_ids(model, after_id):
+    """Ids created by a bulk insert, everything above the id taken before it"""
+    return [id for id, in db.session.query(model.id).filter(model.id > after_id).order_by(model.id)]
+
+
+def _max_id(model):
+    return db.session.query(db.func.coalesce(db.func.max(model.id), 0)).scalar()
+
+
+def _random_walk(rng, vertices, step_m, lon, lat):
+    """Lon/lat vertices of a wandering path starting at lon, lat"""
+    heading = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.35, vertices - 1))
+    steps = rng.uniform(0.6, 1.4, vertices - 1) * step_m
+    east = np.concatenate(([0.0], np.cumsum(np.cos(heading) * steps)))
+    north = np.concatenate(([0.0], np.cumsum(np.sin(heading) * steps)))
+    scale_lon = METERS_PER_DEGREE * math.cos(math.radians(lat))
+    return np.column_stack((lon + east / scale_lon, lat + north / METERS_PER_DEGREE)), float(steps.sum())
+
+
+def _trail_rows(rng, count, user_ids):
+    rows = []
+    lines = []
+    for i in range(count):
+        region, center_lon, center_lat, spread_km = REGIONS[rng.integers(len(REGIONS))]
+        offset = rng.normal(0, spread_km * 1000 / 2, 2)
+        start_lon = center_lon + offset[0] / (METERS_PER_DEGREE * math.cos(math.radians(center_lat)))
+        start_lat = center_lat + offset[1] / METERS_PER_DEGREE
+
+        vertices = int(np.clip(rng.lognormal(4.3, 0.6), 8, 1500))
+        coords, length_m = _random_walk(rng, vertices, rng.uniform(15, 40), start_lon, start_lat)
+        if rng.random() < 0.2:
+            # Loops come back to the trailhead
+            coords = np.vstack((coords, coords[:1]))
+
+        difficulty = DIFFICULTIES[rng.choice(len(DIFFICULTIES), p=DIFFICULTY_WEIGHTS)]
+        length_km = round(length_m / 1000, 2)
+        gain_low, gain_high = GAIN_PER_KM[difficulty]
+        parts = [part[rng.integers(len(part))] for part in NAME_PARTS]
+
+        lines.append(coords)
+        rows.append({
+            'name': ' '.join(parts),
+            'description': f'A {difficulty} {parts[2].lower()} of {length_km} km in the {region} area.',
+            'difficulty': difficulty,
+            'length_km': max(length_km, 0.1),
+            'elevation_gain_m': round(length_km * rng.uniform(gain_low, gain_high)),
+            'geometry_encoded': encode_polyline(coords),
+            'region': region,
+            'parking_info': 'Trailhead parking lot.' if rng.random() < 0.7 else None,
+            'created_by': user_ids[rng.integers(len(user_ids))],
+            'avg_rating': 0.0,
+            'total_reviews': 0,
+        })
+
+    # Convert all geometries to EWKT and centroids in vectorized calls
+    geometries = [shapely.linestrings(coords) for coords in lines]
+    wkt = shapely.to_wkt(geometries, rounding_precision=6)
+    centroids = shapely.get_coordinates(shapely.centroid(geometries))
+    for row, text, (lon, lat) in zip(rows, wkt, centroids.tolist()):
+        row['geometry'] = f'SRID=4326;{text}'
+        row['centroid_lon'], row['centroid_lat'] = lon, lat
+    return rows
+
+
+def _review_rows(rng, pyrandom, trail_ids, user_ids, reviews_per_trail, today):
+    # Heavy-tailed popularity with the requested mean
+    sigma = 1.0
+    counts = np.rint(rng.lognormal(math.log(max(reviews_per_trail, 1e-9)) - sigma ** 2 / 2, sigma, len(trail_ids)))
+    counts = np.minimum(counts, len(user_ids)).astype(int) if reviews_per_trail else np.zeros(len(trail_ids), int)
+
+    rows = []
+    for trail_id, count in zip(trail_ids, counts):
+        quality = rng.normal(4.0, 0.5)
+        for user_id in pyrandom.sample(user_ids, int(count)):
+            hiked_date = today - timedelta(days=int(rng.triangular(0, 0, 730)))
+            weather = WEATHER[rng.choice(4, p=SEASON_WEATHER[_season(hiked_date)])]
+            conditions, odds = TRAIL_CONDITION_BY_WEATHER[weather]
+            created_at = datetime.combine(hiked_date, datetime.min.time()) + timedelta(
+                days=int(rng.integers(0, 4)), seconds=int(rng.integers(0, 86400)))
+            created_at = min(created_at, datetime.utcnow())
+            rows.append({
+                'trail_id': trail_id,
+                'user_id': user_id,
+                'rating': int(np.clip(np.rint(rng.normal(quality, 0.9)), 1, 5)),
+                'title': REVIEW_TITLES[rng.integers(len(REVIEW_TITLES))],
+                'content': ' '.join(pyrandom.sample(REVIEW_SENTENCES, int(rng.integers(1, 5)))),
+                'hiked_date': hiked_date,
+                'weather_condition': weather if rng.random() < 0.8 else None,
+                'trail_condition': conditions[rng.choice(len(conditions), p=odds)] if rng.random() < 0.8 else None,
+                'crowd_level': CROWD_LEVELS[rng.integers(4)] if rng.random() < 0.7 else None,
+                'helpful_count': 0,
+                'is_verified_hike': False,
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+    return rows
+
+
+def seed_synthetic(trails=1000, users=200, reviews_per_trail=10, seed=1, today=None):
+    """Generate and bulk insert a synthetic dataset, returns what was created"""
+    rng = np.random.default_rng(seed)
+    pyrandom = random.Random(seed)
+    today = today or date.today()
+    now = datetime.utcnow()
+
+    # Hashing is deliberately slow, so every synthetic user shares one hash
+    # of "password"
+    hashed_password = generate_password_hash('password')
+    first_user = _max_id(User) + 1
+    _insert(User, [{
+        'username': f'hiker{first_user + i}',
+        'email': f'hiker{first_user + i}@example.com',
+        'hashed_password': hashed_password,
+        'hiking_level': ('beginner', 'intermediate', 'advanced', 'expert')[int(rng.integers(4))],
+        'is_active': True,
+        'is_admin': False,
+        'created_at': now,
+        'updated_at': now,
+    } for i in range(users)])
+    user_ids = _new_ids(User, first_user - 1)
+
+    last_trail = _max_id(Trail)
+    trail_rows = _trail_rows(rng, trails, user_ids)
+    for row in trail_rows:
+        row['created_at'] = row['updated_at'] = now
+    _insert(Trail, trail_rows)
+    trail_ids = _new_ids(Trail, last_trail)
+
+    review_rows = _review_rows(rng, pyrandom, trail_ids, user_ids, reviews_per_trail, today)
+    _insert(Review, review_rows)
+    db.session.commit()
+
+    # Derived data, a chunk of trails at a time to keep IN lists short
+    for chunk in _chunks(trail_ids):
+        Trail.refresh_rating_stats(chunk)
+        ChangeLog.record_trails(chunk)
+        ChangeLog.record_reviews(trail_ids=chunk)
+        TrailConditionRollup.rebuild(chunk)
+    db.session.commit()
+    # Synthetic trails and reviews only belong to the synthetic users
+    UserStats.reconcile(user_ids)
+
+    return {'users': len(user_ids), 'trails': len(trail_ids), 'reviews': len(review_rows)}
@@ -1,4 +1,4 @@
-from app.models import db, Trail, Review, environment, SCHEMA
+from app.models import db, Trail, Review, TrailConditionRollup, UserStats, environment, SCHEMA
 from geoalchemy2.shape import from_shape
 from shapely.geometry import LineString
 from datetime import datetime, timedelta
@@ -141,12 +141,28 @@ def seed_trails():
     for trail in [trail1, trail2, trail3]:
         trail.update_rating_stats()
 
+    # Build the recent conditions rollup from the seeded reviews
+    TrailConditionRollup.rebuild()
+
+    # And the profile counters of the seeded users
+    UserStats.reconcile()
+
 
 def undo_trails():
     if environment == "production":
+        db.session.execute(f"TRUNCATE table {SCHEMA}.change_log RESTART IDENTITY CASCADE;")
+        db.session.execute(f"TRUNCATE table {SCHEMA}.trail_forecasts RESTART IDENTITY CASCADE;")
+        db.session.execute(f"TRUNCATE table {SCHEMA}.trail_condition_rollups RESTART IDENTITY CASCADE;")
+        db.session.execute(f"TRUNCATE table {SCHEMA}.track_verifications RESTART IDENTITY CASCADE;")
+        db.session.execute(f"TRUNCATE table {SCHEMA}.review_votes RESTART IDENTITY CASCADE;")
         db.session.execute(f"TRUNCATE table {SCHEMA}.reviews RESTART IDENTITY CASCADE;")
         db.session.execute(f"TRUNCATE table {SCHEMA}.trails RESTART IDENTITY CASCADE;")
     else:
+        db.session.execute("DELETE FROM change_log")
+        db.session.execute("DELETE FROM trail_forecasts")
+        db.session.execute("DELETE FROM trail_condition_rollups")
+        db.session.execute("DELETE FROM track_verifications")
+        db.session.execute("DELETE FROM review_votes")
         db.session.execute("DELETE FROM reviews")
         db.session.execute("DELETE FROM trails")
 
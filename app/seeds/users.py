@@ -27,6 +27,7 @@ def undo_users():
     if environment == "production":
         db.session.execute(f"TRUNCATE table {SCHEMA}.users RESTART IDENTITY CASCADE;")
     else:
+        db.session.execute(text("DELETE FROM user_stats"))
         db.session.execute(text("DELETE FROM users"))
         
     db.session.commit()
@@ -0,0 +1,2 @@
+# In-process helpers that sit between the models and the API routes:
+# indexes, caches and background work kept per worker process.
@@ -0,0 +1,246 @@
+"""
+Seasonal condition forecasts per trail.
+
+For a month and a weekday, a trail's forecast gives the probability of
+each weather, trail and crowd value, learned offline from the per-day
+condition counts of the review history (the trail condition rollup, the
+reviews aggregated by hiked day):
+
+- the trail's overall distribution, shrunk toward the distribution over
+  all trails by PRIOR_WEIGHT reports, so a trail with three reviews does
+  not predict snow with certainty;
+- per month, the reports of that month plus NEIGHBOUR_WEIGHT of each
+  adjacent month (seasons do not stop at month boundaries), shrunk toward
+  the trail's overall distribution by PROFILE_WEIGHT reports;
+- per weekday, the same without the neighbours;
+- month and weekday combined naively: p(v | m, w) ~ p(v | m) p(v | w) / p(v).
+
+Training is vectorized over a chunk of trails at a time and stores every
+month x weekday distribution, quantized to a byte per probability, in one
+TrailForecast row per trail (about 1.3 KB). Serving a forecast is a
+primary key fetch and an array index. `flask forecast train` retrains
+only the trails whose reviews changed since the last run, found through
+the change log, or every trail with --full.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from app.models import db, Trail, TrailConditionRollup, TrailForecast, ChangeLog
+from app.models.change_log import REVIEW
+from app.models.condition_rollup import CONDITION_VALUES
+
+TABLE_FORMAT = 1
+MONTHS = 12
+WEEKDAYS = 7
+KINDS = tuple(CONDITION_VALUES)
+
+PRIOR_WEIGHT = 5.0
+PROFILE_WEIGHT = 3.0
+NEIGHBOUR_WEIGHT = 0.5
+
+# Table layout: a format byte, then per kind uint8 probabilities shaped
+# (month, weekday, value), then little-endian uint32 report counts shaped
+# (kind, month + weekday)
+PROBABILITY_SHAPES = {kind: (MONTHS, WEEKDAYS, len(values)) for kind, values in CONDITION_VALUES.items()}
+
+
+def _layout():
+    offsets, offset = {}, 1
+    for kind in KINDS:
+        offsets[kind] = offset
+        offset += int(np.prod(PROBABILITY_SHAPES[kind]))
+    return offsets, offset
+
+
+PROBABILITY_OFFSETS, REPORTS_OFFSET = _layout()
+TABLE_SIZE = REPORTS_OFFSET + len(KINDS) * (MONTHS + WEEKDAYS) * 4
+
+
+def _chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _priors():
+    """Per kind, the share of each value over every trail (add-one smoothed)"""
+    totals = {
+        (kind, value): count for kind, value, count in
+        db.session.query(TrailConditionRollup.kind, TrailConditionRollup.value, db.func.sum(TrailConditionRollup.count))
+        .group_by(TrailConditionRollup.kind, TrailConditionRollup.value)
+    }
+    priors = {}
+    for kind, values in CONDITION_VALUES.items():
+        counts = np.array([float(totals.get((kind, value)) or 0) for value in values]) + 1
+        priors[kind] = counts / counts.sum()
+    return priors
+
+
+def _day_parts(days):
+    """Month (0-11) and weekday (0 is Monday) of an array of dates"""
+    days = np.array(days, dtype='datetime64[D]')
+    months = days.astype('datetime64[M]').astype(np.int64) % MONTHS
+    # 1970-01-01 was a Thursday
+    weekdays = (days.astype(np.int64) + 3) % WEEKDAYS
+    return months, weekdays
+
+
+def _probabilities(month_counts, weekday_counts, prior):
+    """(trails, month, weekday, value) probabilities from per trail counts"""
+    totals = month_counts.sum(axis=1)
+    overall = (totals + PRIOR_WEIGHT * prior) / (totals.sum(axis=-1, keepdims=True) + PRIOR_WEIGHT)
+
+    seasonal = month_counts + NEIGHBOUR_WEIGHT * (
+        np.roll(month_counts, 1, axis=1) + np.roll(month_counts, -1, axis=1))
+    by_month = (seasonal + PROFILE_WEIGHT * overall[:, None, :]) \
+        / (seasonal.sum(axis=-1, keepdims=True) + PROFILE_WEIGHT)
+    by_weekday = (weekday_counts + PROFILE_WEIGHT * overall[:, None, :]) \
+        / (weekday_counts.sum(axis=-1, keepdims=True) + PROFILE_WEIGHT)
+
+    joint = by_month[:, :, None, :] * by_weekday[:, None, :, :] / overall[:, None, None, :]
+    return joint / joint.sum(axis=-1, keepdims=True)
+
+
+def build_tables(trail_ids, priors):
+    """{trail_id: (tables, reports)} for the trails of trail_ids with condition reports"""
+    rollup = TrailConditionRollup
+    rows = db.session.query(rollup.trail_id, rollup.day, rollup.kind, rollup.value, rollup.count)\
+        .filter(rollup.trail_id.in_(trail_ids)).all()
+    if not rows:
+        return {}
+
+    index = {trail_id: position for position, trail_id in enumerate(trail_ids)}
+    trails = np.array([index[row.trail_id] for row in rows])
+    months, weekdays = _day_parts([row.day for row in rows])
+    counts = np.array([row.count for row in rows], dtype=float)
+    kinds = np.array([row.kind for row in rows])
+    values = [row.value for row in rows]
+
+    size = len(trail_ids)
+    probabilities = {}
+    reports = np.zeros((size, len(KINDS), MONTHS + WEEKDAYS), dtype=np.uint32)
+    for k, kind in enumerate(KINDS):
+        lookup = {value: position for position, value in enumerate(CONDITION_VALUES[kind])}
+        value_index = np.array([lookup.get(value, -1) for value in values])
+        mask = (kinds == kind) & (value_index >= 0)
+        width = len(lookup)
+
+        t, v, c = trails[mask], value_index[mask], counts[mask]
+        month_counts = np.bincount(
+            (t * MONTHS + months[mask]) * width + v, weights=c, minlength=size * MONTHS * width
+        ).reshape(size, MONTHS, width)
+        weekday_counts = np.bincount(
+            (t * WEEKDAYS + weekdays[mask]) * width + v, weights=c, minlength=size * WEEKDAYS * width
+        ).reshape(size, WEEKDAYS, width)
+
+        probabilities[kind] = np.rint(
+            _probabilities(month_counts, weekday_counts, priors[kind]) * 255).astype(np.uint8)
+        reports[:, k, :MONTHS] = month_counts.sum(axis=-1)
+        reports[:, k, MONTHS:] = weekday_counts.sum(axis=-1)
+
+    reported = reports[:, :, :MONTHS].sum(axis=(1, 2))
+    tables = {}
+    for position, trail_id in enumerate(trail_ids):
+        if not reported[position]:
+            continue
+        parts = [bytes([TABLE_FORMAT])]
+        parts += [probabilities[kind][position].tobytes() for kind in KINDS]
+        parts.append(reports[position].astype('<u4').tobytes())
+        tables[trail_id] = (b''.join(parts), int(reported[position]))
+    return tables
+
+
+def train_forecasts(full=False, chunk_size=1000):
+    """
+    Retrain the forecasts of the trails whose reviews changed since the
+    last run (every trail with `full`). Returns (trails trained, trails
+    dropped for lack of reports)
+
+    Untouched trails keep the all-trails prior of the run that trained
+    them; it moves slowly, an occasional full run brings it up to date.
+    """
+    head = ChangeLog.head(current_app.config.get('SYNC_SETTLE_SECONDS', 0))
+    cursor = None if full else TrailForecast.cursor()
+
+    if cursor is None:
+        trail_ids = {id for id, in db.session.query(TrailConditionRollup.trail_id).distinct()}
+        trail_ids |= {id for id, in db.session.query(TrailForecast.trail_id)}
+    else:
+        trail_ids = {
+            id for id, in db.session.query(ChangeLog.trail_id).distinct()
+            .filter(ChangeLog.entity == REVIEW, ChangeLog.seq > cursor, ChangeLog.seq <= head)
+        }
+    trail_ids = sorted(id for id in trail_ids if id is not None)
+
+    priors = _priors()
+    trained = dropped = 0
+    now = datetime.utcnow()
+    for chunk in _chunks(trail_ids, chunk_size):
+        tables = build_tables(chunk, priors)
+        # Rows keep the old cursor until the run completes, so an
+        # interrupted run is redone from the same place
+        TrailForecast.query.filter(TrailForecast.trail_id.in_(chunk)).delete(synchronize_session=False)
+        if tables:
+            db.session.execute(db.insert(TrailForecast.__table__), [
+                {'trail_id': trail_id, 'tables': data, 'reports': reports, 'trained_seq': cursor or 0, 'trained_at': now}
+                for trail_id, (data, reports) in tables.items()
+            ])
+        db.session.commit()
+        trained += len(tables)
+        dropped += len(chunk) - len(tables)
+
+    # Every table is now current as of head, deleted trails took their
+    # rows with them
+    db.session.execute(db.update(TrailForecast.__table__).values(trained_seq=head))
+    db.session.commit()
+    return trained, dropped
+
+
+def _distribution(forecast, kind, month, weekday):
+    offset = PROBABILITY_OFFSETS[kind]
+    shape = PROBABILITY_SHAPES[kind]
+    table = np.frombuffer(forecast.tables, dtype=np.uint8, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    weights = table[month, weekday].astype(float)
+    values = CONDITION_VALUES[kind]
+    probabilities = weights / weights.sum() if weights.sum() else weights
+    reports = np.frombuffer(forecast.tables, dtype='<u4', offset=REPORTS_OFFSET)\
+        .reshape(len(KINDS), MONTHS + WEEKDAYS)[KINDS.index(kind)]
+    return {
+        'likely': values[int(np.argmax(probabilities))],
+        'probabilities': {value: round(float(p), 2) for value, p in zip(values, probabilities)},
+        'month_reports': int(reports[month]),
+        'weekday_reports': int(reports[MONTHS + weekday])
+    }
+
+
+def forecast_days(trail_id, start, days):
+    """
+    The forecast of a trail for `days` days from `start`, None for an
+    unknown trail. Trails without a trained table get no distributions
+    """
+    row = db.session.query(Trail.id, TrailForecast)\
+        .outerjoin(TrailForecast, TrailForecast.trail_id == Trail.id)\
+        .filter(Trail.id == trail_id).first()
+    if row is None:
+        return None
+
+    forecast = row.TrailForecast
+    if forecast is not None and (len(forecast.tables) != TABLE_SIZE or forecast.tables[0] != TABLE_FORMAT):
+        # Written by another version of the layout, retrain to serve it
+        forecast = None
+
+    result = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        entry = {'date': day.isoformat()}
+        for kind in KINDS:
+            entry[kind] = _distribution(forecast, kind, day.month - 1, day.weekday()) if forecast else None
+        result.append(entry)
+
+    return {
+        'trail_id': trail_id,
+        'trained_at': forecast.trained_at.isoformat() if forecast else None,
+        'reports': forecast.reports if forecast else 0,
+        'days': result
+    }
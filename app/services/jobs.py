@@ -0,0 +1,64 @@
+"""
+Small background job runner for work that must not run in a request.
+
+Jobs run on a per-process thread pool inside an app context. The number
+of queued plus running jobs is capped (JOB_MAX_PENDING), so a burst of
+uploads is turned away instead of piling up in memory. The pool is only
+created on first use, which keeps it out of a preloading gunicorn master.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobRunner:
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self, app):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('JOB_WORKERS', 2),
+                    thread_name_prefix='trailhub-job'
+                )
+                self._slots = threading.BoundedSemaphore(app.config.get('JOB_MAX_PENDING', 16))
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the background, raises JobQueueFull"""
+        app = current_app._get_current_object()
+        executor = self._ensure_executor(app)
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+
+        def run():
+            try:
+                with app.app_context():
+                    fn(*args, **kwargs)
+            except Exception:
+                logger.exception('Background job %s failed', getattr(fn, '__name__', fn))
+            finally:
+                self._slots.release()
+
+        return executor.submit(run)
+
+    def reset(self):
+        """Forget the pool (after fork, the threads belong to the parent)"""
+        with self._lock:
+            self._executor = None
+            self._slots = None
+
+
+jobs = JobRunner()
@@ -0,0 +1,301 @@
+"""
+Offline trail packs: one prebuilt, gzip compressed JSON bundle per region.
+
+A pack holds the region's trail metadata, geometries simplified to about
+PACK_SIMPLIFY_METERS and encoded as polylines, and the most recent reviews
+of every trail. Packs live in PACK_CACHE_DIR under a name derived from the
+hash of their content, so a rebuild that changes nothing keeps the same
+file (and ETag) and an interrupted download can resume with a Range
+request. A small manifest per region points at the current file and
+records the version of the data it was built from.
+
+The version is an aggregate (counts, last update) over the region's
+trails and reviews. Downloads compare the manifest against a per-worker
+cached copy of it, recomputed when this worker writes to the region,
+when it no longer matches the manifest (another worker rebuilt the pack)
+and at the latest every PACK_VERSION_MAX_AGE seconds. A stale pack keeps
+being served while a background job rebuilds it; trail and review writes
+schedule that job right away.
+"""
+from datetime import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import shapely
+from flask import current_app
+from sqlalchemy import func
+
+from app.models import db, Trail, Review
+from app.models.polyline import POLYLINE, encode_polyline, encoded_geometry
+from app.services.jobs import jobs, JobQueueFull
+
+logger = logging.getLogger(__name__)
+
+PACK_FORMAT = 1
+METERS_PER_DEGREE = 111320.0
+
+TRAIL_FIELDS = (
+    'id', 'name', 'description', 'difficulty', 'length_km', 'elevation_gain_m',
+    'geometry', 'region', 'parking_info', 'avg_rating', 'total_reviews', 'updated_at'
+)
+REVIEW_FIELDS = (
+    'id', 'trail_id', 'rating', 'title', 'content', 'hiked_date', 'weather_condition',
+    'trail_condition', 'crowd_level', 'helpful_count', 'is_verified_hike', 'created_at', 'author'
+)
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+# Region key -> (data version, monotonic time computed). The generation is
+# bumped by every invalidation, a version computed across one is not kept
+_versions = {}
+_versions_generation = 0
+_versions_lock = threading.Lock()
+
+
+def _region_filter(region):
+    return func.lower(Trail.region) == region.lower()
+
+
+def region_slug(region):
+    """File-system safe name of a region, unique per (case-insensitive) name"""
+    name = region.lower()
+    readable = re.sub(r'[^a-z0-9]+', '-', name).strip('-')[:40] or 'region'
+    return f"{readable}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _cache_dir():
+    path = current_app.config['PACK_CACHE_DIR']
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _manifest_path(region):
+    return os.path.join(_cache_dir(), f'{region_slug(region)}.manifest.json')
+
+
+def data_version(region):
+    """Changes whenever a trail or review of the region is added, edited or removed"""
+    trails, trails_updated = db.session.query(
+        func.count(Trail.id), func.max(Trail.updated_at)
+    ).filter(_region_filter(region)).one()
+    reviews, reviews_updated, helpful = db.session.query(
+        func.count(Review.id), func.max(Review.updated_at), func.coalesce(func.sum(Review.helpful_count), 0)
+    ).join(Trail, Review.trail_id == Trail.id).filter(_region_filter(region)).one()
+
+    def stamp(value):
+        return value.isoformat() if value else None
+
+    return f'{PACK_FORMAT}:{trails}:{stamp(trails_updated)}:{reviews}:{stamp(reviews_updated)}:{helpful}'
+
+
+def cached_data_version(region, refresh=False):
+    """data_version of a region, from this worker's cache when fresh enough"""
+    key = region.lower()
+    now = time.monotonic()
+    with _versions_lock:
+        cached = _versions.get(key)
+        generation = _versions_generation
+    if cached and not refresh and now - cached[1] <= current_app.config.get('PACK_VERSION_MAX_AGE', 60):
+        return cached[0]
+
+    version = data_version(region)
+    with _versions_lock:
+        if generation == _versions_generation:
+            _versions[key] = (version, now)
+    return version
+
+
+def _forget_versions(region=None):
+    """Drop the cached version of a region, of every region by default"""
+    global _versions_generation
+    with _versions_lock:
+        _versions_generation += 1
+        if region is None:
+            _versions.clear()
+        else:
+            _versions.pop(region.lower(), None)
+
+
+def read_manifest(region):
+    """The current pack of a region, None if it was never built"""
+    try:
+        with open(_manifest_path(region)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest['path'] = os.path.join(_cache_dir(), manifest['file'])
+    if not os.path.exists(manifest['path']):
+        return None
+    return manifest
+
+
+def _bundle(region):
+    config = current_app.config
+    trails = Trail.query.options(*Trail.load_options(TRAIL_FIELDS))\
+        .filter(_region_filter(region))\
+        .order_by(Trail.id)\
+        .all()
+    if not trails:
+        return None
+
+    # Simplify every geometry in one vectorized pass
+    tolerance = config.get('PACK_SIMPLIFY_METERS', 5) / METERS_PER_DEGREE
+    lines = shapely.from_wkb([bytes(trail.geometry.data) if trail.geometry else None for trail in trails])
+    lines = shapely.simplify(lines, tolerance, preserve_topology=True)
+    polylines = [
+        encode_polyline(shapely.get_coordinates(line)) if line is not None else None
+        for line in lines
+    ]
+
+    # The newest reviews of every trail, picked with a window function so it
+    # is one query however many trails the region has
+    ranked = db.session.query(
+        Review.id.label('id'),
+        func.row_number().over(
+            partition_by=Review.trail_id,
+            order_by=(Review.created_at.desc(), Review.id.desc())
+        ).label('position')
+    ).join(Trail, Review.trail_id == Trail.id)\
+        .filter(_region_filter(region))\
+        .subquery()
+    reviews = Review.query.options(*Review.load_options(REVIEW_FIELDS))\
+        .join(ranked, ranked.c.id == Review.id)\
+        .filter(ranked.c.position <= config.get('PACK_REVIEWS_PER_TRAIL', 20))\
+        .order_by(Review.trail_id, Review.created_at.desc(), Review.id.desc())\
+        .all()
+
+    return {
+        'format': PACK_FORMAT,
+        'region': trails[0].region,
+        'trails': [
+            trail.serialize(
+                TRAIL_FIELDS,
+                geometry=lambda polyline=polyline: encoded_geometry(polyline, POLYLINE) if polyline else None
+            )
+            for trail, polyline in zip(trails, polylines)
+        ],
+        'reviews': [review.to_dict(REVIEW_FIELDS) for review in reviews]
+    }
+
+
+def build_pack(region):
+    """(Re)build the pack of a region, returns its manifest or None if it has no trails"""
+    version = data_version(region)
+    bundle = _bundle(region)
+    slug = region_slug(region)
+    cache_dir = _cache_dir()
+    manifest_path = _manifest_path(region)
+
+    if bundle is None:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return None
+
+    # Fixed mtime and key order keep the bytes (and so the name) stable
+    body = json.dumps(bundle, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    data = gzip.compress(body, compresslevel=9, mtime=0)
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    name = f'{slug}.{digest}.json.gz'
+    path = os.path.join(cache_dir, name)
+
+    if not os.path.exists(path):
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    manifest = {
+        'region': bundle['region'],
+        'file': name,
+        'etag': digest,
+        'size': len(data),
+        'version': version,
+        'trails': len(bundle['trails']),
+        'reviews': len(bundle['reviews']),
+        'generated_at': datetime.utcnow().isoformat()
+    }
+    temp = f'{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp, manifest_path)
+
+    # Drop older packs of the region. Downloads already reading one keep
+    # their open file, resumes get the new pack since the ETag changed
+    for other in os.listdir(cache_dir):
+        if other.startswith(f'{slug}.') and other.endswith('.json.gz') and other != name:
+            try:
+                os.remove(os.path.join(cache_dir, other))
+            except OSError:
+                pass
+
+    manifest['path'] = path
+    return manifest
+
+
+def _rebuild(region):
+    with _pending_lock:
+        _pending.discard(region.lower())
+    build_pack(region)
+
+
+def schedule_rebuild(region):
+    """Rebuild a region's pack in the background, once per burst of writes"""
+    if not region:
+        return
+    key = region.lower()
+    with _pending_lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    try:
+        jobs.submit(_rebuild, region)
+    except JobQueueFull:
+        # The next download notices the stale version and schedules it again
+        with _pending_lock:
+            _pending.discard(key)
+        logger.warning('Job queue full, pack rebuild for %s postponed', region)
+
+
+def get_pack(region):
+    """
+    Manifest of the pack to serve and whether it is stale, building it
+    inline only when the region has never been packed. None if the region
+    has no trails.
+    """
+    manifest = read_manifest(region)
+    if manifest is None:
+        return build_pack(region), False
+
+    version = cached_data_version(region)
+    if manifest['version'] != version:
+        # Either the data changed or another worker rebuilt the pack
+        version = cached_data_version(region, refresh=True)
+    stale = manifest['version'] != version
+    if stale:
+        schedule_rebuild(region)
+    return manifest, stale
+
+
+def index_trail(trail, deleted=False):
+    """
+    Refresh the pack of a trail's region after a write. A trail moved out of
+    a region is picked up by that region's version check on next download
+    (every cached version is dropped, the old region is not known here).
+    """
+    _forget_versions()
+    schedule_rebuild(trail.region)
+
+
+def index_review(trail_id):
+    """Refresh the pack of the region a review write touched"""
+    region = db.session.query(Trail.region).filter(Trail.id == trail_id).scalar()
+    if region:
+        _forget_versions(region)
+    schedule_rebuild(region)
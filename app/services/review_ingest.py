@@ -0,0 +1,205 @@
+"""
+Bulk review ingestion for partner feeds.
+
+A batch is validated up front with the same rules as a single review
+(Review.validate), checked for unknown trails/users and for duplicates
+against the one-review-per-user-per-trail rule, within the batch and
+against the database, with one query each. Accepted reviews are inserted
+in chunks. The condition rollup, the rating stats of every affected trail,
+the reviewers' profile counters and the change log are then updated once
+per batch, in the same transaction.
+"""
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Trail, User, Review, TrailConditionRollup, ChangeLog, UserStats
+from app.models.condition_rollup import CONDITION_FIELDS
+
+INGEST_FIELDS = (
+    'trail_id', 'user_id', 'rating', 'title', 'content', 'hiked_date',
+    'weather_condition', 'trail_condition', 'crowd_level'
+)
+
+
+def _build(item):
+    """Review built from one submitted item plus its field errors"""
+    if not isinstance(item, dict):
+        return None, {'review': 'Each review must be an object'}
+
+    errors = {}
+    values = {field: item.get(field) for field in INGEST_FIELDS}
+    for field in ('trail_id', 'user_id', 'rating'):
+        if values[field] is not None and (isinstance(values[field], bool) or not isinstance(values[field], int)):
+            errors[field] = f'{field} must be an integer'
+            values[field] = None
+    for field in ('trail_id', 'user_id'):
+        if values[field] is None and field not in errors:
+            errors[field] = f'{field} is required'
+
+    if values['hiked_date']:
+        try:
+            values['hiked_date'] = datetime.strptime(values['hiked_date'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            errors['hiked_date'] = 'Invalid date format. Use YYYY-MM-DD'
+            values['hiked_date'] = None
+
+    values['title'] = values['title'] or ''
+    values['content'] = values['content'] or ''
+    review = Review(**values)
+    if not isinstance(review.content, str) or not isinstance(review.title, str):
+        errors['content'] = 'Title and content must be text'
+        return review, errors
+
+    # Format errors take precedence over the model rules for the same field
+    errors = dict(review.validate(), **errors)
+    return review, errors
+
+
+def _existing_pairs(pairs):
+    if not pairs:
+        return set()
+    return set(
+        db.session.query(Review.trail_id, Review.user_id)
+        .filter(tuple_(Review.trail_id, Review.user_id).in_(list(pairs)))
+    )
+
+
+def _row(review, now):
+    return {
+        'trail_id': review.trail_id,
+        'user_id': review.user_id,
+        'rating': review.rating,
+        'title': review.title,
+        'content': review.content,
+        'hiked_date': review.hiked_date,
+        'weather_condition': review.weather_condition,
+        'trail_condition': review.trail_condition,
+        'crowd_level': review.crowd_level,
+        'helpful_count': 0,
+        'is_verified_hike': False,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def _insert_chunk(rows):
+    """
+    Insert a chunk, returns the rows that lost a race with a concurrent
+    insert of the same trail/user pair (only those are skipped)
+    """
+    table = Review.__table__
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(table), rows)
+        return []
+    except IntegrityError:
+        pass
+
+    duplicates = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(table), [row])
+        except IntegrityError:
+            duplicates.append(row)
+    return duplicates
+
+
+def ingest_reviews(items, chunk_size=500):
+    """
+    Validate and insert a batch of reviews. Returns
+    {'created': [{'index', 'id'}], 'duplicates': [index], 'errors': {index: errors}}
+    where index is the item's position in the batch
+    """
+    errors = {}
+    accepted = []
+    for index, item in enumerate(items):
+        review, item_errors = _build(item)
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            accepted.append((index, review))
+
+    # Unknown trails and users, one query each
+    trail_ids = {review.trail_id for _, review in accepted}
+    user_ids = {review.user_id for _, review in accepted}
+    known_trails = {id for id, in db.session.query(Trail.id).filter(Trail.id.in_(trail_ids))} if trail_ids else set()
+    known_users = {id for id, in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+
+    valid = []
+    for index, review in accepted:
+        item_errors = {}
+        if review.trail_id not in known_trails:
+            item_errors['trail_id'] = 'Trail not found'
+        if review.user_id not in known_users:
+            item_errors['user_id'] = 'User not found'
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            valid.append((index, review))
+
+    # Duplicates within the batch (first one wins) and against the table
+    existing = _existing_pairs({(review.trail_id, review.user_id) for _, review in valid})
+    duplicates = []
+    seen = set()
+    fresh = []
+    for index, review in valid:
+        pair = (review.trail_id, review.user_id)
+        if pair in existing or pair in seen:
+            duplicates.append(index)
+        else:
+            seen.add(pair)
+            fresh.append((index, review))
+
+    now = datetime.utcnow()
+    rows = [_row(review, now) for _, review in fresh]
+    lost = set()
+    for start in range(0, len(rows), chunk_size):
+        for row in _insert_chunk(rows[start:start + chunk_size]):
+            lost.add((row['trail_id'], row['user_id']))
+    if lost:
+        duplicates.extend(index for index, review in fresh if (review.trail_id, review.user_id) in lost)
+        fresh = [(index, review) for index, review in fresh if (review.trail_id, review.user_id) not in lost]
+
+    # Derived data, once for the whole batch
+    counts = Counter()
+    for _, review in fresh:
+        for kind, attr in CONDITION_FIELDS.items():
+            value = getattr(review, attr)
+            if value:
+                counts[(review.trail_id, review.hiked_date, kind, value)] += 1
+    TrailConditionRollup.add_counts(counts)
+
+    affected = sorted({review.trail_id for _, review in fresh})
+    if affected:
+        Trail.refresh_rating_stats(affected)
+
+    lengths = dict(db.session.query(Trail.id, Trail.length_km).filter(Trail.id.in_(affected))) if affected else {}
+    user_counts = {}
+    for _, review in fresh:
+        deltas = user_counts.setdefault(review.user_id, Counter())
+        deltas['review_count'] += 1
+        deltas['km_hiked'] += lengths.get(review.trail_id) or 0
+        deltas['rating_sum'] += review.rating
+    UserStats.add_counts(user_counts)
+
+    ids = dict(
+        ((trail_id, user_id), id) for id, trail_id, user_id in
+        db.session.query(Review.id, Review.trail_id, Review.user_id)
+        .filter(tuple_(Review.trail_id, Review.user_id).in_([(r.trail_id, r.user_id) for _, r in fresh]))
+    ) if fresh else {}
+
+    # Core inserts and updates bypass the ORM events of the change log
+    ChangeLog.record_reviews(list(ids.values()))
+    ChangeLog.record_trails(affected)
+    db.session.commit()
+
+    return {
+        'created': [{'index': index, 'id': ids.get((review.trail_id, review.user_id))} for index, review in fresh],
+        'duplicates': sorted(duplicates),
+        'errors': errors,
+        'trail_ids': affected,
+    }
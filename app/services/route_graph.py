@@ -0,0 +1,378 @@
+"""
+Routing graph over the trail network.
+
+Trail endpoints and trail/trail intersections become nodes (points closer
+than SNAP_METERS are merged), and every stretch of trail between two nodes
+becomes an edge with a length and a climb cost. Trails only store their
+total elevation gain, so each edge gets the share of that gain matching
+its share of the trail's length.
+
+Edges live in per-trail lists so a trail write only re-cuts that trail and
+the trails it crosses. Queries run on a compressed adjacency (CSR) built
+from those lists into typed arrays the first time a query follows a write.
+Queries snap to the nearest node that still has edges, nodes left behind
+by a moved or deleted trail are skipped.
+
+The graph is built inline by the first query of a worker, then rebuilt by
+a background job once older than ROUTE_GRAPH_MAX_AGE seconds (other
+workers' writes), the old graph answering queries meanwhile.
+"""
+from array import array
+import heapq
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+import shapely
+from flask import current_app
+
+from app.models import db, Trail
+from app.services.jobs import jobs, JobQueueFull
+
+logger = logging.getLogger(__name__)
+
+SNAP_METERS = 20.0
+METERS_PER_DEGREE = 111320.0
+
+SHORTEST = 'shortest'
+LEAST_CLIMB = 'least_climb'
+ROUTE_MODES = (SHORTEST, LEAST_CLIMB)
+
+# Least-climb routes still prefer the shorter of two equally flat options
+LENGTH_TIE_BREAK = 0.001
+
+
+def _distance_m(lon1, lat1, lon2, lat2):
+    kx = METERS_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot((lon2 - lon1) * kx, (lat2 - lat1) * METERS_PER_DEGREE)
+
+
+class RouteGraph:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Trail writes seen while a build runs, {id: (line, gain)}, replayed
+        # over the rows it loaded (None when no build runs)
+        self._writes_during_build = None
+        self._rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        self._trails = {}        # trail id -> (LineString, elevation gain m)
+        self._trail_edges = {}   # trail id -> [(u, v, length m, climb m, coords)]
+        self._node_lon = array('d')
+        self._node_lat = array('d')
+        self._cells = {}         # snap grid cell -> [node ids]
+        self._tree = None
+        self._tree_ids = None
+        self._csr = None
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    # Building
+
+    def build(self):
+        with self._lock:
+            self._writes_during_build = {}
+        try:
+            rows = db.session.query(Trail.id, Trail.geometry, Trail.elevation_gain_m)\
+                .filter(Trail.geometry.isnot(None)).all()
+            lines = shapely.from_wkb([bytes(geometry.data) for _, geometry, _ in rows]) if rows else []
+        except Exception:
+            with self._lock:
+                self._writes_during_build = None
+            raise
+
+        with self._lock:
+            self._reset()
+            for (id, _, gain), line in zip(rows, lines):
+                self._trails[id] = (line, gain or 0.0)
+            # The rows may have been read before these writes committed
+            for id, (line, gain) in self._writes_during_build.items():
+                self._trails.pop(id, None)
+                if line is not None:
+                    self._trails[id] = (line, gain or 0.0)
+            self._writes_during_build = None
+            for id in self._trails:
+                self._cut_trail(id)
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+
+    def schedule_rebuild(self):
+        """Rebuild the graph in a background job, once at a time"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        try:
+            jobs.submit(self._rebuild_in_background)
+        except JobQueueFull:
+            # The next query past the max age schedules it again
+            self._rebuilding = False
+            logger.warning('Job queue full, route graph rebuild postponed')
+
+    def update_trail(self, trail_id, line, elevation_gain_m):
+        """Add, replace (or with line=None remove) one trail"""
+        with self._lock:
+            if self._writes_during_build is not None:
+                self._writes_during_build[trail_id] = (line, elevation_gain_m)
+            if not self.is_built:
+                return
+            affected = {trail_id}
+            if trail_id in self._trails:
+                affected.update(self._crossing(self._trails[trail_id][0]))
+                del self._trails[trail_id]
+                self._trail_edges.pop(trail_id, None)
+            if line is not None:
+                self._trails[trail_id] = (line, elevation_gain_m or 0.0)
+            self._tree = None
+            if line is not None:
+                affected.update(self._crossing(line))
+
+            for id in affected:
+                if id in self._trails:
+                    self._cut_trail(id)
+            self._csr = None
+
+    def _ensure_tree(self):
+        if self._tree is None:
+            self._tree_ids = list(self._trails)
+            self._tree = shapely.STRtree([self._trails[id][0] for id in self._tree_ids])
+        return self._tree
+
+    def _crossing(self, line):
+        tree = self._ensure_tree()
+        return {self._tree_ids[i] for i in tree.query(line, predicate='intersects')}
+
+    def _node(self, lon, lat):
+        """Node id for a point, reusing any node within SNAP_METERS"""
+        size = SNAP_METERS / METERS_PER_DEGREE
+        cx = int(math.floor(lon * math.cos(math.radians(lat)) / size))
+        cy = int(math.floor(lat / size))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for node in self._cells.get((cx + dx, cy + dy), ()):
+                    if _distance_m(lon, lat, self._node_lon[node], self._node_lat[node]) <= SNAP_METERS:
+                        return node
+
+        node = len(self._node_lon)
+        self._node_lon.append(lon)
+        self._node_lat.append(lat)
+        self._cells.setdefault((cx, cy), []).append(node)
+        return node
+
+    def _cut_trail(self, trail_id):
+        """Split a trail at its ends and wherever it meets another trail"""
+        line, gain = self._trails[trail_id]
+        others = [self._trails[id][0] for id in self._crossing(line) if id != trail_id]
+
+        stops = [0.0, line.length]
+        if others:
+            points = shapely.get_coordinates(shapely.intersection(line, others))
+            if len(points):
+                stops.extend(shapely.line_locate_point(line, shapely.points(points)).tolist())
+        stops = sorted(set(round(stop, 9) for stop in stops))
+
+        # Cut the vertex array at every stop in one pass instead of running
+        # a substring per stretch (trails crossing hundreds of others)
+        vertices = shapely.get_coordinates(line)
+        steps = np.diff(vertices, axis=0)
+        along = np.concatenate(([0.0], np.cumsum(np.hypot(steps[:, 0], steps[:, 1]))))
+        scale = (METERS_PER_DEGREE * math.cos(math.radians(line.centroid.y)), METERS_PER_DEGREE)
+        along_m = np.concatenate(([0.0], np.cumsum(np.hypot(*(steps * scale).T))))
+
+        cuts = shapely.get_coordinates(shapely.line_interpolate_point(line, stops))
+        first = np.searchsorted(along, stops, side='right')
+        lengths = np.diff(np.interp(stops, along, along_m))
+        total = along_m[-1] or 1.0
+        nodes = [self._node(lon, lat) for lon, lat in cuts]
+
+        edges = []
+        for i in range(len(stops) - 1):
+            if nodes[i] == nodes[i + 1]:
+                continue
+            inner = vertices[first[i]:first[i + 1]]
+            inner = inner[along[first[i]:first[i + 1]] < stops[i + 1]]
+            coords = np.concatenate((cuts[i:i + 1], inner, cuts[i + 1:i + 2]))
+            length = float(lengths[i])
+            edges.append((nodes[i], nodes[i + 1], length, gain * length / total, coords))
+        self._trail_edges[trail_id] = edges
+
+    def _ensure_csr(self):
+        max_age = current_app.config.get('ROUTE_GRAPH_MAX_AGE', 900)
+        if not self.is_built:
+            self.build()
+        elif time.monotonic() - self._built_at > max_age:
+            self.schedule_rebuild()
+
+        with self._lock:
+            if self._csr is None:
+                self._csr = self._compile()
+            return self._csr
+
+    def _compile(self):
+        """Pack the per-trail edge lists into CSR adjacency arrays"""
+        edges = [(trail_id, edge) for trail_id, trail_edges in self._trail_edges.items() for edge in trail_edges]
+        count = len(edges)
+
+        source = np.empty(2 * count, dtype=np.int32)
+        target = np.empty(2 * count, dtype=np.int32)
+        if count:
+            u = np.fromiter((edge[0] for _, edge in edges), dtype=np.int32, count=count)
+            v = np.fromiter((edge[1] for _, edge in edges), dtype=np.int32, count=count)
+            # Every trail can be walked both ways
+            source[:count], source[count:] = u, v
+            target[:count], target[count:] = v, u
+        order = np.argsort(source, kind='stable')
+        indptr = np.searchsorted(source[order], np.arange(len(self._node_lon) + 1))
+
+        def typed(code, values):
+            packed = array(code)
+            dtype = np.float64 if code == 'd' else np.int32
+            packed.frombytes(np.asarray(values, dtype=dtype).tobytes())
+            return packed
+
+        node_lon, node_lat = array('d', self._node_lon), array('d', self._node_lat)
+        # Only nodes with edges can be snapped to
+        snappable = np.flatnonzero(np.diff(indptr)).astype(np.int32)
+
+        return {
+            'indptr': typed('i', indptr),
+            'target': typed('i', target[order]),
+            # Directed slot -> edge index; slots >= count walk the edge backwards
+            'slot': typed('i', order),
+            'length': typed('d', [edge[2] for _, edge in edges]),
+            'climb': typed('d', [edge[3] for _, edge in edges]),
+            'trail': typed('i', [trail_id for trail_id, _ in edges]),
+            'coords': [edge[4] for _, edge in edges],
+            'edges': count,
+            'node_lon': node_lon,
+            'node_lat': node_lat,
+            'snappable': snappable,
+            'node_points': np.column_stack((np.frombuffer(node_lon)[snappable], np.frombuffer(node_lat)[snappable]))
+        }
+
+    # Queries
+
+    def nearest_node(self, lon, lat, csr):
+        points = csr['node_points']
+        if not len(points):
+            return None, None
+        kx = math.cos(math.radians(lat))
+        distances = np.hypot((points[:, 0] - lon) * kx, points[:, 1] - lat) * METERS_PER_DEGREE
+        nearest = int(np.argmin(distances))
+        return int(csr['snappable'][nearest]), float(distances[nearest])
+
+    def route(self, from_lon, from_lat, to_lon, to_lat, mode=SHORTEST, max_snap_m=2000.0):
+        """
+        Best path between the trail nodes closest to two points, or None
+        when either point is too far from any trail or they are not connected
+        """
+        csr = self._ensure_csr()
+        start, start_snap = self.nearest_node(from_lon, from_lat, csr)
+        goal, goal_snap = self.nearest_node(to_lon, to_lat, csr)
+        if start is None or start_snap > max_snap_m or goal_snap > max_snap_m:
+            return None
+
+        path = self._search(csr, start, goal, mode)
+        if path is None:
+            return None
+        return self._describe(csr, path, start_snap, goal_snap)
+
+    def _search(self, csr, start, goal, mode):
+        """A* over the CSR arrays, returns the list of directed slots taken"""
+        indptr, target, slot = csr['indptr'], csr['target'], csr['slot']
+        length, climb, count = csr['length'], csr['climb'], csr['edges']
+        node_lon, node_lat = csr['node_lon'], csr['node_lat']
+        goal_lon, goal_lat = node_lon[goal], node_lat[goal]
+        kx = METERS_PER_DEGREE * math.cos(math.radians(goal_lat))
+        # Straight-line distance never overestimates walking distance, so it
+        # keeps A* exact; for climb it only bounds the length tie-break
+        scale = 1.0 if mode == SHORTEST else LENGTH_TIE_BREAK
+
+        def heuristic(node):
+            return scale * math.hypot((node_lon[node] - goal_lon) * kx, (node_lat[node] - goal_lat) * METERS_PER_DEGREE)
+
+        best = {start: 0.0}
+        came_from = {}
+        queue = [(heuristic(start), 0.0, start)]
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == goal:
+                break
+            if cost > best.get(node, math.inf):
+                continue
+            for position in range(indptr[node], indptr[node + 1]):
+                edge = slot[position] % count
+                weight = length[edge] if mode == SHORTEST else climb[edge] + LENGTH_TIE_BREAK * length[edge]
+                neighbor = target[position]
+                new_cost = cost + weight
+                if new_cost < best.get(neighbor, math.inf):
+                    best[neighbor] = new_cost
+                    came_from[neighbor] = (node, position)
+                    heapq.heappush(queue, (new_cost + heuristic(neighbor), new_cost, neighbor))
+        else:
+            return None
+
+        path = []
+        node = goal
+        while node != start:
+            node, position = came_from[node]
+            path.append(slot[position])
+        path.reverse()
+        return path
+
+    def _describe(self, csr, path, start_snap, goal_snap):
+        count = csr['edges']
+        coordinates = []
+        legs = []
+        distance = climb = 0.0
+        for directed in path:
+            edge = directed % count
+            coords = csr['coords'][edge]
+            if directed >= count:
+                coords = coords[::-1]
+            coordinates.extend(coords[1:].tolist() if coordinates else coords.tolist())
+
+            distance += csr['length'][edge]
+            climb += csr['climb'][edge]
+            trail_id = csr['trail'][edge]
+            if legs and legs[-1]['trail_id'] == trail_id:
+                legs[-1]['distance_km'] += csr['length'][edge] / 1000
+            else:
+                legs.append({'trail_id': trail_id, 'distance_km': csr['length'][edge] / 1000})
+
+        for leg in legs:
+            leg['distance_km'] = round(leg['distance_km'], 3)
+        return {
+            'distance_km': round(distance / 1000, 3),
+            'climb_m': round(climb, 1),
+            'legs': legs,
+            'start_snap_m': round(start_snap, 1),
+            'end_snap_m': round(goal_snap, 1),
+            'geometry': {'type': 'LineString', 'coordinates': coordinates}
+        }
+
+
+route_graph = RouteGraph()
+
+
+def index_trail(trail, deleted=False):
+    """Keep this worker's routing graph in step with a trail write"""
+    if not route_graph.is_built:
+        return
+    if deleted or not trail.geometry:
+        route_graph.update_trail(trail.id, None, None)
+    else:
+        from geoalchemy2.shape import to_shape
+        route_graph.update_trail(trail.id, to_shape(trail.geometry), trail.elevation_gain_m)
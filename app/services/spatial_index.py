@@ -0,0 +1,212 @@
+"""
+Spatial lookups for trails: bounding box, within-radius and nearest-N.
+
+Two interchangeable backends answer the same questions with the same
+semantics (distances in km, results ordered by distance, then id):
+
+- PostgisSpatialBackend runs the query in the database (GIST index)
+- MemorySpatialIndex keeps an STRtree over the trail geometries in the
+  worker process, for dev/test and edge deployments without PostGIS
+
+The in-memory index is built on first use, updated by the trail write
+paths of the worker that handles the write, and rebuilt when older than
+SPATIAL_INDEX_MAX_AGE seconds so other workers' writes show up too.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+import shapely
+from shapely.geometry import box, Point
+from flask import current_app
+from geoalchemy2 import Geography
+from sqlalchemy import cast
+
+from app.models import db, Trail
+
+KM_PER_DEGREE = 111.32
+# Shortest degree of latitude on the WGS84 spheroid (at the equator)
+MIN_KM_PER_DEGREE_LAT = 110.574
+
+
+def _local_scale(lat):
+    """km per degree of (lon, lat) around a latitude"""
+    return KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6), KM_PER_DEGREE
+
+
+def _degree_box(lon, lat, radius_km):
+    kx, ky = _local_scale(lat)
+    dlon, dlat = radius_km / kx, radius_km / ky
+    return lon - dlon, lat - dlat, lon + dlon, lat + dlat
+
+
+def _geodesic_box(lon, lat, radius_km):
+    """A degree box holding every point within radius_km on the spheroid"""
+    dlat = radius_km / MIN_KM_PER_DEGREE_LAT
+    # Degrees of longitude are shortest at the box's poleward edge
+    edge = min(abs(lat) + dlat, 90.0)
+    dlon = 180.0 if edge >= 90.0 else radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge)))
+    return lon - dlon, max(lat - dlat, -90.0), lon + dlon, min(lat + dlat, 90.0)
+
+
+class MemorySpatialIndex:
+
+    def __init__(self):
+        self._geometries = {}
+        self._tree = None
+        self._tree_ids = None
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def build(self):
+        """Load every trail geometry from the database"""
+        rows = db.session.query(Trail.id, Trail.geometry).filter(Trail.geometry.isnot(None)).all()
+        geometries = shapely.from_wkb([bytes(geometry.data) for _, geometry in rows]) if rows else []
+
+        with self._lock:
+            self._geometries = {id: geometry for (id, _), geometry in zip(rows, geometries)}
+            self._tree = None
+            self._built_at = time.monotonic()
+
+    def upsert(self, trail_id, geometry):
+        """Add or replace one trail, `geometry` is a shapely LineString"""
+        if not self.is_built:
+            return
+        with self._lock:
+            if geometry is None:
+                self._geometries.pop(trail_id, None)
+            else:
+                self._geometries[trail_id] = geometry
+            self._tree = None
+
+    def remove(self, trail_id):
+        self.upsert(trail_id, None)
+
+    def _ensure_tree(self):
+        max_age = current_app.config.get('SPATIAL_INDEX_MAX_AGE', 300)
+        if not self.is_built or time.monotonic() - self._built_at > max_age:
+            self.build()
+
+        with self._lock:
+            # STRtree is immutable, writes just drop it and the next
+            # query rebuilds it from the geometry dict
+            if self._tree is None:
+                self._tree_ids = np.fromiter(self._geometries.keys(), dtype=np.int64, count=len(self._geometries))
+                self._tree = shapely.STRtree(list(self._geometries.values()))
+            return self._tree, self._tree_ids
+
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat, limit):
+        tree, ids = self._ensure_tree()
+        hits = tree.query(box(min_lon, min_lat, max_lon, max_lat), predicate='intersects')
+        return sorted(ids[hits].tolist())[:limit]
+
+    def nearby(self, lon, lat, radius_km=None, limit=10):
+        """[(trail_id, distance_km), ...] closest first"""
+        tree, ids = self._ensure_tree()
+        if not len(ids):
+            return []
+
+        # Without a radius, widen the search box until it holds `limit`
+        # trails that are closer than the box's inner radius
+        search_km = radius_km or 1.0
+        while True:
+            candidates = tree.query(box(*_degree_box(lon, lat, search_km)))
+            distances = self._distances_km(tree.geometries.take(candidates), lon, lat)
+            inside = distances <= search_km
+            if radius_km is not None or inside.sum() >= limit or len(candidates) == len(ids) or search_km > 20000:
+                break
+            search_km *= 4
+
+        if radius_km is not None:
+            candidates, distances = candidates[inside], distances[inside]
+
+        order = np.lexsort((ids[candidates], distances))[:limit]
+        return [(int(ids[candidates[i]]), round(float(distances[i]), 3)) for i in order]
+
+    @staticmethod
+    def _distances_km(geometries, lon, lat):
+        # Project into a local equirectangular plane in km around the query
+        # point, accurate to well under a percent at trail scales
+        if not len(geometries):
+            return np.empty(0)
+        kx, ky = _local_scale(lat)
+        projected = shapely.transform(geometries, lambda coords: (coords - (lon, lat)) * (kx, ky))
+        return shapely.distance(projected, Point(0, 0))
+
+
+class PostgisSpatialBackend:
+
+    @staticmethod
+    def _point(lon, lat):
+        return db.func.ST_SetSRID(db.func.ST_MakePoint(lon, lat), 4326)
+
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat, limit):
+        envelope = db.func.ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326)
+        rows = db.session.query(Trail.id)\
+            .filter(db.func.ST_Intersects(Trail.geometry, envelope))\
+            .order_by(Trail.id)\
+            .limit(limit)
+        return [id for id, in rows]
+
+    def nearby(self, lon, lat, radius_km=None, limit=10):
+        point = self._point(lon, lat)
+        distance_m = db.func.ST_Distance(cast(Trail.geometry, Geography), cast(point, Geography))
+
+        if radius_km is None:
+            # KNN over the GIST index orders by planar degrees, which
+            # stretch with latitude, so its first `limit` trails are not
+            # always the geodesically nearest. They do bound them: the
+            # farthest of them is a radius holding at least `limit`
+            # trails, searched exactly below
+            candidates = db.session.query(distance_m)\
+                .filter(Trail.geometry.isnot(None))\
+                .order_by(Trail.geometry.op('<->')(point))\
+                .limit(limit)\
+                .all()
+            if not candidates:
+                return []
+            # Slack for ST_DWithin rounding differently from ST_Distance
+            radius_m = max(float(meters) for meters, in candidates) + 0.01
+            if len(candidates) < limit:
+                # Every trail is a candidate
+                radius_m = None
+        else:
+            radius_m = radius_km * 1000.0
+
+        query = db.session.query(Trail.id, distance_m / 1000.0).filter(Trail.geometry.isnot(None))
+        if radius_m is not None:
+            # The bbox test uses the GIST index, DWithin is the exact check
+            query = query.filter(
+                Trail.geometry.op('&&')(db.func.ST_MakeEnvelope(*_geodesic_box(lon, lat, radius_m / 1000.0), 4326)),
+                db.func.ST_DWithin(cast(Trail.geometry, Geography), cast(point, Geography), radius_m)
+            )
+        query = query.order_by(distance_m, Trail.id).limit(limit)
+        return [(id, round(float(km), 3)) for id, km in query]
+
+
+memory_spatial_index = MemorySpatialIndex()
+postgis_spatial_backend = PostgisSpatialBackend()
+
+
+def get_spatial_backend():
+    """SPATIAL_BACKEND config ('postgis' or 'memory'), else by database"""
+    backend = current_app.config.get('SPATIAL_BACKEND')
+    if backend is None:
+        backend = 'postgis' if db.engine.dialect.name == 'postgresql' else 'memory'
+    return postgis_spatial_backend if backend == 'postgis' else memory_spatial_index
+
+
+def index_trail(trail, deleted=False):
+    """Keep this worker's in-memory index in step with a trail write"""
+    if not memory_spatial_index.is_built:
+        return
+    if deleted or not trail.geometry:
+        memory_spatial_index.remove(trail.id)
+    else:
+        from geoalchemy2.shape import to_shape
+        memory_spatial_index.upsert(trail.id, to_shape(trail.geometry))
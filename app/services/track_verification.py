@@ -0,0 +1,131 @@
+"""
+Verify a review's hike from an uploaded GPX track.
+
+The track is streamed from disk with iterparse and decimated on the fly,
+so memory stays bounded by TRACK_MAX_POINTS whatever the file size. The
+trail is sampled every SAMPLE_METERS and the share of samples within
+TOLERANCE_METERS of the track is the coverage. Both steps are vectorized
+shapely/NumPy calls in a local metric projection around the trail.
+"""
+from datetime import datetime
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import shapely
+from flask import current_app
+from geoalchemy2.shape import to_shape
+
+from app.models import db, Review, TrackVerification
+
+SAMPLE_METERS = 10.0
+TOLERANCE_METERS = 30.0
+VERIFIED_COVERAGE = 0.8
+METERS_PER_DEGREE = 111320.0
+
+
+class InvalidTrack(ValueError):
+    pass
+
+
+def read_gpx_points(path, max_points=50000):
+    """
+    (n, 2) array of lon/lat from the track and route points of a GPX file.
+    Whenever the buffer fills up every other point is dropped and only every
+    second following point is kept, so at most max_points are held.
+    """
+    points = np.empty((max_points, 2))
+    count = 0
+    stride = 1
+    seen = 0
+
+    # Open elements, root first. Every finished element is detached from
+    # its parent, so a long track segment does not keep its cleared points
+    open_elements = []
+    try:
+        for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                open_elements.append(element)
+                continue
+            open_elements.pop()
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag in ('trkpt', 'rtept'):
+                if seen % stride == 0:
+                    try:
+                        lat, lon = float(element.get('lat')), float(element.get('lon'))
+                    except (TypeError, ValueError):
+                        raise InvalidTrack('Track point without a valid lat/lon')
+                    if count == max_points:
+                        points[:max_points // 2] = points[0:max_points:2]
+                        count = max_points // 2
+                        stride *= 2
+                    points[count] = (lon, lat)
+                    count += 1
+                seen += 1
+            if open_elements:
+                open_elements[-1].remove(element)
+    except ElementTree.ParseError as e:
+        raise InvalidTrack(f'Not a valid GPX file: {e}')
+
+    if count < 2:
+        raise InvalidTrack('The track needs at least two points')
+    return points[:count]
+
+
+def track_coverage(trail_line, track_points):
+    """Share (0-1) of the trail that lies within TOLERANCE_METERS of the track"""
+    origin_lon, origin_lat = trail_line.centroid.x, trail_line.centroid.y
+    scale = (METERS_PER_DEGREE * math.cos(math.radians(origin_lat)), METERS_PER_DEGREE)
+
+    def project(coords):
+        return (coords - (origin_lon, origin_lat)) * scale
+
+    trail = shapely.transform(trail_line, project)
+    track = shapely.linestrings(project(track_points))
+
+    samples = shapely.line_interpolate_point(
+        trail, np.append(np.arange(0.0, trail.length, SAMPLE_METERS), trail.length)
+    )
+    distances = shapely.distance(samples, track)
+    return float(np.mean(distances <= TOLERANCE_METERS))
+
+
+def verify_track(verification_id, path):
+    """Background job: score an uploaded track and flag the review"""
+    verification = TrackVerification.query.get(verification_id)
+    try:
+        if verification is None:
+            return
+        verification.status = 'running'
+        db.session.commit()
+
+        review = Review.query.get(verification.review_id)
+        if review is None or not review.trail or not review.trail.geometry:
+            raise InvalidTrack('The reviewed trail has no geometry to compare against')
+
+        points = read_gpx_points(path, current_app.config.get('TRACK_MAX_POINTS', 50000))
+        coverage = track_coverage(to_shape(review.trail.geometry), points)
+
+        verification.coverage = coverage
+        verification.point_count = len(points)
+        verification.status = 'verified' if coverage >= VERIFIED_COVERAGE else 'rejected'
+        review.is_verified_hike = coverage >= VERIFIED_COVERAGE
+    except InvalidTrack as e:
+        db.session.rollback()
+        verification.status = 'failed'
+        verification.error = str(e)
+    except Exception:
+        db.session.rollback()
+        if verification is not None:
+            verification.status = 'failed'
+            verification.error = 'Track could not be processed'
+            verification.completed_at = datetime.utcnow()
+            db.session.commit()
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    verification.completed_at = datetime.utcnow()
+    db.session.commit()
@@ -0,0 +1,250 @@
+"""
+Map clusters of trails for zoomed-out views.
+
+Trails are bucketed by their cached centroid into a pyramid of grids in
+web mercator space, one grid per zoom level. At zoom z a cell is
+1/CELLS_PER_TILE of a 256px map tile, so clusters come out evenly spaced
+on screen at every latitude. Every level keeps, per non-empty cell, the
+trail count, coordinate sums (the cluster position is the mean centroid),
+rating sums over rated trails, counts per difficulty and the XOR of the
+trail ids, which is the trail's own id once a cell holds a single trail.
+
+The pyramid is built on first use from the trails' scalar columns only,
+updated by the trail and review write paths of the worker that handles
+the write (one cell per level changes), and rebuilt when older than
+CLUSTER_INDEX_MAX_AGE seconds so other workers' writes show up too. A
+request reads the cells of one level inside the bounding box and never
+touches a geometry.
+"""
+import threading
+import time
+
+import numpy as np
+import shapely
+from flask import current_app
+
+from app.models import db, Trail
+
+CELLS_PER_TILE = 4
+MAX_CLUSTER_ZOOM = 18
+DIFFICULTIES = ('easy', 'moderate', 'hard', 'expert')
+MAX_MERCATOR_LAT = 85.05112878
+
+# Positions in a cell's aggregate list
+COUNT, SUM_LON, SUM_LAT, RATING_SUM, RATED, ID_XOR = range(6)
+FIRST_DIFFICULTY = 6
+
+
+def _grid_size(zoom):
+    return (1 << zoom) * CELLS_PER_TILE
+
+
+def _mercator(lon, lat):
+    """Web mercator x, y in [0, 1), y growing southwards"""
+    lat = np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return np.clip(x, 0, 1 - 1e-12), np.clip(y, 0, 1 - 1e-12)
+
+
+def _cells(lon, lat):
+    """Cell coordinates at MAX_CLUSTER_ZOOM, coarser levels shift them down"""
+    x, y = _mercator(lon, lat)
+    size = _grid_size(MAX_CLUSTER_ZOOM)
+    return (x * size).astype(np.int64), (y * size).astype(np.int64)
+
+
+class TrailClusterIndex:
+
+    def __init__(self):
+        self._levels = [{} for _ in range(MAX_CLUSTER_ZOOM + 1)]
+        self._trails = {}
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def build(self):
+        """Load every trail's centroid, rating and difficulty"""
+        rows = db.session.query(
+            Trail.id, Trail.centroid_lon, Trail.centroid_lat,
+            Trail.avg_rating, Trail.total_reviews, Trail.difficulty
+        ).all()
+
+        # Rows written before centroids were cached fall back to their
+        # geometry, once
+        missing = [row.id for row in rows if row.centroid_lon is None]
+        centroids = {}
+        if missing:
+            geometries = db.session.query(Trail.id, Trail.geometry)\
+                .filter(Trail.id.in_(missing), Trail.geometry.isnot(None)).all()
+            points = shapely.centroid(shapely.from_wkb([bytes(g.data) for _, g in geometries])) \
+                if geometries else []
+            centroids = {id: (point.x, point.y) for (id, _), point in zip(geometries, points)}
+
+        trails = {}
+        for row in rows:
+            lon, lat = (row.centroid_lon, row.centroid_lat) if row.centroid_lon is not None \
+                else centroids.get(row.id, (None, None))
+            if lon is None:
+                continue
+            rating = row.avg_rating if row.total_reviews else None
+            trails[row.id] = [lon, lat, rating, row.difficulty]
+
+        levels = self._aggregate(trails)
+        with self._lock:
+            self._trails = trails
+            self._levels = levels
+            self._built_at = time.monotonic()
+
+    @staticmethod
+    def _aggregate(trails):
+        """Every level of the pyramid for {id: [lon, lat, rating, difficulty, ...]}"""
+        levels = [{} for _ in range(MAX_CLUSTER_ZOOM + 1)]
+        if not trails:
+            return levels
+
+        ids = np.fromiter(trails.keys(), dtype=np.int64, count=len(trails))
+        values = list(trails.values())
+        lon = np.array([value[0] for value in values])
+        lat = np.array([value[1] for value in values])
+        rating = np.array([value[2] if value[2] is not None else np.nan for value in values])
+        difficulty = np.array([
+            DIFFICULTIES.index(value[3]) if value[3] in DIFFICULTIES else -1 for value in values
+        ])
+        ix, iy = _cells(lon, lat)
+        for value, cell_x, cell_y in zip(values, ix.tolist(), iy.tolist()):
+            value[4:] = [cell_x, cell_y]
+
+        rated = ~np.isnan(rating)
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            shift = MAX_CLUSTER_ZOOM - zoom
+            keys = ((ix >> shift) << 32) | (iy >> shift)
+            order = np.argsort(keys, kind='stable')
+            cells, starts, inverse = np.unique(keys[order], return_index=True, return_inverse=True)
+            columns = [
+                np.bincount(inverse),
+                np.bincount(inverse, lon[order]),
+                np.bincount(inverse, lat[order]),
+                np.bincount(inverse, np.where(rated, rating, 0)[order]),
+                np.bincount(inverse, rated[order]),
+                np.bitwise_xor.reduceat(ids[order], starts),
+            ] + [np.bincount(inverse, (difficulty == i)[order]) for i in range(len(DIFFICULTIES))]
+
+            level = levels[zoom]
+            for position, key in enumerate(cells.tolist()):
+                level[(key >> 32, key & 0xFFFFFFFF)] = [
+                    int(columns[0][position]), float(columns[1][position]), float(columns[2][position]),
+                    float(columns[3][position]), int(columns[4][position]), int(columns[5][position])
+                ] + [int(column[position]) for column in columns[FIRST_DIFFICULTY:]]
+        return levels
+
+    def _apply(self, trail_id, value, sign):
+        lon, lat, rating, difficulty, ix, iy = value
+        for zoom, level in enumerate(self._levels):
+            shift = MAX_CLUSTER_ZOOM - zoom
+            key = (ix >> shift, iy >> shift)
+            cell = level.get(key)
+            if cell is None:
+                cell = level[key] = [0, 0.0, 0.0, 0.0, 0, 0] + [0] * len(DIFFICULTIES)
+            cell[COUNT] += sign
+            if cell[COUNT] <= 0:
+                del level[key]
+                continue
+            cell[SUM_LON] += sign * lon
+            cell[SUM_LAT] += sign * lat
+            if rating is not None:
+                cell[RATING_SUM] += sign * rating
+                cell[RATED] += sign
+            cell[ID_XOR] ^= trail_id
+            if difficulty in DIFFICULTIES:
+                cell[FIRST_DIFFICULTY + DIFFICULTIES.index(difficulty)] += sign
+
+    def upsert(self, trail_id, lon, lat, rating, difficulty):
+        """Add or move one trail, rating is None for unreviewed trails"""
+        if not self.is_built:
+            return
+        with self._lock:
+            self.remove(trail_id)
+            if lon is None or lat is None:
+                return
+            ix, iy = _cells(np.array([lon]), np.array([lat]))
+            value = [lon, lat, rating, difficulty, int(ix[0]), int(iy[0])]
+            self._trails[trail_id] = value
+            self._apply(trail_id, value, 1)
+
+    def remove(self, trail_id):
+        if not self.is_built:
+            return
+        with self._lock:
+            value = self._trails.pop(trail_id, None)
+            if value is not None:
+                self._apply(trail_id, value, -1)
+
+    def _ensure_built(self):
+        max_age = current_app.config.get('CLUSTER_INDEX_MAX_AGE', 300)
+        if not self.is_built or time.monotonic() - self._built_at > max_age:
+            self.build()
+
+    def clusters(self, min_lon, min_lat, max_lon, max_lat, zoom):
+        """The clusters of the cells of `zoom` that overlap the box"""
+        self._ensure_built()
+        zoom = max(0, min(int(zoom), MAX_CLUSTER_ZOOM))
+        shift = MAX_CLUSTER_ZOOM - zoom
+        (x0, x1), (y1, y0) = [values.tolist() for values in _cells(
+            np.array([min_lon, max_lon]), np.array([min_lat, max_lat]))]
+        x0, x1, y0, y1 = x0 >> shift, x1 >> shift, y0 >> shift, y1 >> shift
+
+        with self._lock:
+            level = self._levels[zoom]
+            # Walk whichever is smaller, the box's cells or the level's
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(level):
+                cells = [
+                    ((x, y), level[(x, y)]) for x in range(x0, x1 + 1)
+                    for y in range(y0, y1 + 1) if (x, y) in level
+                ]
+            else:
+                cells = [
+                    (key, cell) for key, cell in level.items()
+                    if x0 <= key[0] <= x1 and y0 <= key[1] <= y1
+                ]
+            cells = [(key, list(cell)) for key, cell in cells]
+
+        clusters = []
+        for (x, y), cell in cells:
+            count = cell[COUNT]
+            cluster = {
+                'count': count,
+                'lon': round(cell[SUM_LON] / count, 6),
+                'lat': round(cell[SUM_LAT] / count, 6),
+                'avg_rating': round(cell[RATING_SUM] / cell[RATED], 1) if cell[RATED] else None,
+                'difficulty': {
+                    name: cell[FIRST_DIFFICULTY + i] for i, name in enumerate(DIFFICULTIES)
+                    if cell[FIRST_DIFFICULTY + i]
+                },
+                'cell': [zoom, x, y],
+            }
+            if count == 1:
+                cluster['trail_id'] = cell[ID_XOR]
+            clusters.append(cluster)
+
+        clusters.sort(key=lambda cluster: (-cluster['count'], cluster['cell'][1], cluster['cell'][2]))
+        return zoom, clusters
+
+
+trail_cluster_index = TrailClusterIndex()
+
+
+def index_trail(trail, deleted=False):
+    """Keep this worker's cluster pyramid in step with a trail write"""
+    if not trail_cluster_index.is_built:
+        return
+    if deleted or trail.centroid_lon is None:
+        trail_cluster_index.remove(trail.id)
+    else:
+        trail_cluster_index.upsert(
+            trail.id, trail.centroid_lon, trail.centroid_lat,
+            trail.avg_rating if trail.total_reviews else None, trail.difficulty
+        )
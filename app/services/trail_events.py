@@ -0,0 +1,312 @@
+"""
+Server-sent event streams for trail detail pages.
+
+A listener subscribes to one trail and receives review.created,
+review.updated, review.deleted, trail.updated and trail.deleted events for
+it, instead of polling the reviews listing.
+
+Each connection has a bounded buffer. When a listener falls more than
+TRAIL_EVENTS_BUFFER events behind, the backlog is dropped and it gets one
+`resync` event (refetch, then carry on with what follows). A worker serves
+at most TRAIL_EVENTS_MAX_CONNECTIONS streams. An idle stream is a thread
+waiting on an Event, with a heartbeat comment every
+TRAIL_EVENTS_HEARTBEAT seconds so dead connections are noticed.
+
+Events reach this process's listeners through a backend
+(TRAIL_EVENTS_BACKEND):
+
+- local: the write routes publish straight to the listeners of their
+  own process. Only right when a single process serves the API.
+- changelog: while it has listeners, every worker polls the change log,
+  which is written in the same transaction as each trail and review
+  write. A write made in any worker, by the bulk ingest or by a CLI job
+  therefore reaches every listener. Publishing from the routes is a
+  no-op. Delivery is best effort: on reconnect a client refetches.
+"""
+from collections import deque
+import json
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from app.models import db, Trail, Review, ChangeLog, get_many
+from app.models.change_log import TRAIL, REVIEW, UPSERT
+
+logger = logging.getLogger(__name__)
+
+LOCAL = 'local'
+CHANGELOG = 'changelog'
+
+REVIEW_CREATED = 'review.created'
+REVIEW_UPDATED = 'review.updated'
+REVIEW_DELETED = 'review.deleted'
+TRAIL_UPDATED = 'trail.updated'
+TRAIL_DELETED = 'trail.deleted'
+RESYNC = 'resync'
+
+# Trail fields sent with trail.updated, everything but the geometry
+TRAIL_EVENT_FIELDS = (
+    'id', 'name', 'difficulty', 'length_km', 'elevation_gain_m',
+    'region', 'avg_rating', 'total_reviews', 'updated_at'
+)
+POLL_BATCH = 500
+
+
+class TooManyListeners(Exception):
+    pass
+
+
+def review_event(change, review=None, review_id=None):
+    if review is None:
+        return {'event': change, 'data': {'review': {'id': review_id}}}
+    return {'event': change, 'data': {'review': review.to_dict()}}
+
+
+def trail_event(change, trail=None, trail_id=None):
+    if trail is None:
+        return {'event': change, 'data': {'trail': {'id': trail_id}}}
+    return {'event': change, 'data': {'trail': trail.to_dict(TRAIL_EVENT_FIELDS)}}
+
+
+def format_event(event):
+    lines = []
+    if event.get('id') is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append('data: ' + json.dumps(event.get('data', {}), separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """One stream's bounded event buffer"""
+
+    def __init__(self, trail_id, size):
+        self.trail_id = trail_id
+        self._size = size
+        self._events = deque()
+        self._overflowed = False
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def push(self, event):
+        with self._lock:
+            if len(self._events) >= self._size:
+                # The client has to refetch anyway, so keep nothing
+                self._events.clear()
+                self._overflowed = True
+            self._events.append(event)
+        self._ready.set()
+
+    def wait(self, timeout):
+        """Pending events, an empty list when none came within timeout"""
+        self._ready.wait(timeout)
+        with self._lock:
+            self._ready.clear()
+            events = list(self._events)
+            self._events.clear()
+            if self._overflowed:
+                self._overflowed = False
+                events.insert(0, {'event': RESYNC, 'data': {'trail_id': self.trail_id}})
+        return events
+
+
+class ChangeLogPoller:
+    """Turns change log entries into events for this process's listeners"""
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._thread = None
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self, app):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Start from the current head, read in the subscribing request
+            self._cursor = ChangeLog.head()
+            self._thread = threading.Thread(
+                target=self._run, args=(app,), name='trailhub-events', daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        interval = app.config.get('TRAIL_EVENTS_POLL_SECONDS', 1)
+        while True:
+            time.sleep(interval)
+            # Stop with the last listener, under the lock ensure_running takes
+            with self._lock:
+                if not self._broker.watched():
+                    self._thread = None
+                    return
+            try:
+                with app.app_context():
+                    self._cursor = self.poll(self._cursor)
+            except Exception:
+                logger.exception('Polling the change log for trail events failed')
+
+    def poll(self, cursor):
+        """Deliver the entries after cursor, returns the new cursor"""
+        entries = (
+            ChangeLog.query.filter(ChangeLog.seq > cursor)
+            .order_by(ChangeLog.seq).limit(POLL_BATCH).all()
+        )
+        if not entries:
+            return cursor
+
+        watched = self._broker.watched()
+        for trail_id, event in change_log_events([e for e in entries if e.trail_id in watched], cursor):
+            self._broker.deliver(trail_id, event)
+        return entries[-1].seq
+
+    def reset(self):
+        with self._lock:
+            self._thread = None
+            self._cursor = None
+
+
+def change_log_events(entries, cursor):
+    """(trail_id, event) pairs for change log entries read after cursor"""
+    # Several writes to the same row collapse to the last one
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.entity_id), None)
+        latest[(entry.entity, entry.entity_id)] = entry
+    if not latest:
+        return []
+
+    def upserted(entity):
+        return [id for (kind, id), entry in latest.items() if kind == entity and entry.op == UPSERT]
+
+    review_ids = upserted(REVIEW)
+    reviews = get_many(Review, review_ids, Review.load_options())
+    trails = get_many(Trail, upserted(TRAIL), Trail.load_options(TRAIL_EVENT_FIELDS))
+    # A review is new when its first entry ever is past the cursor
+    first_seq = dict(
+        db.session.query(ChangeLog.entity_id, db.func.min(ChangeLog.seq))
+        .filter(ChangeLog.entity == REVIEW, ChangeLog.entity_id.in_(review_ids))
+        .group_by(ChangeLog.entity_id)
+    ) if review_ids else {}
+
+    events = []
+    for (entity, id), entry in latest.items():
+        if entity == REVIEW:
+            review = reviews.get(id) if entry.op == UPSERT else None
+            if review is None:
+                event = review_event(REVIEW_DELETED, review_id=id)
+            else:
+                event = review_event(REVIEW_CREATED if first_seq.get(id, 0) > cursor else REVIEW_UPDATED, review)
+        else:
+            trail = trails.get(id) if entry.op == UPSERT else None
+            event = trail_event(TRAIL_UPDATED, trail) if trail is not None else trail_event(TRAIL_DELETED, trail_id=id)
+        event['id'] = entry.seq
+        events.append((entry.trail_id, event))
+    return events
+
+
+class TrailEventBroker:
+
+    def __init__(self):
+        self._listeners = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.poller = ChangeLogPoller(self)
+
+    def subscribe(self, trail_id):
+        """A new subscription to trail_id, raises TooManyListeners"""
+        app = current_app._get_current_object()
+        with self._lock:
+            if self._count >= app.config.get('TRAIL_EVENTS_MAX_CONNECTIONS', 24):
+                raise TooManyListeners()
+            subscription = Subscription(trail_id, app.config.get('TRAIL_EVENTS_BUFFER', 100))
+            self._listeners.setdefault(trail_id, set()).add(subscription)
+            self._count += 1
+        if app.config.get('TRAIL_EVENTS_BACKEND', CHANGELOG) == CHANGELOG:
+            self.poller.ensure_running(app)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            listeners = self._listeners.get(subscription.trail_id)
+            if listeners and subscription in listeners:
+                listeners.discard(subscription)
+                self._count -= 1
+                if not listeners:
+                    del self._listeners[subscription.trail_id]
+
+    def watched(self):
+        """Trail ids with at least one listener in this process"""
+        with self._lock:
+            return set(self._listeners)
+
+    def deliver(self, trail_id, event):
+        with self._lock:
+            listeners = list(self._listeners.get(trail_id, ()))
+        for subscription in listeners:
+            subscription.push(event)
+
+    def publish(self, trail_id, build):
+        """
+        Deliver build() to the listeners of trail_id with the local
+        backend. The event is only built when someone listens.
+        """
+        if current_app.config.get('TRAIL_EVENTS_BACKEND', CHANGELOG) != LOCAL:
+            return
+        if trail_id in self.watched():
+            self.deliver(trail_id, build())
+
+    def stream(self, subscription, heartbeat=15):
+        """The text/event-stream body of one subscription"""
+        try:
+            yield 'retry: 5000\n: connected\n\n'
+            while True:
+                events = subscription.wait(heartbeat)
+                if not events:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield ''.join(format_event(event) for event in events)
+        finally:
+            self.unsubscribe(subscription)
+
+    def reset(self):
+        """Forget listeners and the poller (after fork they belong to the parent)"""
+        with self._lock:
+            self._listeners = {}
+            self._count = 0
+        self.poller.reset()
+
+
+broker = TrailEventBroker()
+
+
+def review_changed(change, review):
+    broker.publish(review.trail_id, lambda: review_event(change, review))
+
+
+def review_deleted(trail_id, review_id):
+    broker.publish(trail_id, lambda: review_event(REVIEW_DELETED, review_id=review_id))
+
+
+def review_updated(review_id):
+    """Events for a review updated without the ORM (helpful votes)"""
+    if current_app.config.get('TRAIL_EVENTS_BACKEND', CHANGELOG) != LOCAL or not broker.watched():
+        return
+    review = db.session.get(Review, review_id)
+    if review is not None:
+        review_changed(REVIEW_UPDATED, review)
+
+
+def reviews_created(review_ids):
+    """Events for reviews written without the ORM (bulk ingest)"""
+    if current_app.config.get('TRAIL_EVENTS_BACKEND', CHANGELOG) != LOCAL or not broker.watched():
+        return
+    for review in get_many(Review, review_ids, Review.load_options()).values():
+        review_changed(REVIEW_CREATED, review)
+
+
+def trail_changed(trail_id, deleted=False):
+    if deleted:
+        broker.publish(trail_id, lambda: trail_event(TRAIL_DELETED, trail_id=trail_id))
+    else:
+        broker.publish(trail_id, lambda: trail_event(TRAIL_UPDATED, db.session.get(Trail, trail_id)))
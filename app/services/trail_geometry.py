@@ -0,0 +1,255 @@
+"""
+Validate and clean trail geometries before they are stored.
+
+Client geometries are recorded GPS tracks as often as drawn lines, so the
+coordinates go through a cleanup stage, every step a vectorized NumPy or
+shapely call over the whole track (a 100k vertex track takes a few tens of
+milliseconds, up to about 0.2 s when it has to be simplified):
+
+- the coordinates must be a list of [lon, lat] numbers (extra Z/M values
+  are dropped, the column is 2D) within longitude -180..180 and latitude
+  -90..90; an out of range point is rejected rather than dropped, it is
+  usually a swapped lat/lon pair
+- consecutive points in the same DUPLICATE_METERS grid cell are merged,
+  so a slow or densely sampled stretch keeps a point about every
+  DUPLICATE_METERS instead of losing every sub-threshold step
+- spikes are dropped: a single point at least SPIKE_MIN_METERS and
+  SPIKE_FACTOR times the track's median step away from its neighbours,
+  which themselves lie within SPIKE_RETURN of that distance of each other
+  (the track jumps out and comes straight back, a GPS glitch)
+- tracks over TRAIL_MAX_VERTICES points are simplified (Douglas-Peucker)
+  with the smallest tolerance that makes them fit: doubled from
+  SIMPLIFY_METERS until it does, then bisected down from there
+
+What is left must have two distinct points, a length, no step wrapping
+around the antimeridian and be valid for shapely, or InvalidGeometry is
+raised. Distances are measured in a local metric projection around the
+track, like the track verification does.
+
+`flask trails repair-geometry` runs the same stage over the stored rows
+and clears the placeholder line trails created without a geometry used
+to get.
+"""
+import math
+
+import numpy as np
+import shapely
+from flask import current_app
+from geoalchemy2.shape import from_shape
+
+from app.models import db, Trail
+
+METERS_PER_DEGREE = 111320.0
+DUPLICATE_METERS = 0.5
+SPIKE_MIN_METERS = 25.0
+SPIKE_FACTOR = 5.0
+SPIKE_RETURN = 0.35
+SPIKE_PASSES = 3
+SIMPLIFY_METERS = 1.0
+# Bisection steps between the last tolerance too small and the first that fits
+SIMPLIFY_STEPS = 8
+
+# What trails created without a geometry used to be given
+PLACEHOLDER_COORDINATES = ((0.0, 0.0), (0.001, 0.001))
+
+
+class InvalidGeometry(ValueError):
+    pass
+
+
+def _coordinates(geojson):
+    """(n, 2) float array of lon/lat from a GeoJSON LineString"""
+    if not isinstance(geojson, dict) or geojson.get('type') != 'LineString':
+        raise InvalidGeometry('Geometry must be a LineString')
+    try:
+        coords = np.asarray(geojson.get('coordinates'), dtype=float)
+    except (TypeError, ValueError):
+        raise InvalidGeometry('Coordinates must be a list of [longitude, latitude] numbers')
+    if coords.ndim != 2 or not 2 <= coords.shape[1] <= 4:
+        raise InvalidGeometry('Coordinates must be a list of [longitude, latitude] numbers')
+    return coords[:, :2]
+
+
+def _check_ranges(coords):
+    bad = ~np.isfinite(coords).all(axis=1) \
+        | (np.abs(coords[:, 0]) > 180) | (np.abs(coords[:, 1]) > 90)
+    if bad.any():
+        raise InvalidGeometry(
+            f'Coordinate {int(np.argmax(bad))} is out of range '
+            '(longitude -180 to 180, latitude -90 to 90)'
+        )
+
+
+def _project(coords):
+    """The coordinates in meters around their mean, with the inverse"""
+    origin = coords.mean(axis=0)
+    scale = np.array([METERS_PER_DEGREE * max(math.cos(math.radians(origin[1])), 1e-6), METERS_PER_DEGREE])
+    return (coords - origin) * scale, lambda xy: xy / scale + origin
+
+
+def _drop_duplicates(xy):
+    """Keep mask with one point per run of consecutive points in a grid cell"""
+    cells = np.floor(xy / DUPLICATE_METERS).astype(np.int64)
+    return np.concatenate(([True], (np.diff(cells, axis=0) != 0).any(axis=1)))
+
+
+def _drop_spikes(xy):
+    """Keep mask without the single point spikes of xy"""
+    keep = np.ones(len(xy), dtype=bool)
+    if len(xy) < 3:
+        return keep
+    out = np.hypot(*(xy[1:-1] - xy[:-2]).T)
+    back = np.hypot(*(xy[2:] - xy[1:-1]).T)
+    across = np.hypot(*(xy[2:] - xy[:-2]).T)
+    leg = np.minimum(out, back)
+    typical = np.median(np.hypot(*np.diff(xy, axis=0).T))
+
+    spike = (leg >= SPIKE_MIN_METERS) & (leg >= SPIKE_FACTOR * typical) & (across <= SPIKE_RETURN * leg)
+    # Of two neighbouring candidates only the first goes in a pass, its
+    # removal changes the other's neighbours
+    spike[1:] &= ~spike[:-1]
+    keep[1:-1] = ~spike
+    return keep
+
+
+def _simplify(xy, max_vertices):
+    """xy simplified to at most max_vertices points, with the tolerance used"""
+    track = shapely.linestrings(xy)
+
+    def fits(tolerance):
+        line = shapely.simplify(track, tolerance, preserve_topology=False)
+        return line if shapely.get_num_coordinates(line) <= max_vertices else None
+
+    low, high = 0.0, SIMPLIFY_METERS
+    best = fits(high)
+    while best is None:
+        low, high = high, high * 2
+        best = fits(high)
+
+    if low:
+        for _ in range(SIMPLIFY_STEPS):
+            middle = (low + high) / 2
+            line = fits(middle)
+            if line is None:
+                low = middle
+            else:
+                high, best = middle, line
+    return shapely.get_coordinates(best), high
+
+
+def clean_coordinates(coords, max_vertices):
+    """
+    The cleaned (n, 2) lon/lat array of a track and a report of what the
+    cleanup did. Raises InvalidGeometry
+    """
+    _check_ranges(coords)
+    if len(coords) < 2:
+        raise InvalidGeometry('The geometry needs at least two points')
+    if (np.abs(np.diff(coords[:, 0])) > 180).any():
+        raise InvalidGeometry('The geometry crosses the antimeridian')
+
+    report = {}
+    xy, unproject = _project(coords)
+
+    keep = _drop_duplicates(xy)
+    xy = xy[keep]
+    report['duplicates_removed'] = int((~keep).sum())
+
+    spikes = 0
+    for _ in range(SPIKE_PASSES):
+        keep = _drop_spikes(xy)
+        if keep.all():
+            break
+        xy = xy[keep]
+        spikes += int((~keep).sum())
+    report['spikes_removed'] = spikes
+
+    if len(xy) < 2:
+        raise InvalidGeometry('The geometry needs at least two distinct points')
+
+    report['simplify_meters'] = 0.0
+    if len(xy) > max_vertices:
+        xy, report['simplify_meters'] = _simplify(xy, max_vertices)
+
+    cleaned = unproject(xy)
+    # Untouched points are restored exactly, not through the projection
+    if len(cleaned) == len(coords):
+        cleaned = coords
+    line = shapely.linestrings(cleaned)
+    if not shapely.is_valid(line) or shapely.length(line) == 0:
+        raise InvalidGeometry(f'Invalid geometry: {shapely.is_valid_reason(line)}')
+    return cleaned, report
+
+
+def clean_geometry(geojson, max_vertices=None):
+    """The cleaned shapely LineString of a GeoJSON LineString. Raises InvalidGeometry"""
+    if max_vertices is None:
+        max_vertices = current_app.config.get('TRAIL_MAX_VERTICES', 5000)
+    cleaned, _ = clean_coordinates(_coordinates(geojson), max_vertices)
+    return shapely.linestrings(cleaned)
+
+
+def _is_placeholder(coords):
+    return coords.shape == (2, 2) and np.allclose(coords, PLACEHOLDER_COORDINATES)
+
+
+def repair_geometries(chunk_size=500, dry_run=False):
+    """
+    Run the cleanup over every stored trail geometry a chunk at a time,
+    writing back the ones it changed and clearing placeholder lines.
+    Geometries without a cached polyline are written back as well, which
+    fills the cache encoded responses read. Returns ({checked, repaired,
+    cleared, cached, duplicates, spikes, simplified}, {trail_id: reason}
+    of the geometries it rejects, left as they are)
+    """
+    max_vertices = current_app.config.get('TRAIL_MAX_VERTICES', 5000)
+    counts = dict.fromkeys(('checked', 'repaired', 'cleared', 'cached', 'duplicates', 'spikes', 'simplified'), 0)
+    invalid = {}
+    after = 0
+    while True:
+        rows = db.session.query(Trail.id, Trail.geometry, Trail.geometry_encoded)\
+            .filter(Trail.id > after, Trail.geometry.isnot(None))\
+            .order_by(Trail.id).limit(chunk_size).all()
+        if not rows:
+            break
+        after = rows[-1].id
+
+        lines = shapely.from_wkb([bytes(row.geometry.data) for row in rows])
+        updates = {}
+        for row, line in zip(rows, lines):
+            coords = shapely.get_coordinates(line)
+            if _is_placeholder(coords):
+                updates[row.id] = None
+                continue
+            try:
+                cleaned, report = clean_coordinates(coords, max_vertices)
+            except InvalidGeometry as e:
+                invalid[row.id] = str(e)
+                if row.geometry_encoded is None:
+                    updates[row.id] = line
+                    counts['cached'] += 1
+                continue
+            counts['duplicates'] += report['duplicates_removed']
+            counts['spikes'] += report['spikes_removed']
+            counts['simplified'] += report['simplify_meters'] > 0
+            if cleaned is not coords:
+                updates[row.id] = shapely.linestrings(cleaned)
+                counts['repaired'] += 1
+            elif row.geometry_encoded is None:
+                updates[row.id] = line
+                counts['cached'] += 1
+
+        counts['checked'] += len(rows)
+        counts['cleared'] += sum(1 for line in updates.values() if line is None)
+        if updates and not dry_run:
+            # Through the ORM, so the cached polyline and centroid and the
+            # change log follow
+            for trail in Trail.query.filter(Trail.id.in_(updates)):
+                line = updates[trail.id]
+                trail.geometry = from_shape(line, srid=4326) if line is not None else None
+            db.session.commit()
+        db.session.expunge_all()
+
+        if len(rows) < chunk_size:
+            break
+    return counts, invalid
@@ -0,0 +1,155 @@
+"""
+Result cache for the filtered trail listing.
+
+Most listing traffic asks for a handful of filter combinations. For each
+normalized combination the cache keeps the ordered ids of every matching
+trail, so any page of it is a slice and the total a length, with no COUNT
+query. Pages are hydrated from a second cache of rendered trails, keyed by
+trail and response shape (fields, geometry format); only the trails
+missing from it are loaded, with one query.
+
+A version counter, bumped by every trail write, is part of each id
+list's key, so a created, edited or deleted trail is never missed by the
+lists. A review write only drops its trail's rendered entries (the rating
+changed, the filters did not). This worker's writes apply right away.
+Before each listing, sync reads the change log entries written since it
+last looked (a primary key range, usually empty), so writes made by other
+workers and CLI jobs apply too, once they are SYNC_SETTLE_SECONDS old like
+for the sync API: a transaction committing late could otherwise land
+behind the position already applied. Writes the change log does not see
+(creators' profiles) show up once entries are older than
+TRAIL_CACHE_MAX_AGE seconds. Both caches are LRU bounded
+(TRAIL_QUERY_CACHE_SIZE id lists, TRAIL_OBJECT_CACHE_SIZE trails).
+"""
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+from app.models import ChangeLog
+from app.models.change_log import TRAIL
+
+# More change log entries than this since the last sync drop everything
+SYNC_BATCH = 1000
+
+
+class TrailQueryCache:
+
+    def __init__(self):
+        self._version = 0
+        # Bumped by every invalidation, a load that overlapped one is not kept
+        self._epoch = 0
+        self._results = OrderedDict()
+        self._objects = OrderedDict()
+        # The change log position sync has applied
+        self._seen_seq = None
+        self._lock = threading.Lock()
+
+    def bump(self):
+        """A trail was created, edited or deleted: every id list is stale"""
+        with self._lock:
+            self._version += 1
+            self._epoch += 1
+            self._results.clear()
+
+    def forget(self, trail_id):
+        with self._lock:
+            self._epoch += 1
+            self._objects.pop(trail_id, None)
+
+    def sync(self):
+        """Apply the trail and review writes logged since the last call"""
+        settle = current_app.config.get('SYNC_SETTLE_SECONDS', 0)
+        seen = self._seen_seq
+        if seen is None:
+            # Nothing is cached before the first sync
+            self._advance(ChangeLog.head(settle))
+            return
+
+        rows = ChangeLog.since(seen, SYNC_BATCH + 1, settle)
+        if not rows:
+            return
+        if len(rows) > SYNC_BATCH:
+            with self._lock:
+                self._objects.clear()
+            self.bump()
+            self._advance(ChangeLog.head(settle))
+            return
+
+        if any(row.entity == TRAIL for row in rows):
+            self.bump()
+        for trail_id in {row.trail_id for row in rows}:
+            self.forget(trail_id)
+        self._advance(rows[-1].seq)
+
+    def _advance(self, seq):
+        with self._lock:
+            self._seen_seq = max(self._seen_seq or 0, seq)
+
+    def result_ids(self, filters, load_ids):
+        """The ordered ids matching filters, from load_ids() on a miss"""
+        max_age = current_app.config.get('TRAIL_CACHE_MAX_AGE', 60)
+        now = time.monotonic()
+        with self._lock:
+            key = (self._version, filters)
+            cached = self._results.get(key)
+            if cached is not None and now - cached[1] <= max_age:
+                self._results.move_to_end(key)
+                return cached[0]
+
+        ids = np.fromiter(load_ids(), dtype=np.int64)
+
+        size = current_app.config.get('TRAIL_QUERY_CACHE_SIZE', 256)
+        with self._lock:
+            if key[0] == self._version:
+                self._results[key] = (ids, now)
+                self._results.move_to_end(key)
+                while len(self._results) > size:
+                    self._results.popitem(last=False)
+        return ids
+
+    def hydrate(self, ids, shape, load):
+        """
+        {id: rendered trail} for ids in the response `shape`, rendering the
+        ones not cached with load(missing ids) -> {id: rendered trail}
+        """
+        max_age = current_app.config.get('TRAIL_CACHE_MAX_AGE', 60)
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            epoch = self._epoch
+            for id in ids:
+                cached = self._objects.get(id, {}).get(shape)
+                if cached is not None and now - cached[1] <= max_age:
+                    found[id] = cached[0]
+                    self._objects.move_to_end(id)
+
+        missing = [id for id in ids if id not in found]
+        if not missing:
+            return found
+        loaded = load(missing)
+        found.update(loaded)
+
+        size = current_app.config.get('TRAIL_OBJECT_CACHE_SIZE', 5000)
+        with self._lock:
+            if epoch == self._epoch:
+                for id, rendered in loaded.items():
+                    self._objects.setdefault(id, {})[shape] = (rendered, now)
+                    self._objects.move_to_end(id)
+                while len(self._objects) > size:
+                    self._objects.popitem(last=False)
+        return found
+
+
+listing_cache = TrailQueryCache()
+
+
+def index_trail(trail, deleted=False):
+    listing_cache.bump()
+    listing_cache.forget(trail.id)
+
+
+def index_review(trail_id):
+    listing_cache.forget(trail_id)
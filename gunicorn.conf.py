@@ -0,0 +1,21 @@
+# Gunicorn settings, picked up automatically from the working directory.
+#
+# The app is built once in the master (imports, mapper configuration) and
+# the workers are forked from it, sharing those pages copy-on-write. Each
+# worker then drops the connections and job threads it inherited.
+import os
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threaded workers, so a long-lived event stream (/api/trails/<id>/events)
+# ties up one thread rather than a whole worker. Keep the threads above
+# TRAIL_EVENTS_MAX_CONNECTIONS to leave room for ordinary requests
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def post_fork(server, worker):
+    from app import reset_after_fork
+
+    reset_after_fork(server.app.wsgi())
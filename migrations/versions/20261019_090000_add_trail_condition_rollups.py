@@ -0,0 +1,46 @@
+"""Add trail condition rollups
+
+Revision ID: e35ee38261e0
+Revises: 3e282587f954
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e35ee38261e0'
+down_revision = '3e282587f954'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trail_condition_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('trail_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.String(length=50), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['trail_id'], ['trails.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('trail_id', 'day', 'kind', 'value', name='_trail_day_condition_uc')
+    )
+
+    # Backfill from the reviews that already exist
+    for kind, column in (('weather', 'weather_condition'),
+                         ('trail', 'trail_condition'),
+                         ('crowd', 'crowd_level')):
+        op.execute(f"""
+            INSERT INTO trail_condition_rollups (trail_id, day, kind, value, count)
+            SELECT trail_id, hiked_date, '{kind}', {column}, COUNT(*)
+            FROM reviews
+            WHERE {column} IS NOT NULL
+            GROUP BY trail_id, hiked_date, {column}
+        """)
+
+
+def downgrade():
+    op.drop_table('trail_condition_rollups')
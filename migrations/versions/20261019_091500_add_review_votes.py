@@ -0,0 +1,45 @@
+"""Add review votes
+
+Revision ID: ac88f67729a0
+Revises: e35ee38261e0
+Create Date: 2026-10-19 09:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ac88f67729a0'
+down_revision = 'e35ee38261e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('review_votes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('review_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['review_id'], ['reviews.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('review_id', 'user_id', name='_review_user_vote_uc')
+    )
+    with op.batch_alter_table('review_votes', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_review_votes_user_id'), ['user_id'], unique=False)
+
+    op.execute("UPDATE reviews SET helpful_count = 0 WHERE helpful_count IS NULL")
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_trail_helpful', ['trail_id', 'helpful_count'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_index('ix_reviews_trail_helpful')
+
+    with op.batch_alter_table('review_votes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_review_votes_user_id'))
+
+    op.drop_table('review_votes')
@@ -0,0 +1,45 @@
+"""Add composite indexes for review listing sorts
+
+Revision ID: 0f975ea1ac7c
+Revises: ac88f67729a0
+Create Date: 2026-10-19 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f975ea1ac7c'
+down_revision = 'ac88f67729a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        # One index per filter + sort in get_trail_reviews / get_user_reviews
+        batch_op.create_index('ix_reviews_trail_created', ['trail_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_reviews_trail_rating', ['trail_id', 'rating', 'created_at'], unique=False)
+        batch_op.create_index('ix_reviews_user_created', ['user_id', 'created_at'], unique=False)
+
+        # Extend the helpful index with its created_at tie-breaker
+        batch_op.drop_index('ix_reviews_trail_helpful')
+        batch_op.create_index('ix_reviews_trail_helpful', ['trail_id', 'helpful_count', 'created_at'], unique=False)
+
+        # Single column indexes are now prefixes of the composites above
+        batch_op.drop_index('ix_reviews_trail_id')
+        batch_op.drop_index('ix_reviews_user_id')
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_user_id', ['user_id'], unique=False)
+        batch_op.create_index('ix_reviews_trail_id', ['trail_id'], unique=False)
+
+        batch_op.drop_index('ix_reviews_trail_helpful')
+        batch_op.create_index('ix_reviews_trail_helpful', ['trail_id', 'helpful_count'], unique=False)
+
+        batch_op.drop_index('ix_reviews_user_created')
+        batch_op.drop_index('ix_reviews_trail_rating')
+        batch_op.drop_index('ix_reviews_trail_created')
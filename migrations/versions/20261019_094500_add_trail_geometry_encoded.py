@@ -0,0 +1,59 @@
+"""Add cached encoded polyline to trails
+
+Revision ID: 2ec437cb3ce2
+Revises: 0f975ea1ac7c
+Create Date: 2026-10-19 09:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2ec437cb3ce2'
+down_revision = '0f975ea1ac7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geometry_encoded', sa.Text(), nullable=True))
+
+    # Encoded responses read only the cache, so every row is filled.
+    # PostGIS produces the same Google polyline (precision 5) the app
+    # writes, other databases are encoded here a chunk at a time
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("UPDATE trails SET geometry_encoded = ST_AsEncodedPolyline(geometry, 5)")
+        return
+
+    import shapely
+    from app.models.polyline import encode_polyline
+
+    trails = sa.table('trails', sa.column('id', sa.Integer), sa.column('geometry_encoded', sa.Text))
+    after = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, ST_AsBinary(geometry) AS wkb FROM trails "
+                "WHERE id > :after AND geometry IS NOT NULL ORDER BY id LIMIT 500"
+            ),
+            {'after': after}
+        ).fetchall()
+        if not rows:
+            break
+        after = rows[-1].id
+        lines = shapely.from_wkb([bytes(row.wkb) for row in rows])
+        bind.execute(
+            trails.update().where(trails.c.id == sa.bindparam('trail_id')),
+            [
+                {'trail_id': row.id, 'geometry_encoded': encode_polyline(shapely.get_coordinates(line))}
+                for row, line in zip(rows, lines)
+            ]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.drop_column('geometry_encoded')
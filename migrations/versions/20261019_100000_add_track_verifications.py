@@ -0,0 +1,40 @@
+"""Add track verifications
+
+Revision ID: 353375b7be84
+Revises: 2ec437cb3ce2
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '353375b7be84'
+down_revision = '2ec437cb3ce2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('track_verifications',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('review_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('coverage', sa.Float(), nullable=True),
+    sa.Column('point_count', sa.Integer(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['review_id'], ['reviews.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('track_verifications', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_track_verifications_review_id'), ['review_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('track_verifications', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_track_verifications_review_id'))
+
+    op.drop_table('track_verifications')
@@ -0,0 +1,47 @@
+"""Add change log for the sync API
+
+Revision ID: eccff8c05de6
+Revises: 353375b7be84
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import os
+environment = os.getenv("FLASK_ENV")
+SCHEMA = os.environ.get("SCHEMA")
+
+
+# revision identifiers, used by Alembic.
+revision = 'eccff8c05de6'
+down_revision = '353375b7be84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('trail_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('seq')
+    )
+
+    # Existing rows enter the log once, so a first sync from 0 is complete
+    prefix = f"{SCHEMA}." if environment == "production" else ""
+    op.execute(
+        f"INSERT INTO {prefix}change_log (entity, entity_id, op, trail_id, created_at) "
+        f"SELECT 'trail', id, 'upsert', id, CURRENT_TIMESTAMP FROM {prefix}trails ORDER BY id"
+    )
+    op.execute(
+        f"INSERT INTO {prefix}change_log (entity, entity_id, op, trail_id, created_at) "
+        f"SELECT 'review', id, 'upsert', trail_id, CURRENT_TIMESTAMP FROM {prefix}reviews ORDER BY id"
+    )
+
+
+def downgrade():
+    op.drop_table('change_log')
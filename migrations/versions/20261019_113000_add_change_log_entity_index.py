@@ -0,0 +1,26 @@
+"""Index the change log by entity for per-row history
+
+Revision ID: f7976b8533e6
+Revises: eccff8c05de6
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7976b8533e6'
+down_revision = 'eccff8c05de6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index('ix_change_log_entity', ['entity', 'entity_id', 'seq'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_log_entity')
@@ -0,0 +1,36 @@
+"""Add cached centroids to trails for map clustering
+
+Revision ID: d58f6d252d01
+Revises: f7976b8533e6
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58f6d252d01'
+down_revision = 'f7976b8533e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('centroid_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('centroid_lat', sa.Float(), nullable=True))
+
+    # Other databases fall back to the geometry when the cluster index
+    # is built
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "UPDATE trails SET centroid_lon = ST_X(ST_Centroid(geometry)), "
+            "centroid_lat = ST_Y(ST_Centroid(geometry))"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.drop_column('centroid_lat')
+        batch_op.drop_column('centroid_lon')
@@ -0,0 +1,31 @@
+"""Add a username pattern index for the admin user listing's prefix search
+
+Revision ID: f31617655c51
+Revises: d58f6d252d01
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f31617655c51'
+down_revision = 'd58f6d252d01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        # varchar_pattern_ops serves LIKE 'abc%' under any collation, the
+        # unique index on username only under the C collation
+        batch_op.create_index(
+            'ix_users_username_pattern', ['username'], unique=False,
+            postgresql_ops={'username': 'varchar_pattern_ops'}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_username_pattern')
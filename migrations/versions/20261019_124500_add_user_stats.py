@@ -0,0 +1,58 @@
+"""Add per-user profile counters
+
+Revision ID: 5d276852825f
+Revises: f31617655c51
+Create Date: 2026-10-19 12:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import os
+environment = os.getenv("FLASK_ENV")
+SCHEMA = os.environ.get("SCHEMA")
+
+
+# revision identifiers, used by Alembic.
+revision = '5d276852825f'
+down_revision = 'f31617655c51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('review_count', sa.Integer(), nullable=False),
+    sa.Column('trails_created', sa.Integer(), nullable=False),
+    sa.Column('km_hiked', sa.Float(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Backfill every user with reviews or trails
+    prefix = f"{SCHEMA}." if environment == "production" else ""
+    op.execute(f"""
+        INSERT INTO {prefix}user_stats (user_id, review_count, trails_created, km_hiked, rating_sum, updated_at)
+        SELECT u.id,
+               COALESCE(r.review_count, 0), COALESCE(t.trails_created, 0),
+               COALESCE(r.km_hiked, 0), COALESCE(r.rating_sum, 0), CURRENT_TIMESTAMP
+        FROM {prefix}users u
+        LEFT JOIN (
+            SELECT reviews.user_id, COUNT(*) AS review_count,
+                   SUM(trails.length_km) AS km_hiked, SUM(reviews.rating) AS rating_sum
+            FROM {prefix}reviews reviews JOIN {prefix}trails trails ON trails.id = reviews.trail_id
+            GROUP BY reviews.user_id
+        ) r ON r.user_id = u.id
+        LEFT JOIN (
+            SELECT created_by, COUNT(*) AS trails_created
+            FROM {prefix}trails GROUP BY created_by
+        ) t ON t.created_by = u.id
+        WHERE r.user_id IS NOT NULL OR t.created_by IS NOT NULL
+    """)
+
+
+def downgrade():
+    op.drop_table('user_stats')
@@ -0,0 +1,33 @@
+"""Add trained seasonal condition forecasts per trail
+
+Revision ID: 23d9e98a122c
+Revises: 5d276852825f
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '23d9e98a122c'
+down_revision = '5d276852825f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask forecast train`
+    op.create_table('trail_forecasts',
+    sa.Column('trail_id', sa.Integer(), nullable=False),
+    sa.Column('tables', sa.LargeBinary(), nullable=False),
+    sa.Column('reports', sa.Integer(), nullable=False),
+    sa.Column('trained_seq', sa.Integer(), nullable=False),
+    sa.Column('trained_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['trail_id'], ['trails.id'], ),
+    sa.PrimaryKeyConstraint('trail_id')
+    )
+
+
+def downgrade():
+    op.drop_table('trail_forecasts')
@@ -0,0 +1,46 @@
+"""Make trail geometry nullable and drop the placeholder lines
+
+Revision ID: 9c41e7b2a3d8
+Revises: 65a95b8f787e
+Create Date: 2026-10-19 13:30:00.000000
+
+"""
+from alembic import op
+import geoalchemy2
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c41e7b2a3d8'
+down_revision = '65a95b8f787e'
+branch_labels = None
+depends_on = None
+
+PLACEHOLDER = "ST_GeomFromText('LINESTRING(0 0, 0.001 0.001)', 4326)"
+
+
+def upgrade():
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.alter_column('geometry',
+               existing_type=geoalchemy2.types.Geometry(geometry_type='LINESTRING', srid=4326),
+               nullable=True)
+
+    # Trails created without a geometry were given a placeholder line off
+    # the African coast. Other databases are cleared by
+    # `flask trails repair-geometry`
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "UPDATE trails SET geometry = NULL, geometry_encoded = NULL, "
+            "centroid_lon = NULL, centroid_lat = NULL "
+            f"WHERE ST_Equals(geometry, {PLACEHOLDER})"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(f"UPDATE trails SET geometry = {PLACEHOLDER} WHERE geometry IS NULL")
+
+    with op.batch_alter_table('trails', schema=None) as batch_op:
+        batch_op.alter_column('geometry',
+               existing_type=geoalchemy2.types.Geometry(geometry_type='LINESTRING', srid=4326),
+               nullable=False)